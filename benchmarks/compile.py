@@ -0,0 +1,32 @@
+"""Benchmarks `ICarl._training_step` in eager mode vs compiled by
+`torch.compile`, as enabled in the options by
+`compile: {mode: default, last_batch: drop}`.
+
+The forward & losses are compiled, the backward & optimizer step stay eager.
+The compilation time is excluded by the warm-up steps. On CUDA, the
+"reduce-overhead" mode also captures CUDA graphs. See `benchmarks.training`
+for the model.
+
+Usage:
+    python3 -m benchmarks.compile --device cuda:0 --mode reduce-overhead
+"""
+import torch
+
+from benchmarks import training
+
+
+def main():
+    parser = training.get_parser()
+    parser.add_argument("--mode", default="default", type=str)
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    compile_config = {"mode": args.mode, "last_batch": "drop"}
+    for name, compiled in (("eager", False), ("compiled ({})".format(args.mode), True)):
+        model = training.get_model(device, compile=compile_config if compiled else {})
+        steps_per_sec = 1. / training.time_training_step(model, args)
+        print("{}: {:.2f} steps/s.".format(name, steps_per_sec))
+
+
+if __name__ == "__main__":
+    main()
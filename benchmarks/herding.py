@@ -0,0 +1,65 @@
+"""Benchmarks the iCaRL herding selection: class per class vs all classes at once.
+
+Usage:
+    python3 -m benchmarks.herding --nb-classes 50 100 500 --device cpu
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from inclearn.lib import herding
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-c", "--nb-classes", default=[50, 100, 500], type=int, nargs="+")
+    parser.add_argument("-n", "--nb-samples", default=500, type=int,
+                        help="Number of samples per class.")
+    parser.add_argument("-d", "--features-dim", default=64, type=int)
+    parser.add_argument("-m", "--memory-per-class", default=20, type=int)
+    parser.add_argument("--device", default=None, type=str,
+                        help="Torch device of the batched herding, numpy if not set.")
+    parser.add_argument("-seed", "--seed", default=1, type=int)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    rnd_state = np.random.RandomState(args.seed)
+    device = torch.device(args.device) if args.device else None
+
+    for nb_classes in args.nb_classes:
+        features = [
+            np.abs(rnd_state.randn(args.nb_samples, args.features_dim)).astype(np.float32)
+            for _ in range(nb_classes)
+        ]
+
+        start = time.perf_counter()
+        indexes = [
+            herding.icarl_selection(class_features, args.memory_per_class)
+            for class_features in features
+        ]
+        per_class_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batched_indexes = herding.icarl_selection_batched(
+            features, args.memory_per_class, device=device
+        )
+        if device is not None and device.type == "cuda":
+            torch.cuda.synchronize(device)
+        batched_time = time.perf_counter() - start
+
+        nb_same = sum((a == b).all() for a, b in zip(indexes, batched_indexes))
+        print(
+            "{} classes: per-class {:.4f}s, batched {:.4f}s ({}/{} identical selections)".format(
+                nb_classes, per_class_time, batched_time, nb_same, nb_classes
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Benchmarks the loaders start-up overhead per task, on CIFAR100 with 50 steps.
+
+The time to the first batch of every epoch is measured, with & without the
+persistent workers of the loader config.
+
+Usage:
+    python3 -m benchmarks.loaders --data-path <PATH/TO/DATA> --workers 4
+"""
+import argparse
+import statistics
+import time
+
+from inclearn.lib.data import IncrementalDataset
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--data-path", default="data", type=str)
+    parser.add_argument("-w", "--workers", default=4, type=int)
+    parser.add_argument("-b", "--batch-size", default=128, type=int)
+    parser.add_argument("-e", "--epochs", default=3, type=int,
+                        help="Number of epochs started per task.")
+    parser.add_argument("--max-task", default=None, type=int)
+    parser.add_argument("--prefetch-factor", default=None, type=int)
+    parser.add_argument("--pin-memory", action="store_true", default=False)
+
+    return parser.parse_args()
+
+
+def benchmark(args, persistent_workers):
+    inc_dataset = IncrementalDataset(
+        "cifar100",
+        workers=args.workers,
+        batch_size=args.batch_size,
+        initial_increment=50,
+        increment=1,
+        data_path=args.data_path,
+        dataset_transforms={"color_jitter": True},
+        loader_config={
+            "persistent_workers": persistent_workers,
+            "prefetch_factor": args.prefetch_factor,
+            "pin_memory": args.pin_memory
+        }
+    )
+
+    startup_times = []
+    for _ in range(min(inc_dataset.n_tasks, args.max_task or inc_dataset.n_tasks)):
+        _, train_loader, _, _ = inc_dataset.new_task()
+
+        task_time = 0.
+        for _ in range(args.epochs):
+            start = time.perf_counter()
+            for _ in train_loader:
+                task_time += time.perf_counter() - start
+                break
+        startup_times.append(task_time)
+
+    return startup_times
+
+
+def main():
+    args = parse_args()
+
+    for persistent_workers in (False, True):
+        startup_times = benchmark(args, persistent_workers)
+        print(
+            "Persistent workers {}: {:.3f}s per task ({} epochs), {:.1f}s in total.".format(
+                persistent_workers, statistics.mean(startup_times), args.epochs,
+                sum(startup_times)
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""Benchmarks `ICarl._training_step` with the loss metrics reduced every step,
+as the `.item()` per term did, vs accumulated on device by
+`metrics.RunningMetrics` and only reduced at the epoch end.
+
+Each reduction reads back the sums with the invalid terms flags, i.e. the NaN
+& negative loss check. The progress bar is disabled, as it also triggers
+reductions. The difference only shows on an asynchronous device, i.e. CUDA.
+See `benchmarks.training` for the model.
+
+Usage:
+    python3 -m benchmarks.metrics --device cuda:0
+"""
+import torch
+
+from benchmarks import training
+
+
+def main():
+    args = training.get_parser().parse_args()
+    device = torch.device(args.device)
+
+    for name, reduce_every in (("reduced every step", 1), ("running sums", None)):
+        model = training.get_model(device, metrics_reduce_every=reduce_every)
+        step_time = training.time_training_step(model, args)
+        print("{}: {:.4f}s per step.".format(name, step_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Benchmarks the POD spatial loss: squared maps vs pooled sums of squares.
+
+Peak memory is only reported on CUDA.
+
+Usage:
+    python3 -m benchmarks.pod --device cuda:0
+"""
+import argparse
+import time
+
+import torch
+from torch.nn import functional as F
+
+from inclearn.lib import factory, losses
+
+CONVNETS = {
+    "resnet32": ("rebuffi", {"all_attentions": True}, 32),
+    "resnet18": ("resnet18", {}, 224),
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-c", "--convnets", default=list(CONVNETS.keys()), nargs="+",
+                        choices=list(CONVNETS.keys()))
+    parser.add_argument("-b", "--batch-size", default=128, type=int)
+    parser.add_argument("-n", "--nb-steps", default=10, type=int)
+    parser.add_argument("--device", default="cpu", type=str)
+
+    return parser.parse_args()
+
+
+def legacy_pod(list_attentions_a, list_attentions_b):
+    loss = 0.
+    for a, b in zip(list_attentions_a, list_attentions_b):
+        a, b = torch.pow(a, 2), torch.pow(b, 2)
+
+        a = torch.cat([a.sum(dim=3).view(a.shape[0], -1), a.sum(dim=2).view(a.shape[0], -1)], -1)
+        b = torch.cat([b.sum(dim=3).view(b.shape[0], -1), b.sum(dim=2).view(b.shape[0], -1)], -1)
+
+        a, b = F.normalize(a, dim=1, p=2), F.normalize(b, dim=1, p=2)
+        loss += torch.mean(torch.frobenius_norm(a - b, dim=-1))
+
+    return loss / len(list_attentions_a)
+
+
+def benchmark(student, teacher, inputs, pod_func, nb_steps):
+    device = inputs.device
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+
+    start = time.perf_counter()
+    for _ in range(nb_steps):
+        with torch.no_grad():
+            old_atts = teacher(inputs)["attention"]
+        atts = student(inputs)["attention"]
+
+        loss = pod_func(old_atts, atts)
+        loss.backward()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    step_time = (time.perf_counter() - start) / nb_steps
+
+    peak_memory = torch.cuda.max_memory_allocated(device) if device.type == "cuda" else None
+    return loss.item(), step_time, peak_memory
+
+
+def main():
+    args = parse_args()
+    device = torch.device(args.device)
+
+    for name in args.convnets:
+        convnet_type, convnet_kwargs, size = CONVNETS[name]
+        student = factory.get_convnet(convnet_type, **convnet_kwargs).to(device)
+        teacher = factory.get_convnet(convnet_type, **convnet_kwargs).to(device).eval()
+        inputs = torch.randn(args.batch_size, 3, size, size, device=device)
+
+        for pod_name, pod_func in (("squared maps", legacy_pod), ("pooled sums", losses.pod)):
+            loss, step_time, peak_memory = benchmark(
+                student, teacher, inputs, pod_func, args.nb_steps
+            )
+            print(
+                "{} / {}: loss {:.6f}, {:.3f}s per step, peak memory {}.".format(
+                    name, pod_name, loss, step_time,
+                    "{:.1f}MB".format(peak_memory / 1024**2) if peak_memory else "n/a"
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Benchmarks the merging of the proxies & the negative weights bias of the
+CosineClassifier, vs their former implementation.
+
+The merging is benchmarked on 1000 classes x 10 proxies, as PODNet on
+ImageNet1000, and the bias on 1000 classes + 1000 negative weights, forward &
+backward, from the raw similarities.
+
+Usage:
+    python3 -m benchmarks.proxies --device cuda:0
+"""
+import argparse
+import time
+
+import torch
+from torch.nn import functional as F
+
+from inclearn.lib.network import classifiers
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-b", "--batch-size", default=128, type=int)
+    parser.add_argument("-n", "--nb-steps", default=50, type=int)
+    parser.add_argument("--nb-classes", default=1000, type=int)
+    parser.add_argument("--proxy-per-class", default=10, type=int)
+    parser.add_argument("--device", default="cpu", type=str)
+
+    return parser.parse_args()
+
+
+def former_merge_similarities(classifier, similarities):
+    if classifier.proxy_per_class > 1:
+        simi_per_class = similarities.view(len(similarities), -1, classifier.proxy_per_class)
+        if classifier.merging == "softmax":
+            attentions = F.softmax(classifier.gamma * simi_per_class, dim=-1)
+            return (simi_per_class * attentions).sum(-1)
+        return simi_per_class.max(-1)[0]
+
+    qt = classifier._negative_weights.shape[0]
+    if classifier.negative_weights_bias == "min":
+        bound = similarities[..., :-qt].min(dim=1, keepdim=True)[0]
+    else:
+        bound = similarities[..., :-qt].max(dim=1, keepdim=True)[0] - 1e-6
+    return torch.min(
+        similarities, torch.cat((similarities[..., :-qt], bound.repeat(1, qt)), dim=1)
+    )
+
+
+def benchmark(merge, raw_similarities, nb_steps):
+    def step():
+        # A non-leaf, as the distances, to be modified in place:
+        similarities = merge(raw_similarities * 1.)
+        similarities.pow(2).sum().backward()
+
+    step()  # Warm-up.
+    if raw_similarities.is_cuda:
+        torch.cuda.synchronize(raw_similarities.device)
+
+    start = time.perf_counter()
+    for _ in range(nb_steps):
+        step()
+    if raw_similarities.is_cuda:
+        torch.cuda.synchronize(raw_similarities.device)
+
+    return (time.perf_counter() - start) / nb_steps
+
+
+def main():
+    args = parse_args()
+    device = torch.device(args.device)
+
+    for merging in ("softmax", "max", "min_bias", "max_bias"):
+        if merging.endswith("_bias"):
+            classifier = classifiers.CosineClassifier(
+                16, device, negative_weights_bias=merging.replace("_bias", "")
+            )
+            classifier._negative_weights = torch.zeros(args.nb_classes, 16, device=device)
+            nb_columns = 2 * args.nb_classes
+        else:
+            classifier = classifiers.CosineClassifier(
+                16, device, proxy_per_class=args.proxy_per_class, merging=merging
+            )
+            nb_columns = args.nb_classes * args.proxy_per_class
+
+        raw_similarities = torch.randn(
+            args.batch_size, nb_columns, device=device, requires_grad=True
+        )
+        for name, merge in (
+            ("former", lambda x: former_merge_similarities(classifier, x)),
+            ("fused", classifier._merge_similarities),
+        ):
+            step_time = benchmark(merge, raw_similarities, args.nb_steps)
+            print("{} {}: {:.5f}s per step.".format(merging, name, step_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Benchmarks the IncrementalDataset startup: class order remapping & class index.
+
+Usage:
+    python3 -m benchmarks.startup --nb-samples 1281167 --nb-classes 1000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from inclearn.lib.data import IncrementalDataset
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-n", "--nb-samples", default=1281167, type=int)
+    parser.add_argument("-c", "--nb-classes", default=1000, type=int)
+    parser.add_argument("--skip-legacy", action="store_true", default=False,
+                        help="Skip the (very slow) legacy pure-Python remapping.")
+    parser.add_argument("-seed", "--seed", default=1, type=int)
+
+    return parser.parse_args()
+
+
+def legacy_map_new_class_index(y, order):
+    return np.array(list(map(lambda x: order.index(x), y)))
+
+
+def legacy_select(y, low_range, high_range):
+    return np.where(np.logical_and(y >= low_range, y < high_range))[0]
+
+
+def timeit(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    args = parse_args()
+    rnd_state = np.random.RandomState(args.seed)
+
+    y = rnd_state.randint(0, args.nb_classes, size=args.nb_samples)
+    order = rnd_state.permutation(args.nb_classes).tolist()
+
+    new_y, elapsed = timeit(IncrementalDataset._map_new_class_index, y, order)
+    print("Vectorized remapping: {:.4f}s".format(elapsed))
+    if not args.skip_legacy:
+        legacy_y, elapsed = timeit(legacy_map_new_class_index, y, order)
+        print("Legacy remapping: {:.4f}s".format(elapsed))
+        assert (legacy_y == new_y).all()
+
+    (sorted_indexes, offsets), elapsed = timeit(
+        IncrementalDataset._build_class_index, new_y, args.nb_classes
+    )
+    print("Class index build: {:.4f}s".format(elapsed))
+
+    start = time.perf_counter()
+    for class_index in range(args.nb_classes):
+        sorted_indexes[offsets[class_index]:offsets[class_index + 1]]
+    print("Per-class selection (indexed): {:.4f}s".format(time.perf_counter() - start))
+
+    start = time.perf_counter()
+    for class_index in range(args.nb_classes):
+        legacy_select(new_y, class_index, class_index + 1)
+    print("Per-class selection (full scans): {:.4f}s".format(time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Shared harness of the training step benchmarks.
+
+They time `ICarl._training_step` itself, on PODNet at its second task so
+that the distillations run: a ResNet32 student & teacher, a cosine
+classifier, NCA, and the POD flat & spatial distillations, on random
+CIFAR100-sized inputs. Each benchmark only changes the model options.
+"""
+import argparse
+import time
+
+import torch
+from torch.utils.data import DataLoader
+
+from inclearn import models
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-b", "--batch-size", default=128, type=int)
+    parser.add_argument("-n", "--nb-steps", default=50, type=int)
+    parser.add_argument("--nb-warmup-steps", default=3, type=int)
+    parser.add_argument("--device", default="cpu", type=str)
+
+    return parser
+
+
+class RandomDataset(torch.utils.data.Dataset):
+
+    def __init__(self, nb_samples, nb_classes, nb_old_classes):
+        self.inputs = torch.randn(nb_samples, 3, 32, 32)
+        self.targets = torch.randint(0, nb_classes, (nb_samples,))
+        self.memory_flags = (self.targets < nb_old_classes).float()
+
+    def __len__(self):
+        return len(self.inputs)
+
+    def __getitem__(self, index):
+        return {
+            "inputs": self.inputs[index],
+            "targets": self.targets[index],
+            "memory_flags": self.memory_flags[index]
+        }
+
+
+class TimedLoader:
+    """Yields the batches of a loader, starting the clock once the warm-up
+    batches, e.g. for cudnn's autotuning or the compilation, are trained on.
+    """
+
+    def __init__(self, loader, nb_warmup_steps, device):
+        self.loader = loader
+        self.nb_warmup_steps = nb_warmup_steps
+        self.device = device
+        self.start = None
+
+    @property
+    def dataset(self):
+        return self.loader.dataset
+
+    @property
+    def sampler(self):
+        return self.loader.sampler
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        for i, batch in enumerate(self.loader):
+            if i == self.nb_warmup_steps:
+                synchronize(self.device)
+                self.start = time.perf_counter()
+            yield batch
+
+
+def synchronize(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def get_model(device, **options):
+    """A PODNet on its second task, with the old model of the first.
+
+    :param options: Options overriding those of `podnet_cnn_cifar100.yaml`.
+    """
+    args = {
+        "device": [device],
+        "convnet": "rebuffi",
+        "batch_size": 128,
+        "optimizer": "sgd",
+        "lr": 0.1,
+        "weight_decay": 0.0005,
+        "epochs": 1,
+        "scheduling": "cosine",
+        "lr_decay": 0.1,
+        "memory_size": 2000,
+        "no_progressbar": True,
+        "classifier_config": {
+            "type": "cosine",
+            "proxy_per_class": 10,
+            "distance": "neg_stable_cosine_distance"
+        },
+        "postprocessor_config": {
+            "type": "learned_scaling",
+            "initial_value": 1.0
+        },
+        "pod_flat": {
+            "scheduled_factor": 1.0
+        },
+        "pod_spatial": {
+            "scheduled_factor": 3.0,
+            "collapse_channels": "spatial"
+        },
+        "nca": {
+            "margin": 0.6,
+            "scale": 1.,
+            "exclude_pos_denominator": True
+        },
+        "weight_generation": {
+            "type": "basic"
+        }
+    }
+    args.update(options)
+
+    torch.manual_seed(0)
+    model = models.PODNet(args)
+    model.inc_dataset = None
+    for task in range(2):
+        model.set_task_info(
+            {
+                "task": task,
+                "total_n_classes": 100,
+                "increment": 50,
+                "n_train_data": 0,
+                "n_test_data": 0,
+                "max_task": 2
+            }
+        )
+        model._before_task(None, None)
+        if task == 0:
+            model._after_task(None)
+    model._network.train()
+    return model
+
+
+def time_training_step(model, args):
+    """Times an epoch of `_training_step`, without its warm-up steps.
+
+    :return: The time per step, in seconds.
+    """
+    nb_steps = args.nb_warmup_steps + args.nb_steps
+    loader = TimedLoader(
+        DataLoader(RandomDataset(args.batch_size * nb_steps, 100, 50), batch_size=args.batch_size),
+        args.nb_warmup_steps, model._device
+    )
+
+    model._training_step(loader, None, 0, 1)
+    synchronize(model._device)
+
+    return (time.perf_counter() - loader.start) / args.nb_steps
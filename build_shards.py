@@ -0,0 +1,57 @@
+"""Pre-decodes & resizes ImageNet into one packed shard per split, to be used with the
+`imagenet100shards`, `imagenet100ucirshards`, and `imagenet1000shards` datasets.
+
+Usage:
+    python3 build_shards.py --dataset imagenet100 --data-path <PATH/TO/DATA> --workers 8
+"""
+import argparse
+import os
+
+from inclearn.lib.data import ImageNet100, ImageNet100UCIR, ImageNet1000, build_shards
+
+DATASETS = {
+    "imagenet100": ImageNet100,
+    "imagenet100ucir": ImageNet100UCIR,
+    "imagenet1000": ImageNet1000,
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-d", "--dataset", default="imagenet100", choices=list(DATASETS.keys()))
+    parser.add_argument("--data-path", required=True, type=str)
+    parser.add_argument("--metadata-path", default=None, type=str)
+    parser.add_argument("-s", "--size", default=256, type=int,
+                        help="Size of the shorter side of the resized images.")
+    parser.add_argument("-w", "--workers", default=0, type=int,
+                        help="Number of processes decoding the images.")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    dataset_class = DATASETS[args.dataset]
+    if args.metadata_path:
+        dataset_class.metadata_path = args.metadata_path
+
+    output_path = os.path.join(
+        args.data_path, "shards_{}{}".format(dataset_class.imagenet_size, dataset_class.suffix)
+    )
+    for split, train in (("train", True), ("val", False)):
+        dataset = dataset_class().base_dataset(args.data_path, train=train)
+        build_shards(
+            dataset.data,
+            dataset.targets,
+            output_path,
+            split,
+            size=args.size,
+            workers=args.workers
+        )
+        print("Wrote {} split in {}.".format(split, output_path))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,6 @@
 https://github.com/srebuffi/iCaRL/blob/master/iCaRL-TheanoLasagne/utils_cifar100.py
 """
 import logging
-import random
 
 import torch
 import torch.nn as nn
@@ -50,19 +49,34 @@ class MCBatchNorm2d(nn.Module):
 
         self.eps = 1e-8
         self._mode = "normal"
+        self._nb_samples = 1
+        self._stacked_records = None
 
     def clear_records(self):
         self.recorded_means = []
         self.recorded_vars = []
+        self._stacked_records = None
 
     def record_mode(self):
         self._mode = "record"
 
     def normal_mode(self):
         self._mode = "normal"
+        self._stacked_records = None
 
-    def sampling_mode(self):
+    def sampling_mode(self, nb_samples=1):
+        """Normalizes with recorded statistics, randomly sampled.
+
+        :param nb_samples: The number K of statistics sampled per forward. The
+                           input batch must then be made of K consecutive
+                           chunks, each normalized with its own statistics.
+        """
         self._mode = "sampling"
+        self._nb_samples = nb_samples
+        if self._stacked_records is None and self.recorded_means:
+            self._stacked_records = (
+                torch.stack(self.recorded_means), torch.stack(self.recorded_vars)
+            )
 
     def forward(self, x):
         if self._mode == "normal":
@@ -74,14 +88,18 @@ class MCBatchNorm2d(nn.Module):
 
             return self.bn(x)
 
-        # Sampling mode
-        index = random.randint(0, len(self.recorded_means) - 1)
-        mean = self.recorded_means[index]
-        var = self.recorded_vars[index]
+        # Sampling mode, with one (mean, var) per chunk folded into an affine:
+        means, variances = self._stacked_records
+        indexes = torch.randint(len(means), (self._nb_samples,), device=means.device)
 
-        normed_x = (x -
-                    mean[None, :, None, None]) / (torch.sqrt(var[None, :, None, None] + self.eps))
-        return normed_x * self.bn.weight[None, :, None, None] + self.bn.bias[None, :, None, None]
+        scale = self.bn.weight * torch.rsqrt(variances[indexes] + self.eps)
+        shift = self.bn.bias - means[indexes] * scale
+
+        sampled_x = x.view(self._nb_samples, -1, *x.shape[1:])
+        normed_x = torch.addcmul(
+            shift[:, None, :, None, None], sampled_x, scale[:, None, :, None, None]
+        )
+        return normed_x.view(x.shape)
 
 
 class ResidualBlock(nn.Module):
@@ -382,14 +400,14 @@ class CifarResNet(nn.Module):
                 block.bn_a.normal_mode()
                 block.bn_b.normal_mode()
 
-    def sampling_mode(self):
-        self.bn_1.sampling_mode()
-        self.stage_4.bn_a.sampling_mode()
-        self.stage_4.bn_b.sampling_mode()
+    def sampling_mode(self, nb_samples=1):
+        self.bn_1.sampling_mode(nb_samples)
+        self.stage_4.bn_a.sampling_mode(nb_samples)
+        self.stage_4.bn_b.sampling_mode(nb_samples)
         for stage in [self.stage_1, self.stage_2, self.stage_3]:
             for block in stage.blocks:
-                block.bn_a.sampling_mode()
-                block.bn_b.sampling_mode()
+                block.bn_a.sampling_mode(nb_samples)
+                block.bn_b.sampling_mode(nb_samples)
 
 
 def resnet_rebuffi(n=5, **kwargs):
@@ -1,5 +1,5 @@
 # flake8: noqa
 from . import (
-    calibration, callbacks, data, distance, factory, herding, loops, losses, metrics, network,
-    pooling, results_utils, schedulers, utils, vizualization
+    calibration, callbacks, data, distance, distributed, factory, features, herding, loops,
+    losses, metrics, network, pooling, results_utils, schedulers, teacher, utils, vizualization
 )
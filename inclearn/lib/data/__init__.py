@@ -3,4 +3,6 @@ from .datasets import *
 from .download import *
 from .incdataset import *
 from .samplers import *
+from .shards import *
+from .store import *
 from .weights import *
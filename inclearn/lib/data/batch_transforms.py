@@ -0,0 +1,106 @@
+"""Data augmentations applied on whole batches, on the training device.
+
+Counterparts of the torchvision transformations, taking float batches of shape
+(B, C, H, W) in [0, 1] and drawing random parameters per sample. They rely on
+the global torch RNG of the batch device, thus are determinist once seeded.
+"""
+import torch
+import torch.nn.functional as F
+
+
+class Compose:
+
+    def __init__(self, transforms):
+        self.transforms = transforms
+
+    def __call__(self, x):
+        for transform in self.transforms:
+            x = transform(x)
+        return x
+
+
+class RandomCrop:
+
+    def __init__(self, size, padding=0):
+        self.size = size
+        self.padding = padding
+
+    def __call__(self, x):
+        if self.padding > 0:
+            x = F.pad(x, (self.padding,) * 4)
+
+        batch_size, _, h, w = x.shape
+        top = torch.randint(0, h - self.size + 1, (batch_size,), device=x.device)
+        left = torch.randint(0, w - self.size + 1, (batch_size,), device=x.device)
+
+        rows = top[:, None] + torch.arange(self.size, device=x.device)
+        cols = left[:, None] + torch.arange(self.size, device=x.device)
+        batch_indexes = torch.arange(batch_size, device=x.device)[:, None, None]
+
+        # (B, size, size, C) -> (B, C, size, size)
+        return x.permute(0, 2, 3, 1)[batch_indexes, rows[:, :, None],
+                                     cols[:, None, :]].permute(0, 3, 1, 2).contiguous()
+
+
+class RandomHorizontalFlip:
+
+    def __init__(self, p=0.5):
+        self.p = p
+
+    def __call__(self, x):
+        flipped = torch.rand(x.shape[0], device=x.device) < self.p
+        return torch.where(flipped[:, None, None, None], x.flip(-1), x)
+
+
+class ColorJitter:
+    """Only brightness is jittered, as in the datasets transformations."""
+
+    def __init__(self, brightness=0.):
+        self.brightness = brightness
+
+    def __call__(self, x):
+        low, high = max(0., 1. - self.brightness), 1. + self.brightness
+        factors = low + (high - low) * torch.rand(x.shape[0], device=x.device, dtype=x.dtype)
+        return (x * factors[:, None, None, None]).clamp_(0., 1.)
+
+
+class Normalize:
+
+    def __init__(self, mean, std):
+        self.mean = mean
+        self.std = std
+
+    def __call__(self, x):
+        mean = torch.tensor(self.mean, device=x.device, dtype=x.dtype)[None, :, None, None]
+        std = torch.tensor(self.std, device=x.device, dtype=x.dtype)[None, :, None, None]
+        return (x - mean) / std
+
+
+class BatchTransformLoader:
+    """Wraps a loader of uint8 images, and transforms its batches on a device.
+
+    Every other attribute (`dataset`, `sampler`, ...) is the wrapped loader's.
+
+    :param loader: A DataLoader whose "inputs" are uint8 tensors (B, C, H, W).
+    :param transforms: A list of batch transformations.
+    :param device: The device where the batches are transformed.
+    """
+
+    def __init__(self, loader, transforms, device):
+        self.loader = loader
+        self.transform = Compose(transforms)
+        self.device = device
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __getattr__(self, name):
+        if name == "loader":  # Not yet set, e.g. while unpickling.
+            raise AttributeError(name)
+        return getattr(self.loader, name)
+
+    def __iter__(self):
+        for input_dict in self.loader:
+            inputs = input_dict["inputs"].to(self.device, non_blocking=True)
+            input_dict["inputs"] = self.transform(inputs.float().div_(255.))
+            yield input_dict
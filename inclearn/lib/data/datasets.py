@@ -8,6 +8,9 @@ import warnings
 import numpy as np
 from torchvision import datasets, transforms
 
+from . import batch_transforms
+from .shards import ShardStore
+
 logger = logging.getLogger(__name__)
 
 
@@ -19,10 +22,22 @@ class DataHandler:
     class_order = None
     open_image = False
 
+    # Alternative train pipeline, enabled with the `batch_augmentations` option:
+    # the per-sample transforms are applied by the loader workers, and the batch
+    # transforms on the uint8 batches on the training device.
+    batch_sample_transforms = []
+    batch_train_transforms = None
+
     def set_custom_transforms(self, transforms):
         if transforms:
             raise NotImplementedError("Not implemented for modified transforms.")
 
+    def _remove_batch_color_jitter(self):
+        self.batch_train_transforms = [
+            t for t in self.batch_train_transforms
+            if not isinstance(t, batch_transforms.ColorJitter)
+        ]
+
 
 class iCIFAR10(DataHandler):
     base_dataset = datasets.cifar.CIFAR10
@@ -35,11 +50,18 @@ class iCIFAR10(DataHandler):
         transforms.ToTensor(),
         transforms.Normalize((0.4914, 0.4822, 0.4465), (0.2023, 0.1994, 0.2010))
     ]
+    batch_train_transforms = [
+        batch_transforms.RandomCrop(32, padding=4),
+        batch_transforms.RandomHorizontalFlip(),
+        batch_transforms.ColorJitter(brightness=63 / 255),
+        batch_transforms.Normalize((0.4914, 0.4822, 0.4465), (0.2023, 0.1994, 0.2010))
+    ]
 
     def set_custom_transforms(self, transforms):
         if not transforms.get("color_jitter"):
             logger.info("Not using color jitter.")
             self.train_transforms.pop(-1)
+            self._remove_batch_color_jitter()
 
 
 class iCIFAR100(iCIFAR10):
@@ -48,6 +70,12 @@ class iCIFAR100(iCIFAR10):
         transforms.ToTensor(),
         transforms.Normalize((0.5071, 0.4867, 0.4408), (0.2675, 0.2565, 0.2761)),
     ]
+    batch_train_transforms = [
+        batch_transforms.RandomCrop(32, padding=4),
+        batch_transforms.RandomHorizontalFlip(),
+        batch_transforms.ColorJitter(brightness=63 / 255),
+        batch_transforms.Normalize((0.5071, 0.4867, 0.4408), (0.2675, 0.2565, 0.2761))
+    ]
     class_order = [  # Taken from original iCaRL implementation:
         87, 0, 52, 58, 44, 91, 68, 97, 51, 15, 94, 92, 10, 72, 49, 78, 61, 14, 8, 86, 84, 96, 18,
         24, 32, 45, 88, 11, 4, 67, 69, 66, 77, 47, 79, 93, 29, 50, 57, 83, 17, 81, 41, 12, 37, 59,
@@ -90,6 +118,13 @@ class ImageNet100(DataHandler):
         transforms.ToTensor(),
         transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
     ]
+    # Images have various sizes, thus must be cropped before being batched:
+    batch_sample_transforms = [transforms.RandomResizedCrop(224)]
+    batch_train_transforms = [
+        batch_transforms.RandomHorizontalFlip(),
+        batch_transforms.ColorJitter(brightness=63 / 255),
+        batch_transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+    ]
 
     imagenet_size = 100
     open_image = True
@@ -100,6 +135,7 @@ class ImageNet100(DataHandler):
         if not transforms.get("color_jitter"):
             logger.info("Not using color jitter.")
             self.train_transforms.pop(-1)
+            self._remove_batch_color_jitter()
 
     def base_dataset(self, data_path, train=True, download=False):
         if download:
@@ -137,6 +173,35 @@ class ImageNet1000(ImageNet100):
     imagenet_size = 1000
 
 
+class ImageNet100Shards(ImageNet100):
+    """ImageNet read from the pre-decoded & resized shards of `build_shards.py`.
+
+    Data are indexes into `self.store`, which covers both train & val splits.
+    """
+    open_image = False
+
+    def base_dataset(self, data_path, train=True, download=False):
+        shards_path = os.path.join(
+            data_path, "shards_{}{}".format(self.imagenet_size, self.suffix)
+        )
+        split = "train" if train else "val"
+
+        print("Loading shards of ImageNet_{} ({} split).".format(self.imagenet_size, split))
+        self.store = ShardStore(shards_path)
+        self.data = self.store.split_indexes(split)
+        self.targets = self.store.split_targets(split)
+
+        return self
+
+
+class ImageNet100UCIRShards(ImageNet100Shards):
+    suffix = "_ucir"
+
+
+class ImageNet1000Shards(ImageNet100Shards):
+    imagenet_size = 1000
+
+
 class TinyImageNet200(DataHandler):
     train_transforms = [
         transforms.RandomCrop(64),
@@ -4,13 +4,18 @@ import random
 import numpy as np
 import torch
 from PIL import Image
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, DistributedSampler
 from torchvision import transforms
 
+from inclearn.lib import distributed
+
+from .batch_transforms import BatchTransformLoader
 from .datasets import (
-    APY, CUB200, LAD, AwA2, ImageNet100, ImageNet100UCIR, ImageNet1000, TinyImageNet200, iCIFAR10,
-    iCIFAR100
+    APY, CUB200, LAD, AwA2, ImageNet100, ImageNet100Shards, ImageNet100UCIR, ImageNet100UCIRShards,
+    ImageNet1000, ImageNet1000Shards, TinyImageNet200, iCIFAR10, iCIFAR100
 )
+from .samplers import AugmentationSeedSampler
+from .store import ImageStore
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +38,20 @@ class IncrementalDataset:
     :param initial_increment: Initial increment may be defined if you want to train
                               on more classes than usual for the first task, like
                               UCIR does.
+    :param image_store_path: Directory of the memory-mapped image store of
+                             in-RAM datasets (e.g. CIFAR), disabled if null.
+                             Data are then indexes into `self.image_store`.
+    :param device: Device where the train batches are augmented, if the
+                   `batch_augmentations` dataset transforms option is set.
+    :param loader_config: Settings of the loaders with workers: `persistent_workers`
+                          for the loaders iterated several times, `pin_memory`
+                          (default true on CUDA), and `prefetch_factor`. The
+                          first and last need torch >= 1.7.
+    :param nb_augmentation_slots: If set, train loaders augment each sample with
+                                  one of this number of fixed seeds, changing
+                                  every epoch, as needed by the teacher cache.
+    :param eval_every_x_epochs: If set, the test loader is also iterated during
+                                training, and its workers are kept alive.
     """
 
     def __init__(
@@ -53,13 +72,23 @@ class IncrementalDataset:
         class_order=None,
         dataset_transforms=None,
         all_test_classes=False,
-        metadata_path=None
+        metadata_path=None,
+        image_store_path=None,
+        device=None,
+        loader_config=None,
+        nb_augmentation_slots=None,
+        eval_every_x_epochs=None
     ):
         datasets = _get_datasets(dataset_name)
         if metadata_path:
             print("Adding metadata path {}".format(metadata_path))
             datasets[0].metadata_path = metadata_path
 
+        if image_store_path and any(dataset.open_image for dataset in datasets):
+            logger.warning("Image store is only available for in-RAM datasets, disabling it.")
+            image_store_path = None
+        self.image_store = ImageStore(image_store_path) if image_store_path else None
+
         self._setup_data(
             datasets,
             random_order=random_order,
@@ -76,6 +105,19 @@ class IncrementalDataset:
         self.train_transforms = dataset.train_transforms  # FIXME handle multiple datasets
         self.test_transforms = dataset.test_transforms
         self.common_transforms = dataset.common_transforms
+        if dataset_transforms and dataset_transforms.get("batch_augmentations"):
+            if dataset.batch_train_transforms is None:
+                raise NotImplementedError(
+                    "No batch augmentations for dataset {}.".format(dataset_name)
+                )
+            logger.info("Augmenting train batches on {}.".format(device))
+            self.batch_sample_transforms = dataset.batch_sample_transforms
+            self.batch_train_transforms = dataset.batch_train_transforms
+        else:
+            self.batch_sample_transforms, self.batch_train_transforms = None, None
+        self._device = device or torch.device("cpu")
+        self._loader_config = loader_config or {}
+        self._nb_augmentation_slots = nb_augmentation_slots
 
         self.open_image = datasets[0].open_image
 
@@ -89,6 +131,7 @@ class IncrementalDataset:
         self._sampler = sampler
         self._sampler_config = sampler_config
         self._all_test_classes = all_test_classes
+        self._eval_every_x_epochs = eval_every_x_epochs
 
     @property
     def n_tasks(self):
@@ -105,26 +148,20 @@ class IncrementalDataset:
         min_class = sum(self.increments[:self._current_task])
         max_class = sum(self.increments[:self._current_task + 1])
 
-        x_train, y_train = self._select(
-            self.data_train, self.targets_train, low_range=min_class, high_range=max_class
-        )
+        x_train, y_train = self._select("train", low_range=min_class, high_range=max_class)
         nb_new_classes = len(np.unique(y_train))
-        x_val, y_val = self._select(
-            self.data_val, self.targets_val, low_range=min_class, high_range=max_class
-        )
+        x_val, y_val = self._select("val", low_range=min_class, high_range=max_class)
         if self._all_test_classes is True:
             logger.info("Testing on all classes!")
-            x_test, y_test = self._select(
-                self.data_test, self.targets_test, high_range=sum(self.increments)
-            )
+            x_test, y_test = self._select("test", high_range=sum(self.increments))
         elif self._all_test_classes is not None or self._all_test_classes is not False:
             max_class = sum(self.increments[:self._current_task + 1 + self._all_test_classes])
             logger.info(
                 f"Testing on {self._all_test_classes} unseen tasks (max class = {max_class})."
             )
-            x_test, y_test = self._select(self.data_test, self.targets_test, high_range=max_class)
+            x_test, y_test = self._select("test", high_range=max_class)
         else:
-            x_test, y_test = self._select(self.data_test, self.targets_test, high_range=max_class)
+            x_test, y_test = self._select("test", high_range=max_class)
 
         if self._onehot:
 
@@ -145,10 +182,20 @@ class IncrementalDataset:
         else:
             val_memory_flags = np.zeros((x_val.shape[0],))
 
-        train_loader = self._get_loader(x_train, y_train, train_memory_flags, mode="train")
-        val_loader = self._get_loader(x_val, y_val, val_memory_flags,
-                                      mode="train") if len(x_val) > 0 else None
-        test_loader = self._get_loader(x_test, y_test, np.zeros((x_test.shape[0],)), mode="test")
+        # Those loaders are iterated every epoch, their workers are kept alive:
+        train_loader = self._get_loader(
+            x_train, y_train, train_memory_flags, mode="train", persistent=True
+        )
+        val_loader = self._get_loader(
+            x_val, y_val, val_memory_flags, mode="train", persistent=True
+        ) if len(x_val) > 0 else None
+        test_loader = self._get_loader(
+            x_test,
+            y_test,
+            np.zeros((x_test.shape[0],)),
+            mode="test",
+            persistent=bool(self._eval_every_x_epochs)
+        )
 
         task_info = {
             "min_class": min_class,
@@ -195,28 +242,20 @@ class IncrementalDataset:
         if not isinstance(class_indexes, list):  # TODO: deprecated, should always give a list
             class_indexes = [class_indexes]
 
-        if data_source == "train":
-            x, y = self.data_train, self.targets_train
-        elif data_source == "val":
-            x, y = self.data_val, self.targets_val
-        elif data_source == "test":
-            x, y = self.data_test, self.targets_test
-        else:
-            raise ValueError("Unknown data source <{}>.".format(data_source))
-
-        data, targets = [], []
-        for class_index in class_indexes:
-            class_data, class_targets = self._select(
-                x, y, low_range=class_index, high_range=class_index + 1
-            )
-            data.append(class_data)
-            targets.append(class_targets)
+        x, y = self._get_split(data_source)
 
-        if len(data) == 0:
+        if len(class_indexes) == 0:
             assert memory is not None
+            data, targets = [], []
         else:
-            data = np.concatenate(data)
-            targets = np.concatenate(targets)
+            idxes = np.concatenate(
+                [
+                    self._select_indexes(
+                        data_source, low_range=class_index, high_range=class_index + 1
+                    ) for class_index in class_indexes
+                ]
+            )
+            data, targets = x[idxes], y[idxes]
 
         if (not isinstance(memory, tuple) and
             memory is not None) or (isinstance(memory, tuple) and memory[0] is not None):
@@ -232,17 +271,64 @@ class IncrementalDataset:
             data, targets, memory_flags, shuffle=False, mode=mode, sampler=sampler
         )
 
+    def get_class_data(self, class_index, data_source="train"):
+        """Returns the raw data & targets of a class, in the same order as
+        `get_custom_loader`.
+        """
+        return self._select(data_source, low_range=class_index, high_range=class_index + 1)
+
+    def get_class_indexes(self, class_index, data_source="train"):
+        """Returns the indexes in their split of the samples of a class, in the
+        same order as `get_custom_loader`.
+        """
+        return self._select_indexes(data_source, low_range=class_index, high_range=class_index + 1)
+
     def get_memory_loader(self, data, targets):
         return self._get_loader(
-            data, targets, np.ones((data.shape[0],)), shuffle=True, mode="train"
+            data, targets, np.ones((data.shape[0],)), shuffle=True, mode="train", persistent=True
         )
 
-    def _select(self, x, y, low_range=0, high_range=0):
-        idxes = np.where(np.logical_and(y >= low_range, y < high_range))[0]
+    def _get_split(self, data_source):
+        if data_source == "train":
+            return self.data_train, self.targets_train
+        elif data_source == "val":
+            return self.data_val, self.targets_val
+        elif data_source == "test":
+            return self.data_test, self.targets_test
+        raise ValueError("Unknown data source <{}>.".format(data_source))
+
+    def _select_indexes(self, data_source, low_range=0, high_range=0):
+        """Returns the indexes of a split whose targets are in [low_range, high_range[.
+
+        Uses the class index built once in `_setup_data`, thus the cost only
+        depends on the number of selected samples, not on the split size.
+        """
+        sorted_indexes, offsets = self._class_indexes[data_source]
+        nb_classes = len(offsets) - 1
+
+        low_range = min(max(low_range, 0), nb_classes)
+        high_range = min(max(high_range, low_range), nb_classes)
+
+        idxes = sorted_indexes[offsets[low_range]:offsets[high_range]]
+        if high_range - low_range > 1:
+            # Keep the samples in their original order, as a full scan would.
+            idxes = np.sort(idxes)
+        return idxes
+
+    def _select(self, data_source, low_range=0, high_range=0):
+        x, y = self._get_split(data_source)
+        idxes = self._select_indexes(data_source, low_range=low_range, high_range=high_range)
         return x[idxes], y[idxes]
 
-    def _get_loader(self, x, y, memory_flags, shuffle=True, mode="train", sampler=None):
-        if mode == "train":
+    def _get_loader(
+        self, x, y, memory_flags, shuffle=True, mode="train", sampler=None, persistent=False
+    ):
+        batch_augmentations = mode == "train" and self.batch_train_transforms is not None
+
+        if batch_augmentations:
+            # Workers only return uint8 images, augmented later as whole batches:
+            trsf = transforms.Compose([*self.batch_sample_transforms, transforms.PILToTensor()])
+        elif mode == "train":
             trsf = transforms.Compose([*self.train_transforms, *self.common_transforms])
         elif mode == "test":
             trsf = transforms.Compose([*self.test_transforms, *self.common_transforms])
@@ -253,26 +339,91 @@ class IncrementalDataset:
                     *self.common_transforms
                 ]
             )
+        elif mode == "test_flip":
+            # Each image is decoded once, and returned both as is and flipped.
+            trsf = transforms.Compose([*self.test_transforms, *self.common_transforms])
         else:
             raise NotImplementedError("Unknown mode {}.".format(mode))
 
         sampler = sampler or self._sampler
         if sampler is not None and mode == "train":
+            if distributed.is_enabled():
+                # Every process would sample the same batches, and DDP average
+                # identical gradients:
+                raise ValueError(
+                    "Sampler {} is not sharded, it can't be used with distributed"
+                    " training.".format(sampler)
+                )
             logger.info("Using sampler {}".format(sampler))
             sampler = sampler(y, memory_flags, batch_size=self._batch_size, **self._sampler_config)
             batch_size = 1
+        elif self._nb_augmentation_slots and mode == "train" and not batch_augmentations:
+            sampler = AugmentationSeedSampler(
+                y,
+                memory_flags,
+                batch_size=self._batch_size,
+                nb_slots=self._nb_augmentation_slots,
+                shuffle=shuffle,
+                rank=distributed.get_rank(),
+                world_size=distributed.get_world_size(),
+                seed=self._seed
+            )
+            batch_size = 1
         else:
             sampler = None
             batch_size = self._batch_size
 
-        return DataLoader(
-            DummyDataset(x, y, memory_flags, trsf, open_image=self.open_image),
+        dataset = DummyDataset(
+            x,
+            y,
+            memory_flags,
+            trsf,
+            open_image=self.open_image,
+            return_flipped=mode == "test_flip",
+            store=self.image_store
+        )
+        if sampler is None and mode == "train" and distributed.is_enabled():
+            # Each process trains on its shard:
+            shard_sampler = DistributedSampler(dataset, shuffle=shuffle, seed=self._seed)
+            shuffle = False
+        else:
+            shard_sampler = None
+
+        loader = self._make_loader(
+            dataset,
+            persistent=persistent,
             batch_size=batch_size,
             shuffle=shuffle if sampler is None else False,
-            num_workers=self._workers,
+            sampler=shard_sampler,
             batch_sampler=sampler
         )
 
+        if batch_augmentations:
+            return BatchTransformLoader(loader, self.batch_train_transforms, self._device)
+        return loader
+
+    def _make_loader(self, dataset, persistent=False, **kwargs):
+        """Loader factory, applying the loader config to all loaders.
+
+        :param dataset: The dataset to load.
+        :param persistent: Whether the loader will be iterated several times,
+                           thus its workers are worth keeping alive.
+        :return: A DataLoader.
+        """
+        # Only passed when set, as DataLoader takes them from torch 1.7:
+        if self._workers > 0:
+            if persistent and self._loader_config.get("persistent_workers"):
+                kwargs["persistent_workers"] = True
+            if self._loader_config.get("prefetch_factor"):
+                kwargs["prefetch_factor"] = self._loader_config["prefetch_factor"]
+
+        return DataLoader(
+            dataset,
+            num_workers=self._workers,
+            pin_memory=self._loader_config.get("pin_memory", self._device.type == "cuda"),
+            **kwargs
+        )
+
     def _setup_data(
         self,
         datasets,
@@ -297,10 +448,19 @@ class IncrementalDataset:
             test_dataset = dataset().base_dataset(data_path, train=False, download=True)
 
             x_train, y_train = train_dataset.data, np.array(train_dataset.targets)
+            x_test, y_test = test_dataset.data, np.array(test_dataset.targets)
+            if getattr(train_dataset, "store", None) is not None:
+                # Data are already indexes into the dataset own store:
+                if len(datasets) > 1 or self.image_store is not None:
+                    raise NotImplementedError("Dataset with a store must be used alone.")
+                self.image_store = train_dataset.store
+            elif self.image_store is not None:
+                x_train = self.image_store.add("{}_train".format(dataset.__name__), x_train)
+                x_test = self.image_store.add("{}_test".format(dataset.__name__), x_test)
+
             x_val, y_val, x_train, y_train = self._split_per_class(
                 x_train, y_train, validation_split
             )
-            x_test, y_test = test_dataset.data, np.array(test_dataset.targets)
 
             order = list(range(len(np.unique(y_train))))
             if random_order:
@@ -368,10 +528,48 @@ class IncrementalDataset:
         self.data_test = np.concatenate(self.data_test)
         self.targets_test = np.concatenate(self.targets_test)
 
+        self._class_indexes = {
+            "train": self._build_class_index(self.targets_train, current_class_idx),
+            "val": self._build_class_index(self.targets_val, current_class_idx),
+            "test": self._build_class_index(self.targets_test, current_class_idx)
+        }
+
+    @staticmethod
+    def _build_class_index(y, nb_classes):
+        """Builds a CSR-like class -> sample indexes table.
+
+        Indexes of class `c` are `sorted_indexes[offsets[c]:offsets[c + 1]]`,
+        in ascending order thanks to the stable sort.
+
+        :param y: The targets of a split.
+        :param nb_classes: Total number of classes among all datasets.
+        :return: A tuple of (sorted_indexes, offsets).
+        """
+        sorted_indexes = np.argsort(y, kind="stable")
+        offsets = np.searchsorted(y[sorted_indexes], np.arange(nb_classes + 1), side="left")
+        return sorted_indexes, offsets
+
     @staticmethod
     def _map_new_class_index(y, order):
-        """Transforms targets for new class order."""
-        return np.array(list(map(lambda x: order.index(x), y)))
+        """Transforms targets for new class order.
+
+        The target `x` is mapped to `order.index(x)`, through an inverse
+        permutation lookup table applied with a single fancy-indexing.
+        """
+        order = np.asarray(order, dtype=np.int64)
+        y = np.asarray(y, dtype=np.int64)
+        if len(y) == 0:
+            return y
+
+        inverse_order = np.full((max(order.max(), y.max()) + 1,), -1, dtype=np.int64)
+        inverse_order[order[::-1]] = np.arange(len(order) - 1, -1, -1)  # First occurrence wins.
+
+        new_y = inverse_order[y]
+        if (new_y < 0).any():
+            raise ValueError(
+                "Targets {} are not in class order.".format(np.unique(y[new_y < 0]).tolist())
+            )
+        return new_y
 
     @staticmethod
     def _split_per_class(x, y, validation_split=0.):
@@ -405,11 +603,15 @@ class IncrementalDataset:
 
 class DummyDataset(torch.utils.data.Dataset):
 
-    def __init__(self, x, y, memory_flags, trsf, open_image=False):
+    def __init__(
+        self, x, y, memory_flags, trsf, open_image=False, return_flipped=False, store=None
+    ):
         self.x, self.y = x, y
         self.memory_flags = memory_flags
         self.trsf = trsf
         self.open_image = open_image
+        self.return_flipped = return_flipped
+        self.store = store
 
         assert x.shape[0] == y.shape[0] == memory_flags.shape[0]
 
@@ -417,14 +619,40 @@ class DummyDataset(torch.utils.data.Dataset):
         return self.x.shape[0]
 
     def __getitem__(self, idx):
+        aug_slot = None
+        if isinstance(idx, tuple):  # See `AugmentationSeedSampler`.
+            idx, aug_slot, aug_seed = idx
+
         x, y = self.x[idx], self.y[idx]
         memory_flag = self.memory_flags[idx]
 
         if self.open_image:
             img = Image.open(x).convert("RGB")
+        elif self.store is not None:
+            img = Image.fromarray(self.store[x])
         else:
             img = Image.fromarray(x.astype("uint8"))
 
+        if self.return_flipped:
+            return {
+                "inputs": self.trsf(img),
+                "inputs_flipped": self.trsf(img.transpose(Image.FLIP_LEFT_RIGHT)),
+                "targets": y,
+                "memory_flags": memory_flag
+            }
+
+        if aug_slot is not None:
+            with torch.random.fork_rng(devices=[]):
+                torch.manual_seed(aug_seed + idx)
+                img = self.trsf(img)
+            return {
+                "inputs": img,
+                "targets": y,
+                "memory_flags": memory_flag,
+                "indexes": idx,
+                "aug_slots": aug_slot
+            }
+
         img = self.trsf(img)
         return {"inputs": img, "targets": y, "memory_flags": memory_flag}
 
@@ -446,6 +674,12 @@ def _get_dataset(dataset_name):
         return ImageNet100UCIR
     elif dataset_name == "imagenet1000":
         return ImageNet1000
+    elif dataset_name == "imagenet100shards":
+        return ImageNet100Shards
+    elif dataset_name == "imagenet100ucirshards":
+        return ImageNet100UCIRShards
+    elif dataset_name == "imagenet1000shards":
+        return ImageNet1000Shards
     elif dataset_name == "tinyimagenet":
         return TinyImageNet200
     elif dataset_name == "awa2":
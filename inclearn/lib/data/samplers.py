@@ -44,6 +44,70 @@ class MemoryOverSampler(BatchSampler):
         return np.mean(np.bincount(y))
 
 
+class AugmentationSeedSampler(BatchSampler):
+    """Samples batches of (index, augmentation slot, seed) for determinist augmentations.
+
+    Every epoch uses the next of `nb_slots` augmentation slots, and each slot
+    has its own seed, drawn once from the numpy RNG. A sample is thus
+    augmented the same way every `nb_slots` epochs, which allows caching the
+    teacher outputs (see `inclearn.lib.teacher`).
+
+    With distributed training (`world_size` > 1), every process shuffles with
+    the same `seed` and keeps its shard of the samples, padded as
+    `DistributedSampler` does so that all processes have the same number of
+    batches.
+    """
+
+    def __init__(
+        self,
+        y,
+        memory_flags,
+        batch_size=128,
+        nb_slots=1,
+        shuffle=True,
+        rank=0,
+        world_size=1,
+        seed=0,
+        **kwargs
+    ):
+        self.nb_samples = len(y)
+        self.batch_size = batch_size
+        self.nb_slots = nb_slots
+        self.shuffle = shuffle
+        self.rank = rank
+        self.world_size = world_size
+        self.seed = seed
+
+        self.nb_shard_samples = int(np.ceil(self.nb_samples / world_size))
+        self.seeds = np.random.randint(0, 2**31 - len(y), size=nb_slots)
+        self._epoch = 0
+
+    def __len__(self):
+        return int(np.ceil(self.nb_shard_samples / self.batch_size))
+
+    def __iter__(self):
+        slot = self._epoch % self.nb_slots
+        self._epoch += 1
+
+        if self.shuffle and self.world_size > 1:
+            # The same permutation on all processes, whatever their global RNG:
+            indexes = np.random.RandomState(self.seed + self._epoch).permutation(self.nb_samples)
+        elif self.shuffle:
+            indexes = np.random.permutation(self.nb_samples)
+        else:
+            indexes = np.arange(self.nb_samples)
+
+        if self.world_size > 1:
+            indexes = np.resize(indexes, self.nb_shard_samples * self.world_size)
+            indexes = indexes[self.rank::self.world_size]
+
+        seed = int(self.seeds[slot])
+        for batch_index in range(len(self)):
+            batch_indexes = indexes[batch_index * self.batch_size:(batch_index + 1) *
+                                    self.batch_size]
+            yield [(index, slot, seed) for index in batch_indexes.tolist()]
+
+
 class MultiSampler(BatchSampler):
     """Sample same batch several times. Every time it's a little bit different
     due to data augmentation. To be used with ensembling models."""
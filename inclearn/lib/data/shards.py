@@ -0,0 +1,143 @@
+import logging
+import multiprocessing
+import os
+import shutil
+
+import numpy as np
+from PIL import Image
+from torchvision import transforms
+
+logger = logging.getLogger(__name__)
+
+
+class ShardStore:
+    """Pre-decoded & resized images, stored in one packed uint8 shard per split.
+
+    Each split has an index file `<split>_index.npy` whose rows are
+    (target, offset, height, width), in the order of the original samples,
+    and the raw pixels of the split, class after class, in `<split>.bin`. A
+    single file is mapped per split, thus per process, whatever the number of
+    classes. Samples are addressed by a global index over all splits, in the
+    same order as the unsharded dataset, so that e.g. its validation split is
+    the same. The samples of a class are a contiguous read.
+
+    :param directory: Directory written by `build_shards`.
+    :param splits: The splits to load, in the order of the global indexes.
+    """
+
+    def __init__(self, directory, splits=("train", "val")):
+        self.directory = directory
+        self.splits = list(splits)
+
+        indexes = [
+            np.load(os.path.join(directory, "{}_index.npy".format(split))) for split in self.splits
+        ]
+        self._index = np.concatenate(indexes)
+        self._split_ids = np.concatenate(
+            [np.full((len(index),), split_id) for split_id, index in enumerate(indexes)]
+        )
+        self._offsets = np.cumsum([0] + [len(index) for index in indexes])
+
+        self._shards = {}
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, index):
+        target, offset, height, width = self._index[index]
+        shard = self._get_shard(self._split_ids[index])
+        return shard[offset:offset + height * width * 3].reshape(height, width, 3)
+
+    def __getstate__(self):
+        # Workers re-open the shards, rather than receiving a copy of them.
+        state = self.__dict__.copy()
+        state["_shards"] = {}
+        return state
+
+    def split_indexes(self, split):
+        split_id = self.splits.index(split)
+        return np.arange(self._offsets[split_id], self._offsets[split_id + 1])
+
+    def split_targets(self, split):
+        return self._index[self.split_indexes(split), 0]
+
+    def _get_shard(self, split_id):
+        if split_id not in self._shards:
+            self._shards[split_id] = np.memmap(
+                _shard_path(self.directory, self.splits[split_id]), dtype=np.uint8, mode="r"
+            )
+        return self._shards[split_id]
+
+
+def build_shards(paths, targets, directory, split, size=256, workers=0):
+    """Decodes, resizes, and writes the images of a split into a packed shard.
+
+    Classes are written in parallel to temporary files, then concatenated.
+    The index keeps the order of `paths`, only the pixels are grouped by class.
+
+    Images are resized like `transforms.Resize(size)` does, so that the usual
+    ImageNet transformations can be applied on the decoded images.
+
+    :param paths: Paths of the images.
+    :param targets: Targets of the images.
+    :param directory: Output directory, shared by all splits.
+    :param split: Name of the split, e.g. "train" or "val".
+    :param size: Size of the shorter side of the resized images.
+    :param workers: Number of processes decoding the images.
+    """
+    paths, targets = np.asarray(paths), np.asarray(targets, dtype=np.int64)
+    os.makedirs(os.path.join(directory, split), exist_ok=True)
+
+    jobs = [
+        (paths[targets == target], target, directory, split, size)
+        for target in np.unique(targets)
+    ]
+    if workers > 0:
+        with multiprocessing.Pool(workers) as pool:
+            class_indexes = pool.map(_build_class_shard, jobs)
+    else:
+        class_indexes = list(map(_build_class_shard, jobs))
+
+    # Offsets become relative to the split shard:
+    offset = 0
+    with open(_shard_path(directory, split), "wb") as f:
+        for target, class_index in zip(np.unique(targets), class_indexes):
+            class_path = _class_shard_path(directory, split, target)
+            with open(class_path, "rb") as class_file:
+                shutil.copyfileobj(class_file, f)
+            os.remove(class_path)
+
+            class_index[:, 1] += offset
+            offset += int((class_index[:, 2] * class_index[:, 3] * 3).sum())
+    os.rmdir(os.path.join(directory, split))
+
+    index = np.zeros((len(paths), 4), dtype=np.int64)
+    for target, class_index in zip(np.unique(targets), class_indexes):
+        index[targets == target] = class_index
+    np.save(os.path.join(directory, "{}_index.npy".format(split)), index)
+    logger.info("Wrote {} images of split {} in {}.".format(len(index), split, directory))
+
+
+def _build_class_shard(job):
+    paths, target, directory, split, size = job
+    resize = transforms.Resize(size)
+
+    index = np.zeros((len(paths), 4), dtype=np.int64)
+    offset = 0
+    with open(_class_shard_path(directory, split, target), "wb") as f:
+        for i, path in enumerate(paths):
+            img = np.asarray(resize(Image.open(path).convert("RGB")), dtype=np.uint8)
+            f.write(img.tobytes())
+
+            index[i] = (target, offset, img.shape[0], img.shape[1])
+            offset += img.size
+
+    return index
+
+
+def _shard_path(directory, split):
+    return os.path.join(directory, "{}.bin".format(split))
+
+
+def _class_shard_path(directory, split, target):
+    return os.path.join(directory, split, "{}.bin".format(target))
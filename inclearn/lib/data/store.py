@@ -0,0 +1,126 @@
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class ImageStore:
+    """Read-only uint8 images, memory-mapped from one file per split.
+
+    The data of the incremental datasets are then global indexes into the
+    store instead of the images themselves: a task or a rehearsal memory only
+    copies index arrays, and the pages of the files are shared by all the
+    loader workers instead of being pickled with the datasets.
+
+    Each split file has a JSON metadata file next to it, with the split name,
+    its number of images, shape, byte size and a fingerprint of its images.
+    The file is only reused if they all match.
+
+    :param directory: Directory where the split files are written.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+        self._paths = []
+        self._offsets = [0]
+        self._arrays = None
+
+    def __len__(self):
+        return self._offsets[-1]
+
+    def __getitem__(self, index):
+        split = np.searchsorted(self._offsets, index, side="right") - 1
+        return self.arrays[split][index - self._offsets[split]]
+
+    def __getstate__(self):
+        # Workers re-open the files, rather than receiving a copy of the images.
+        state = self.__dict__.copy()
+        state["_arrays"] = None
+        return state
+
+    @property
+    def arrays(self):
+        if self._arrays is None:
+            self._arrays = [np.load(path, mmap_mode="r") for path in self._paths]
+        return self._arrays
+
+    def add(self, name, data):
+        """Adds a split to the store, its file is only written on first load.
+
+        :param name: Unique name of the split, e.g. "iCIFAR100_train".
+        :param data: The images, an array-like of shape (n, h, w, c).
+        :return: The global indexes of the split images.
+        """
+        data = np.asarray(data)
+        path = os.path.join(self.directory, "{}.npy".format(name))
+        metadata = self._metadata(name, data)
+
+        if not self._is_built(path, metadata):
+            logger.info("Building image store {}.".format(path))
+            os.makedirs(self.directory, exist_ok=True)
+            if os.path.exists(self._metadata_path(path)):
+                os.remove(self._metadata_path(path))
+
+            tmp_path = path + ".tmp.npy"
+            array = np.lib.format.open_memmap(
+                tmp_path, mode="w+", dtype=np.uint8, shape=data.shape
+            )
+            array[:] = data
+            array.flush()
+            del array
+            os.replace(tmp_path, path)
+
+            # Written last, thus only present once the split file is complete:
+            metadata["nb_bytes"] = os.path.getsize(path)
+            with open(path + ".tmp.json", "w") as f:
+                json.dump(metadata, f)
+            os.replace(path + ".tmp.json", self._metadata_path(path))
+
+        offset = self._offsets[-1]
+        self._paths.append(path)
+        self._offsets.append(offset + len(data))
+        self._arrays = None
+
+        return np.arange(offset, offset + len(data))
+
+    @staticmethod
+    def _metadata(name, data, nb_fingerprint_images=64):
+        """Metadata of a split, the fingerprint only hashes some of its images."""
+        fingerprint = hashlib.sha1()
+        step = max(len(data) // nb_fingerprint_images, 1)
+        for image in data[::step]:
+            fingerprint.update(np.ascontiguousarray(image, dtype=np.uint8).tobytes())
+
+        return {
+            "name": name,
+            "nb_images": len(data),
+            "shape": list(data.shape),
+            "fingerprint": fingerprint.hexdigest()
+        }
+
+    @staticmethod
+    def _metadata_path(path):
+        return path[:-len(".npy")] + ".json"
+
+    @staticmethod
+    def _is_built(path, metadata):
+        metadata_path = ImageStore._metadata_path(path)
+        if not os.path.exists(path) or not os.path.exists(metadata_path):
+            return False
+
+        with open(metadata_path) as f:
+            built_metadata = json.load(f)
+        nb_bytes = built_metadata.pop("nb_bytes", None)
+
+        if built_metadata != metadata:
+            logger.warning("Image store {} has different images, rebuilding it.".format(path))
+            return False
+        if nb_bytes != os.path.getsize(path):
+            logger.warning("Image store {} is incomplete, rebuilding it.".format(path))
+            return False
+        return True
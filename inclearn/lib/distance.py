@@ -11,31 +11,53 @@ def cosine_similarity(a, b):
 
 
 def stable_cosine_distance(a, b, squared=True):
-    """Computes the pairwise distance matrix with numerical stability."""
-    mat = torch.cat([a, b])
-
-    pairwise_distances_squared = torch.add(
-        mat.pow(2).sum(dim=1, keepdim=True).expand(mat.size(0), -1),
-        torch.t(mat).pow(2).sum(dim=0, keepdim=True).expand(mat.size(0), -1)
-    ) - 2 * (torch.mm(mat, torch.t(mat)))
-
-    # Deal with numerical inaccuracies. Set small negatives to zero.
-    pairwise_distances_squared = torch.clamp(pairwise_distances_squared, min=0.0)
-
-    # Get the mask where the zero distances are at.
-    error_mask = torch.le(pairwise_distances_squared, 0.0)
-
-    # Optionally take the sqrt.
-    if squared:
-        pairwise_distances = pairwise_distances_squared
-    else:
-        pairwise_distances = torch.sqrt(pairwise_distances_squared + error_mask.float() * 1e-16)
-
-    # Undo conditionally adding 1e-16.
-    pairwise_distances = torch.mul(pairwise_distances, (error_mask == False).float())
-
-    # Explicitly set diagonals to zero.
-    mask_offdiagonals = 1 - torch.eye(*pairwise_distances.size(), device=pairwise_distances.device)
-    pairwise_distances = torch.mul(pairwise_distances, mask_offdiagonals)
-
-    return pairwise_distances[:a.shape[0], a.shape[0]:]
+    """Computes the pairwise distance matrix with numerical stability.
+
+    Only the (len(a), len(b)) distances are computed, with a fused backward.
+
+    :param a: A tensor of shape (B, D).
+    :param b: A tensor of shape (C, D).
+    :param squared: Whether the distances are squared.
+    :return: A tensor of shape (B, C).
+    """
+    return _StableCosineDistance.apply(a, b, squared)
+
+
+class _StableCosineDistance(torch.autograd.Function):
+    """||a||^2 + ||b||^2 - 2 a.b, with the negative distances, due to numerical
+    inaccuracies, and their gradients set to zero.
+    """
+
+    @staticmethod
+    def forward(ctx, a, b, squared):
+        a_squared = a.pow(2).sum(dim=1, keepdim=True)
+        b_squared = b.pow(2).sum(dim=1)
+
+        distances = torch.addmm(a_squared + b_squared, a, b.T, alpha=-2)
+        # Deal with numerical inaccuracies. Set small negatives to zero.
+        distances = distances.clamp_(min=0.)
+        if not squared:
+            distances = distances.sqrt_()
+
+        # Zero distances have no gradient, and the sqrt's one is 1 / (2 sqrt(x)).
+        # The distances themselves aren't saved, they may be modified in place.
+        if squared:
+            grad_factor = distances > 0.
+        else:
+            grad_factor = torch.where(distances > 0., 0.5 / distances, torch.zeros_like(distances))
+        ctx.save_for_backward(a, b, grad_factor)
+        return distances
+
+    @staticmethod
+    def backward(ctx, grad_distances):
+        a, b, grad_factor = ctx.saved_tensors
+
+        grad = (grad_distances * grad_factor).to(a.dtype)
+
+        grad_a = grad_b = None
+        if ctx.needs_input_grad[0]:
+            grad_a = 2 * (grad.sum(dim=1, keepdim=True) * a - grad @ b)
+        if ctx.needs_input_grad[1]:
+            grad_b = 2 * (grad.sum(dim=0)[:, None] * b - grad.T @ a)
+
+        return grad_a, grad_b, None
@@ -0,0 +1,120 @@
+"""Multi-process data parallelism, with DistributedDataParallel.
+
+Processes are launched by `torchrun`, which sets the RANK, WORLD_SIZE,
+LOCAL_RANK, MASTER_ADDR & MASTER_PORT environment variables, e.g.:
+
+    torchrun --nproc_per_node 4 -m inclearn --device 0 1 2 3 ...
+
+`torchrun` is installed by PyTorch >= 1.10, on 1.9 the same launcher is run
+by `python3 -m torch.distributed.run`.
+
+Every process trains on its shard of the training data (see
+`IncrementalDataset`), with the per-process batch size given by the options.
+The examplars are selected by the main process only, then broadcast.
+Without those variables, everything here is a no-op.
+"""
+import datetime
+import logging
+import os
+
+import torch
+import torch.distributed as dist
+
+logger = logging.getLogger(__name__)
+
+
+def is_launched():
+    """Whether the process was launched among several by torchrun."""
+    return int(os.environ.get("WORLD_SIZE", 1)) > 1
+
+
+def is_enabled():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_enabled() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_enabled() else 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def init_process_group(devices, backend=None, timeout=None):
+    """Joins the process group if launched by torchrun.
+
+    The other processes wait in a collective while the main process selects
+    the examplars, which may take longer than the default 30 minutes timeout
+    of PyTorch on large datasets.
+
+    :param devices: The `--device` option, -1 standing for the CPU.
+    :param backend: The distributed backend, by default gloo on CPU and nccl on GPU.
+    :param timeout: Timeout of the collectives in minutes, by default 3 hours.
+    """
+    if not is_launched() or is_enabled():
+        return
+
+    backend = backend or ("gloo" if -1 in devices else "nccl")
+    dist.init_process_group(
+        backend, init_method="env://", timeout=datetime.timedelta(minutes=timeout or 180)
+    )
+    logger.info(
+        "Process {}/{} joined the {} process group.".format(
+            get_rank() + 1, get_world_size(), backend
+        )
+    )
+
+
+def select_device(devices):
+    """Selects the device of this process among the `--device` option.
+
+    :param devices: The list of torch devices.
+    :return: A list with the single device of this process.
+    """
+    if not is_launched() or devices[0].type == "cpu":
+        return devices
+
+    local_rank = int(os.environ.get("LOCAL_RANK", 0))
+    if len(devices) > 1:
+        device = devices[local_rank]
+    else:  # One process per GPU of the node.
+        device = torch.device("cuda:{}".format(local_rank))
+    torch.cuda.set_device(device)
+    return [device]
+
+
+def broadcast_object(obj, src=0):
+    """Sends a picklable object from `src` to all processes.
+
+    :param obj: The object to send, ignored on the other processes.
+    :return: The object of `src`.
+    """
+    if not is_enabled():
+        return obj
+
+    # With nccl, the objects are sent from the current device, set by `select_device`:
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=src)
+    return objects[0]
+
+
+def broadcast_buffers(module, src=0):
+    """Sends the buffers of a module, e.g. BN statistics, from `src` to all processes.
+
+    DDP only synchronizes them at the beginning of each forward.
+    """
+    if not is_enabled():
+        return
+    for buffer in module.buffers():
+        dist.broadcast(buffer, src=src)
+
+
+def set_epoch(loader, epoch):
+    """Reshuffles the shards of a loader with a distributed sampler."""
+    sampler = getattr(loader, "sampler", None)
+    if isinstance(sampler, torch.utils.data.DistributedSampler):
+        sampler.set_epoch(epoch)
@@ -8,7 +8,7 @@ from inclearn.convnet import (
     densenet, my_resnet, my_resnet2, my_resnet_brn, my_resnet_mcbn, my_resnet_mtl, resnet,
     resnet_mtl, ucir_resnet, vgg
 )
-from inclearn.lib import data, schedulers
+from inclearn.lib import data, distributed, schedulers
 
 
 def get_optimizer(params, optimizer, lr, weight_decay=0.0):
@@ -24,7 +24,17 @@ def get_optimizer(params, optimizer, lr, weight_decay=0.0):
     raise NotImplementedError
 
 
-def get_convnet(convnet_type, **kwargs):
+def get_convnet(convnet_type, channels_last=False, **kwargs):
+    convnet = _get_convnet(convnet_type, **kwargs)
+    if channels_last:
+        if not hasattr(torch, "channels_last"):
+            raise ValueError("The channels_last convnet option needs torch >= 1.5.")
+        # Only the 4D weights are converted, the inputs must be too (see `BasicNet`).
+        convnet = convnet.to(memory_format=torch.channels_last)
+    return convnet
+
+
+def _get_convnet(convnet_type, **kwargs):
     if convnet_type == "resnet18":
         return resnet.resnet18(**kwargs)
     if convnet_type == "resnet101":
@@ -83,6 +93,16 @@ def get_model(args):
 
 
 def get_data(args, class_order=None):
+    teacher_cache_config = args.get("teacher_cache") or {}
+    if teacher_cache_config and "nb_augmentations" not in teacher_cache_config:
+        raise ValueError(
+            "The teacher cache needs an explicit nb_augmentations, the number of fixed"
+            " augmentations replayed over the epochs (e.g. the number of epochs)."
+        )
+    if teacher_cache_config and (args.get("dataset_transforms") or {}).get("batch_augmentations"):
+        # The batch transforms aren't seeded, thus the cached outputs would never be replayed:
+        raise ValueError("The teacher cache can't be used with batch augmentations.")
+
     return data.IncrementalDataset(
         dataset_name=args["dataset"],
         random_order=args["random_classes"],
@@ -100,7 +120,12 @@ def get_data(args, class_order=None):
         seed=args["seed"],
         dataset_transforms=args.get("dataset_transforms", {}),
         all_test_classes=args.get("all_test_classes", False),
-        metadata_path=args.get("metadata_path")
+        metadata_path=args.get("metadata_path"),
+        image_store_path=args.get("image_store_path"),
+        device=args["device"][0],
+        loader_config=args.get("loader_config", {}),
+        nb_augmentation_slots=teacher_cache_config.get("nb_augmentations"),
+        eval_every_x_epochs=args.get("eval_every_x_epochs")
     )
 
 
@@ -115,7 +140,7 @@ def set_device(args):
 
         devices.append(device)
 
-    args["device"] = devices
+    args["device"] = distributed.select_device(devices)
 
 
 def get_sampler(args):
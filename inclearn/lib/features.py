@@ -0,0 +1,269 @@
+"""Batched feature extraction over several classes.
+
+Instead of building fresh loaders for every class, a single loader goes through
+all the needed classes, and features are grouped back by class.
+"""
+import collections
+import itertools
+import logging
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+ClassFeatures = collections.namedtuple(
+    "ClassFeatures", ["class_index", "data", "features", "features_flipped", "targets"]
+)
+
+
+class GroupedFeatures:
+    """Features of several classes, stored contiguously and grouped by class.
+
+    Samples of the i-th class of `class_indexes` are located between
+    `offsets[i]` and `offsets[i + 1]` in every array.
+
+    :param class_indexes: The list of extracted classes, in storage order.
+    :param data: The raw data (images or paths), as given by the dataset.
+    :param features: Features of shape (n, features_dim).
+    :param features_flipped: Features of the flipped images, may be None.
+    :param targets: The targets of shape (n,).
+    """
+
+    def __init__(self, class_indexes, data, features, features_flipped, targets):
+        self.class_indexes = list(class_indexes)
+        self.data = data
+        self.features = features
+        self.features_flipped = features_flipped
+        self.targets = targets
+
+        self.offsets = class_offsets(targets, self.class_indexes)
+        self._positions = {class_index: i for i, class_index in enumerate(self.class_indexes)}
+
+    def __len__(self):
+        return len(self.class_indexes)
+
+    def __contains__(self, class_index):
+        return class_index in self._positions
+
+    def __getitem__(self, class_index):
+        position = self._positions[class_index]
+        lo, hi = self.offsets[position], self.offsets[position + 1]
+
+        return ClassFeatures(
+            class_index, self.data[lo:hi], self.features[lo:hi],
+            self.features_flipped[lo:hi] if self.features_flipped is not None else None,
+            self.targets[lo:hi]
+        )
+
+    def __iter__(self):
+        for class_index in self.class_indexes:
+            yield self[class_index]
+
+
+class FeatureCache:
+    """Features of samples of a split, keyed by their index in the split.
+
+    Filled explicitly with `put`, e.g. by a consumer extracting the new
+    classes before `build_examplars` extracts them again. The features are
+    those of the network when they were put, the cache must thus be dropped
+    as soon as the network changes.
+
+    :param data_source: The split of the samples, train, val, or test.
+    """
+
+    def __init__(self, data_source="train"):
+        self.data_source = data_source
+
+        self._indexes = np.zeros((0,), dtype=np.int64)  # Sorted.
+        self._features = None
+        self._features_flipped = None
+
+    def __len__(self):
+        return len(self._indexes)
+
+    def put(self, indexes, features, features_flipped=None):
+        """Adds the features of samples, replacing those already cached.
+
+        :param indexes: The indexes of the samples in their split.
+        :param features: Features of shape (n, features_dim).
+        :param features_flipped: Features of the flipped images, may be None,
+                                 in which case flipped features are never found.
+        """
+        indexes = np.asarray(indexes, dtype=np.int64)
+        if self._features is not None:
+            kept = ~np.isin(self._indexes, indexes)
+            indexes = np.concatenate((self._indexes[kept], indexes))
+            features = np.concatenate((self._features[kept], features))
+            if self._features_flipped is not None and features_flipped is not None:
+                features_flipped = np.concatenate((self._features_flipped[kept], features_flipped))
+            else:
+                features_flipped = None
+
+        order = np.argsort(indexes, kind="stable")
+        self._indexes = indexes[order]
+        self._features = features[order]
+        self._features_flipped = features_flipped[order] if features_flipped is not None else None
+
+    def get(self, indexes, flip=True):
+        """Returns the features of samples, if they are all cached.
+
+        :param indexes: The indexes of the samples in their split.
+        :param flip: Whether the flipped features are also needed.
+        :return: A tuple of the features & flipped features (None if not
+                 `flip`), in the order of `indexes`, or None.
+        """
+        if self._features is None or (flip and self._features_flipped is None):
+            return None
+
+        indexes = np.asarray(indexes, dtype=np.int64)
+        positions = np.searchsorted(self._indexes, indexes)
+        positions = np.minimum(positions, len(self._indexes) - 1)
+        if not (self._indexes[positions] == indexes).all():
+            return None
+
+        return self._features[positions], \
+            self._features_flipped[positions] if flip else None
+
+
+def class_offsets(targets, class_indexes):
+    """Computes the class offsets of targets grouped by class.
+
+    :param targets: Targets where all samples of a class are contiguous, and
+                    classes are in the order of `class_indexes`.
+    :param class_indexes: A list of unique class indexes.
+    :return: An array of shape (len(class_indexes) + 1,).
+    """
+    class_indexes = np.asarray(class_indexes, dtype=np.int64)
+    if len(targets) == 0:
+        return np.zeros((len(class_indexes) + 1,), dtype=np.int64)
+
+    minlength = max(int(targets.max()), int(class_indexes.max(initial=0))) + 1
+    counts = np.bincount(targets.astype(np.int64), minlength=minlength)[class_indexes]
+    return np.concatenate(([0], np.cumsum(counts)))
+
+
+def iter_class_features(
+    network, inc_dataset, class_indexes, data_source="train", flip=True, cache=None
+):
+    """Extracts features class per class, with a single loader for all classes.
+
+    Classes are yielded as soon as all their samples have been extracted, thus
+    only a single class and a batch are kept in memory.
+
+    :param network: The network, must have an `extract` method.
+    :param inc_dataset: The incremental dataset providing the data.
+    :param class_indexes: A list of class indexes.
+    :param data_source: Whether to fetch from the train, val, or test set.
+    :param flip: Also extract the features of the flipped images.
+    :param cache: A `FeatureCache` of the network, whose classes are not
+                  extracted again if all their samples are cached.
+    :return: A generator of `ClassFeatures`.
+    """
+    class_indexes = list(class_indexes)
+    if cache is None or cache.data_source != data_source:
+        yield from _iter_extracted_class_features(
+            network, inc_dataset, class_indexes, data_source, flip
+        )
+        return
+
+    cached = {}
+    for class_index in class_indexes:
+        class_features = cache.get(inc_dataset.get_class_indexes(class_index, data_source), flip)
+        if class_features is not None:
+            cached[class_index] = class_features
+    if len(cached) > 0:
+        logger.info("{} classes features found in cache.".format(len(cached)))
+
+    extracted = _iter_extracted_class_features(
+        network, inc_dataset, [c for c in class_indexes if c not in cached], data_source, flip
+    )
+    for class_index in class_indexes:
+        if class_index not in cached:
+            yield next(extracted)
+            continue
+
+        data, targets = inc_dataset.get_class_data(class_index, data_source=data_source)
+        features, features_flipped = cached[class_index]
+        yield ClassFeatures(class_index, data, features, features_flipped, targets)
+
+
+def _iter_extracted_class_features(network, inc_dataset, class_indexes, data_source, flip):
+    if len(class_indexes) == 0:
+        return
+
+    data, loader = inc_dataset.get_custom_loader(
+        class_indexes, mode="test_flip" if flip else "test", data_source=data_source
+    )
+    targets = loader.dataset.y
+    offsets = class_offsets(targets, class_indexes)
+
+    pending, pending_flipped = [], []  # Features not yet yielded, from sample `pending_start`.
+    pending_start, nb_seen, position = 0, 0, 0
+
+    state = network.training
+    network.eval()
+    try:
+        # The trailing `None` flushes the last classes, which may be empty.
+        for input_dict in itertools.chain(loader, [None]):
+            if input_dict is not None:
+                inputs, batch_size = input_dict["inputs"], len(input_dict["targets"])
+                if flip:
+                    inputs = torch.cat((inputs, input_dict["inputs_flipped"]))
+
+                with torch.no_grad():
+                    batch_features = network.extract(inputs.to(network.device))
+                batch_features = batch_features.detach().cpu().numpy()
+
+                pending.append(batch_features[:batch_size])
+                pending_flipped.append(batch_features[batch_size:])
+                nb_seen += batch_size
+
+            while position < len(class_indexes) and offsets[position + 1] <= nb_seen:
+                lo, hi = offsets[position], offsets[position + 1]
+                if len(pending) > 1:
+                    pending = [np.concatenate(pending)]
+                    pending_flipped = [np.concatenate(pending_flipped)]
+                features, features_flipped = pending[0], pending_flipped[0]
+                lo_p, hi_p = lo - pending_start, hi - pending_start
+
+                yield ClassFeatures(
+                    class_indexes[position], data[lo:hi], features[lo_p:hi_p],
+                    features_flipped[lo_p:hi_p] if flip else None, targets[lo:hi]
+                )
+
+                pending, pending_flipped = [features[hi_p:]], [features_flipped[hi_p:]]
+                pending_start = hi
+                position += 1
+    finally:
+        network.train(state)
+
+
+def extract_class_features(
+    network, inc_dataset, class_indexes, data_source="train", flip=True, cache=None
+):
+    """Extracts the features of several classes with a single loader.
+
+    :param network: The network, must have an `extract` method.
+    :param inc_dataset: The incremental dataset providing the data.
+    :param class_indexes: A list of class indexes.
+    :param data_source: Whether to fetch from the train, val, or test set.
+    :param flip: Also extract the features of the flipped images.
+    :param cache: A `FeatureCache`, see `iter_class_features`.
+    :return: A `GroupedFeatures`.
+    """
+    class_indexes = list(class_indexes)
+
+    data, features, features_flipped, targets = [], [], [], []
+    for class_features in iter_class_features(
+        network, inc_dataset, class_indexes, data_source=data_source, flip=flip, cache=cache
+    ):
+        data.append(class_features.data)
+        features.append(class_features.features)
+        features_flipped.append(class_features.features_flipped)
+        targets.append(class_features.targets)
+
+    return GroupedFeatures(
+        class_indexes, np.concatenate(data), np.concatenate(features),
+        np.concatenate(features_flipped) if flip else None, np.concatenate(targets)
+    )
@@ -1,9 +1,9 @@
 import numpy as np
 import torch
 from sklearn.cluster import KMeans
-from torch.nn import functional as F
 
-from inclearn.lib import utils
+from inclearn.lib import features as features_lib
+from inclearn.lib import metrics, utils
 
 
 def closest_to_mean(features, nb_examplars):
@@ -39,6 +39,93 @@ def icarl_selection(features, nb_examplars):
     return herding_matrix.argsort()[:nb_examplars]
 
 
+def icarl_selection_batched(features, nb_examplars, device=None):
+    """Herding selection of iCaRL for several classes at once.
+
+    Classes are padded to the same number of samples, and the herding
+    iterations of all classes are run together. The selected indexes are the
+    same as calling `icarl_selection` on every class, up to the BLAS rounding
+    used to break exact ties (e.g. duplicated images).
+
+    :param features: A list of per-class features, each of shape (n_c, d).
+    :param nb_examplars: Number of examplars to select per class.
+    :param device: A torch device to run on, numpy is used if None.
+    :return: A list of arrays of indexes, one per class.
+    """
+    nb_classes = len(features)
+    if nb_classes == 0:
+        return []
+
+    sizes = np.array([len(class_features) for class_features in features])
+    max_size, features_dim = sizes.max(), features[0].shape[1]
+    dtype = np.result_type(*features)
+
+    # Normalization & mean are done per class, exactly as in `icarl_selection`:
+    D = np.zeros((nb_classes, max_size, features_dim), dtype=dtype)  # Per-class D.T
+    mu = np.zeros((nb_classes, features_dim), dtype=dtype)
+    for class_index, class_features in enumerate(features):
+        class_D = class_features.T
+        class_D = class_D / (np.linalg.norm(class_D, axis=0) + 1e-8)
+
+        D[class_index, :sizes[class_index]] = class_D.T
+        mu[class_index] = np.mean(class_D, axis=1)
+    padding_mask = np.arange(max_size)[None] >= sizes[:, None]
+
+    if device is not None:
+        D = torch.from_numpy(D).to(device)
+        mu = torch.from_numpy(mu).to(device)
+        padding_mask = torch.from_numpy(padding_mask).to(device)
+        w_t = mu.clone()
+    else:
+        w_t = mu.copy()
+
+    herding_matrix = np.zeros((nb_classes, max_size))
+    nb_selected = np.zeros((nb_classes,), dtype=np.int64)
+    nb_targets = np.minimum(nb_examplars, sizes)
+
+    # Classes still selecting examplars, dropped from the batch once they have their quota:
+    rows = np.arange(nb_classes)
+    active = nb_selected != nb_targets
+    iter_herding_eff = 0
+    while active.any():
+        if not active.all():
+            rows = rows[active]
+            if device is not None:
+                active = torch.from_numpy(active).to(device)
+            D, mu, w_t, padding_mask = D[active], mu[active], w_t[active], padding_mask[active]
+
+        if device is None:
+            tmp_t = np.matmul(D, w_t[..., None])[..., 0]
+            tmp_t[padding_mask] = -np.inf
+            ind_max = np.argmax(tmp_t, axis=1)
+
+            w_t = w_t + mu - D[np.arange(len(rows)), ind_max]
+        else:
+            tmp_t = torch.bmm(D, w_t[..., None])[..., 0].masked_fill_(padding_mask, -np.inf)
+            ind_max_t = torch.argmax(tmp_t, dim=1)
+
+            w_t = w_t + mu - D[torch.arange(len(rows), device=device), ind_max_t]
+            ind_max = ind_max_t.cpu().numpy()
+        iter_herding_eff += 1
+
+        # Masking already picked indexes, only the new ones get a rank:
+        newly_picked = herding_matrix[rows, ind_max] == 0
+        picked_rows, ind_max = rows[newly_picked], ind_max[newly_picked]
+        herding_matrix[picked_rows, ind_max] = 1 + nb_selected[picked_rows]
+        nb_selected[picked_rows] += 1
+
+        active = (nb_selected[rows] != nb_targets[rows]) & (iter_herding_eff < 1000)
+
+    selected_indexes = []
+    for class_index in range(nb_classes):
+        class_herding_matrix = herding_matrix[class_index, :sizes[class_index]]
+        class_herding_matrix[np.where(class_herding_matrix == 0)[0]] = 10000
+
+        selected_indexes.append(class_herding_matrix.argsort()[:nb_examplars])
+
+    return selected_indexes
+
+
 def random(features, nb_examplars):
     return np.random.permutation(len(features))[:nb_examplars]
 
@@ -74,7 +161,10 @@ def confusion(ypreds, ytrue, nb_examplars, class_id=None, minimize_confusion=Tru
     indexes = np.where(ytrue == class_id)[0]
     ypreds, ytrue = ypreds[indexes], ytrue[indexes]
 
-    ranks = ypreds.argsort(axis=1)[:, ::-1][np.arange(len(ypreds)), ytrue]
+    if isinstance(ypreds, metrics.TopkPredictions):
+        ranks = ypreds.target_ranks
+    else:
+        ranks = ypreds.argsort(axis=1)[:, ::-1][np.arange(len(ypreds)), ytrue]
 
     indexes = ranks.argsort()
     if minimize_confusion:
@@ -83,8 +173,9 @@ def confusion(ypreds, ytrue, nb_examplars, class_id=None, minimize_confusion=Tru
 
 
 def minimize_confusion(inc_dataset, network, memory, class_index, nb_examplars):
-    _, new_loader = inc_dataset.get_custom_loader(class_index, mode="test")
-    new_features, _ = utils.extract_features(network, new_loader)
+    new_features = features_lib.extract_class_features(
+        network, inc_dataset, [class_index], flip=False
+    ).features
     new_mean = np.mean(new_features, axis=0)
 
     from sklearn.cluster import KMeans
@@ -131,7 +222,7 @@ def var_ratio(memory_per_class, network, loader, select="max", type=None):
         with torch.no_grad():
             outputs = network(inputs)
         var_ratios.append(outputs["var_ratio"])
-    var_ratios = np.concatenate(var_ratios)
+    var_ratios = torch.cat(var_ratios).cpu().numpy()
 
     indexes = var_ratios.argsort()
     if select == "max":
@@ -141,31 +232,41 @@ def var_ratio(memory_per_class, network, loader, select="max", type=None):
     raise ValueError("Only possible value for <select> are [max, min], not {}.".format(select))
 
 
-def mcbn(memory_per_class, network, loader, select="max", nb_samples=100, type=None):
+def mcbn(
+    memory_per_class,
+    network,
+    loader,
+    select="max",
+    nb_samples=100,
+    nb_samples_per_forward=25,
+    type=None
+):
+    """Selects by variation ratio over BN statistics sampled from the training.
+
+    Each forward expands the batch over `nb_samples_per_forward` sampled
+    statistics, the predictions never leaving the device.
+    """
     if not hasattr(network.convnet, "sampling_mode"):
         raise ValueError("Network must be MCBN-compatible.")
-    network.convnet.sampling_mode()
 
-    all_probs = []
+    var_ratios = []
     for input_dict in loader:
         inputs = input_dict["inputs"].to(network.device)
 
-        probs = []
-        for _ in range(nb_samples):
+        predictions = []
+        for nb_forward_samples in _split_samples(nb_samples, nb_samples_per_forward):
+            network.convnet.sampling_mode(nb_forward_samples)
             with torch.no_grad():
-                outputs = network(inputs)
-                logits = outputs["logits"]
-                probs.append(F.softmax(logits, dim=-1).cpu().numpy())
+                logits = network(inputs.repeat(nb_forward_samples, 1, 1, 1))["logits"]
+            predictions.append(logits.view(nb_forward_samples, len(inputs), -1).argmax(dim=2))
 
-        probs = np.stack(probs)
-        all_probs.append(probs)
+        predictions = torch.cat(predictions).T
+        var_ratios.append(utils.variation_ratio(predictions, logits.shape[1]))
     network.convnet.normal_mode()
 
-    all_probs = np.concatenate(all_probs, axis=1)
-    var_ratios = _var_ratio(all_probs.transpose(1, 0, 2))
+    var_ratios = torch.cat(var_ratios).cpu().numpy()
 
     indexes = var_ratios.argsort()
-    assert len(indexes) == all_probs.shape[1]
     if select == "max":
         return indexes[-memory_per_class:]
     elif select == "min":
@@ -178,17 +279,9 @@ def mcbn(memory_per_class, network, loader, select="max", nb_samples=100, type=N
 # ---------
 
 
-def _var_ratio(sampled_probs):
-    predicted_class = sampled_probs.max(axis=2)
-
-    hist = np.array(
-        [
-            np.histogram(predicted_class[i, :], range=(0, 10))[0]
-            for i in range(predicted_class.shape[0])
-        ]
-    )
-
-    return 1. - hist.max(axis=1) / sampled_probs.shape[1]
+def _split_samples(nb_samples, nb_samples_per_forward):
+    for start in range(0, nb_samples, nb_samples_per_forward):
+        yield min(nb_samples_per_forward, nb_samples - start)
 
 
 def _l2_distance(x, y):
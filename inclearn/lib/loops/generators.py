@@ -435,20 +435,24 @@ def _extract_features(
             loader_args = [[class_id]]
             loader_kwargs = {"mode": "test", "data_source": "train"}
 
-        loader_base = inc_dataset.get_custom_loader(*loader_args, **loader_kwargs)[1]
-        loader_kwargs["mode"] = "flip"
-        loader_flip = inc_dataset.get_custom_loader(*loader_args, **loader_kwargs)[1]
-
-        for loader in (loader_base, loader_flip):
-            for input_dict in loader:
-                inputs, targets = input_dict["inputs"], input_dict["targets"]
-                with torch.no_grad():
-                    outputs = training_network(inputs.to(device))
+        # Normal and flipped images are decoded once and forwarded as a single batch:
+        loader_kwargs["mode"] = "test_flip"
+        loader = inc_dataset.get_custom_loader(*loader_args, **loader_kwargs)[1]
+
+        flipped_features, flipped_targets = [], []
+        for input_dict in loader:
+            inputs, targets = input_dict["inputs"], input_dict["targets"]
+            inputs = torch.cat((inputs, input_dict["inputs_flipped"]))
+            with torch.no_grad():
+                features = training_network(inputs.to(device))[features_key]
 
-                visual_features[class_id].append(outputs[features_key])
-                visual_targets[class_id].append(targets)
+            visual_features[class_id].append(features[:len(targets)])
+            visual_targets[class_id].append(targets)
+            flipped_features.append(features[len(targets):])
+            flipped_targets.append(targets)
 
-        visual_features[class_id] = torch.cat(visual_features[class_id])
+        visual_features[class_id] = torch.cat(visual_features[class_id] + flipped_features)
+        visual_targets[class_id].extend(flipped_targets)
 
     return visual_features, visual_targets
 
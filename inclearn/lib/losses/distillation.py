@@ -41,7 +41,8 @@ def pod(
           Small Task Incremental Learning.
           arXiv 2020.
 
-    :param list_attentions_a: A list of attention maps, each of shape (b, n, w, h).
+    :param list_attentions_a: A list of attention maps, each of shape (b, n, w, h),
+                              or already pooled by `pod_pooling`.
     :param list_attentions_b: A list of attention maps, each of shape (b, n, w, h).
     :param collapse_channels: How to pool the channels.
     :param memory_flags: Integer flags denoting exemplars.
@@ -52,39 +53,16 @@ def pod(
 
     loss = torch.tensor(0.).to(list_attentions_a[0].device)
     for i, (a, b) in enumerate(zip(list_attentions_a, list_attentions_b)):
-        # shape of (b, n, w, h)
-        assert a.shape == b.shape, (a.shape, b.shape)
-
         if only_old:
             a = a[memory_flags]
             b = b[memory_flags]
             if len(a) == 0:
                 continue
 
-        a = torch.pow(a, 2)
-        b = torch.pow(b, 2)
-
-        if collapse_channels == "channels":
-            a = a.sum(dim=1).view(a.shape[0], -1)  # shape of (b, w * h)
-            b = b.sum(dim=1).view(b.shape[0], -1)
-        elif collapse_channels == "width":
-            a = a.sum(dim=2).view(a.shape[0], -1)  # shape of (b, c * h)
-            b = b.sum(dim=2).view(b.shape[0], -1)
-        elif collapse_channels == "height":
-            a = a.sum(dim=3).view(a.shape[0], -1)  # shape of (b, c * w)
-            b = b.sum(dim=3).view(b.shape[0], -1)
-        elif collapse_channels == "gap":
-            a = F.adaptive_avg_pool2d(a, (1, 1))[..., 0, 0]
-            b = F.adaptive_avg_pool2d(b, (1, 1))[..., 0, 0]
-        elif collapse_channels == "spatial":
-            a_h = a.sum(dim=3).view(a.shape[0], -1)
-            b_h = b.sum(dim=3).view(b.shape[0], -1)
-            a_w = a.sum(dim=2).view(a.shape[0], -1)
-            b_w = b.sum(dim=2).view(b.shape[0], -1)
-            a = torch.cat([a_h, a_w], dim=-1)
-            b = torch.cat([b_h, b_w], dim=-1)
-        else:
-            raise ValueError("Unknown method to collapse: {}".format(collapse_channels))
+        if a.dim() == 4:  # Else, `a` was pooled beforehand (e.g. cached teacher outputs).
+            a = pod_pooling(a, collapse_channels)
+        b = pod_pooling(b, collapse_channels)
+        assert a.shape == b.shape, (a.shape, b.shape)
 
         if normalize:
             a = F.normalize(a, dim=1, p=2)
@@ -96,6 +74,68 @@ def pod(
     return loss / len(list_attentions_a)
 
 
+def pod_pooling(a, collapse_channels="spatial"):
+    """Pools the squared attention maps of `pod`, before normalization.
+
+    :param a: An attention map of shape (b, n, w, h).
+    :param collapse_channels: How to pool the channels.
+    :return: A tensor of shape (b, m).
+    """
+    if collapse_channels == "width":
+        return PooledSquares.apply(a, (2,))  # shape of (b, c * h)
+    elif collapse_channels == "height":
+        return PooledSquares.apply(a, (3,))  # shape of (b, c * w)
+    elif collapse_channels == "spatial":
+        return PooledSquares.apply(a, (3, 2))
+
+    a = torch.pow(a, 2)
+    if collapse_channels == "channels":
+        return a.sum(dim=1).view(a.shape[0], -1)  # shape of (b, w * h)
+    elif collapse_channels == "gap":
+        return F.adaptive_avg_pool2d(a, (1, 1))[..., 0, 0]
+    raise ValueError("Unknown method to collapse: {}".format(collapse_channels))
+
+
+class PooledSquares(torch.autograd.Function):
+    """Sums of squares of a map over some of its spatial dimensions, flattened
+    and concatenated.
+
+    Contrary to `torch.pow(a, 2).sum(dim)`, the squared map is never
+    materialized: the forward reduces norms, and the backward only keeps the
+    map itself, which is already saved by the network.
+    """
+
+    @staticmethod
+    def forward(ctx, a, dims):
+        ctx.save_for_backward(a)
+        ctx.dims = dims
+
+        return torch.cat(
+            [torch.norm(a, p=2, dim=dim).pow_(2).view(a.shape[0], -1) for dim in dims],
+            dim=-1
+        )
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        a, = ctx.saved_tensors
+        b, c, h, w = a.shape
+
+        grads, offset = [], 0
+        for dim in ctx.dims:
+            size = c * (h if dim == 3 else w)
+            if dim == 3:  # (b, c, h) -> (b, c, h, 1)
+                grads.append(grad_output[:, offset:offset + size].reshape(b, c, h, 1))
+            else:  # (b, c, w) -> (b, c, 1, w)
+                grads.append(grad_output[:, offset:offset + size].reshape(b, c, 1, w))
+            offset += size
+
+        if len(grads) == 2:  # Broadcasted to a full map, which is reused in-place.
+            grad_a = (grads[0] + grads[1]).mul_(a)
+        else:
+            grad_a = a * grads[0]
+        return grad_a.mul_(2), None
+
+
 def spatial_pyramid_pooling(
     list_attentions_a,
     list_attentions_b,
@@ -17,15 +17,27 @@ class MetricLogger:
         self._task_counter = 0
 
     def log_task(self, ypreds, ytrue, task_size, zeroshot=False):
+        """Logs the metrics of a task, from all its predictions.
+
+        :param ypreds: The predictions, as a `TopkPredictions` or an array of
+                       scores (N, C).
+        :param ytrue: The true classes array.
+        """
+        counts = StreamingAccuracy(self.nb_classes)
+        counts.update(ypreds, ytrue)
+        self.log_accuracy(counts, task_size, zeroshot=zeroshot)
+
+    def log_accuracy(self, counts, task_size, zeroshot=False):
+        """Logs the metrics of a task, from the counts of its predictions.
+
+        :param counts: A `StreamingAccuracy`, updated batch per batch during
+                       the evaluation.
+        """
         self.metrics["accuracy"].append(
-            accuracy_per_task(ypreds, ytrue, task_size=10, topk=1)
+            counts.accuracy_per_task(task_size=10, topk=1)
         )  # FIXME various task size
-        self.metrics["accuracy_top5"].append(
-            accuracy_per_task(ypreds, ytrue, task_size=None, topk=5)
-        )
-        self.metrics["accuracy_per_class"].append(
-            accuracy_per_task(ypreds, ytrue, task_size=1, topk=1)
-        )
+        self.metrics["accuracy_top5"].append(counts.accuracy_per_task(task_size=None, topk=5))
+        self.metrics["accuracy_per_class"].append(counts.accuracy_per_task(task_size=1, topk=1))
         self.metrics["incremental_accuracy"].append(incremental_accuracy(self.metrics["accuracy"]))
         self.metrics["incremental_accuracy_top5"].append(
             incremental_accuracy(self.metrics["accuracy_top5"])
@@ -38,21 +50,17 @@ class MetricLogger:
         #self.metrics["cord_new"].append(cord_metric(self._accuracy_matrix, only="new"))
 
         if zeroshot:
-            seen_classes_indexes = np.where(ytrue < sum(self.increments[:self._task_counter + 1])
-                                           )[0]
+            nb_seen_classes = sum(self.increments[:self._task_counter + 1])
             self.metrics["seen_classes_accuracy"].append(
-                accuracy(ypreds[seen_classes_indexes], ytrue[seen_classes_indexes])
+                counts.accuracy(slice(0, nb_seen_classes))
             )
-            unseen_classes_indexes = np.where(
-                ytrue >= sum(self.increments[:self._task_counter + 1])
-            )[0]
             self.metrics["unseen_classes_accuracy"].append(
-                accuracy(ypreds[unseen_classes_indexes], ytrue[unseen_classes_indexes])
+                counts.accuracy(slice(nb_seen_classes, None))
             )
 
         if self._task_counter > 0:
-            self.metrics["old_accuracy"].append(old_accuracy(ypreds, ytrue, task_size))
-            self.metrics["new_accuracy"].append(new_accuracy(ypreds, ytrue, task_size))
+            self.metrics["old_accuracy"].append(counts.old_accuracy(task_size))
+            self.metrics["new_accuracy"].append(counts.new_accuracy(task_size))
 
         self._task_counter += 1
 
@@ -96,6 +104,287 @@ class MetricLogger:
             self._accuracy_matrix[class_id, self._task_counter] = v
 
 
+class TopkPredictions:
+    """The top-k predictions of a (N, C) scores matrix, without the matrix.
+
+    It is all the metrics, and the confusion herding, need: they index it
+    like the matrix, `predictions[indexes]`, and read its `shape`.
+
+    :param indexes: The classes of the k best scores, shape (N, k).
+    :param scores: Those k scores, in decreasing order.
+    :param target_ranks: The rank of the true class among all scores.
+    :param nb_classes: The number of classes C.
+    """
+
+    def __init__(self, indexes, scores, target_ranks, nb_classes):
+        self.indexes = indexes
+        self.scores = scores
+        self.target_ranks = target_ranks
+        self.nb_classes = nb_classes
+
+    @classmethod
+    def from_scores(cls, scores, targets, topk=5):
+        """Keeps the top-k of a batch of scores, only them being sent to host.
+
+        :param scores: A tensor of scores of shape (B, C).
+        :param targets: The true classes, on the same device.
+        """
+        nb_classes = scores.shape[1]
+        targets = targets.view(-1, 1).long()
+
+        topk_scores, topk_indexes = scores.topk(min(topk, nb_classes), dim=1)
+        # Unseen classes, in zeroshot evaluation, are ranked last:
+        target_scores = scores.gather(1, targets.clamp(max=nb_classes - 1))
+        target_ranks = (scores > target_scores).sum(dim=1).masked_fill(
+            targets[:, 0] >= nb_classes, nb_classes
+        )
+
+        return cls(
+            topk_indexes.cpu().numpy(),
+            topk_scores.float().cpu().numpy(),
+            target_ranks.cpu().numpy(), nb_classes
+        )
+
+    @classmethod
+    def concatenate(cls, predictions):
+        return cls(
+            np.concatenate([p.indexes for p in predictions]),
+            np.concatenate([p.scores for p in predictions]),
+            np.concatenate([p.target_ranks for p in predictions]), predictions[0].nb_classes
+        )
+
+    @property
+    def shape(self):
+        return (len(self.indexes), self.nb_classes)
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def __getitem__(self, indexes):
+        return TopkPredictions(
+            self.indexes[indexes], self.scores[indexes], self.target_ranks[indexes],
+            self.nb_classes
+        )
+
+    def argmax(self, axis=1):
+        assert axis in (1, -1), "Only the classes axis is kept."
+        return self.indexes[:, 0]
+
+    def as_dict(self):
+        return {
+            "topk_indexes": self.indexes,
+            "topk_scores": self.scores,
+            "target_ranks": self.target_ranks,
+            "nb_classes": self.nb_classes
+        }
+
+
+class StreamingAccuracy:
+    """Counts per class of the correct top-k predictions.
+
+    All the accuracies of `MetricLogger` are read from those counts, instead
+    of sorting the predictions once per metric.
+
+    :param nb_classes: The number of classes of the targets.
+    :param topk: The largest k of the top-k accuracies.
+    """
+
+    def __init__(self, nb_classes, topk=5):
+        self.topk = topk
+        self.nb_predicted_classes = 0
+
+        self.nb_samples = np.zeros((nb_classes,), dtype=np.int64)
+        # `nb_correct[c, k - 1]` samples of class c have it in their top-k:
+        self.nb_correct = np.zeros((nb_classes, topk), dtype=np.int64)
+
+    def update(self, predictions, targets):
+        """Counts a batch of predictions.
+
+        :param predictions: A `TopkPredictions`, or an array of scores (B, C).
+        :param targets: The true classes array.
+        """
+        if not isinstance(predictions, TopkPredictions):
+            predictions = TopkPredictions.from_scores(
+                torch.as_tensor(predictions), torch.as_tensor(targets), topk=self.topk
+            )
+        self.nb_predicted_classes = max(self.nb_predicted_classes, predictions.nb_classes)
+
+        if len(targets) > 0 and targets.max() >= len(self.nb_samples):  # Unexpected classes.
+            nb_missing = targets.max() + 1 - len(self.nb_samples)
+            self.nb_samples = np.pad(self.nb_samples, (0, nb_missing))
+            self.nb_correct = np.pad(self.nb_correct, ((0, nb_missing), (0, 0)))
+
+        correct = np.cumsum(predictions.indexes[:, :self.topk] == targets[:, None], axis=1)
+        if correct.shape[1] < self.topk:  # Less classes than k, all are in the top-k.
+            correct = np.pad(correct, ((0, 0), (0, self.topk - correct.shape[1])), mode="edge")
+
+        nb_classes = len(self.nb_samples)
+        self.nb_samples += np.bincount(targets, minlength=nb_classes)
+        for k in range(self.topk):
+            self.nb_correct[:, k] += np.bincount(
+                targets, weights=correct[:, k], minlength=nb_classes
+            ).astype(np.int64)
+
+    @property
+    def max_class(self):
+        return np.nonzero(self.nb_samples)[0].max()
+
+    def accuracy(self, classes=None, topk=1):
+        """Top-k accuracy over some classes, as `accuracy` with their samples.
+
+        :param classes: A boolean mask or indexes of the classes, all if None.
+        """
+        if classes is None:
+            classes = slice(None)
+        nb_samples = self.nb_samples[classes]
+
+        if nb_samples.sum() == 0:
+            return 0.
+        topk = min(topk, np.count_nonzero(nb_samples))
+
+        return round(float(self.nb_correct[classes, topk - 1].sum() / nb_samples.sum()), 3)
+
+    def accuracy_per_task(self, task_size=10, topk=1):
+        """Accuracy for the whole test & per task, as `accuracy_per_task`."""
+        all_acc = {}
+
+        all_acc["total"] = self.accuracy(topk=topk)
+
+        if task_size is not None:
+            max_class = self.max_class
+            for class_id in range(0, max_class + 1, task_size):
+                label = "{}-{}".format(
+                    str(class_id).rjust(2, "0"),
+                    str(class_id + task_size - 1).rjust(2, "0")
+                )
+                all_acc[label] = self.accuracy(slice(class_id, class_id + task_size), topk=topk)
+
+        return all_acc
+
+    def old_accuracy(self, task_size):
+        return self.accuracy(slice(0, self.nb_predicted_classes - task_size))
+
+    def new_accuracy(self, task_size):
+        return self.accuracy(slice(self.nb_predicted_classes - task_size, None))
+
+
+class _Zero:
+    """Sum of a metric not seen yet, to which a value is added as a float32 copy."""
+
+    def __add__(self, other):
+        if isinstance(other, torch.Tensor):
+            # Summed in float32 whatever the autocast dtype, never aliasing the loss:
+            return other.detach().to(torch.float32, copy=True)
+        return other
+
+    __radd__ = __add__
+
+
+_ZERO = _Zero()
+
+
+class RunningMetrics:
+    """Running sums of the training losses, kept on device.
+
+    Used as the `defaultdict(float)` it replaces, with detached tensors:
+    `metrics["nca"] += loss.detach()` doesn't synchronize the device. The sums
+    are only read back, in a single transfer, by `reduce`: every `reduce_every`
+    steps if set, and whenever the training loop displays them.
+
+    Every term added is also checked on device to be finite, and the term of
+    the total loss to be non-negative. The other losses may be negative. The
+    flags are accumulated on device too, and read back with the sums: `reduce`
+    raises if any term was invalid since the start.
+
+    :param reduce_every: Number of steps between two reductions.
+    :param total: Name of the total loss.
+    """
+
+    def __init__(self, reduce_every=None, total="loss"):
+        self.reduce_every = reduce_every
+        self.total = total
+
+        self._sums = collections.OrderedDict()
+        self._reduced = collections.OrderedDict()
+        self._invalid = collections.OrderedDict()
+        self.nb_steps = 0
+        self.nb_reduced_steps = 0
+
+    def __getitem__(self, name):
+        value = self._sums.get(name, _ZERO)
+        # A copy, as `+=` adds in place, and the previous sum is checked against:
+        return value.clone() if isinstance(value, torch.Tensor) else value
+
+    def __setitem__(self, name, value):
+        if isinstance(value, torch.Tensor):
+            value = value.detach()
+
+            # A non-finite term makes its sum non-finite, and a negative one decreases it:
+            invalid = ~torch.isfinite(value)
+            if name == self.total:
+                invalid |= value < self._sums.get(name, 0.)
+            if name in self._invalid:
+                invalid |= self._invalid[name]
+            self._invalid[name] = invalid
+        self._sums[name] = value
+
+    def __contains__(self, name):
+        return name in self._sums
+
+    def __repr__(self):
+        return repr(dict(self._reduced))
+
+    def step(self):
+        """Ends a step.
+
+        :return: Whether a reduction is due.
+        """
+        self.nb_steps += 1
+        return bool(self.reduce_every) and self.nb_steps % self.reduce_every == 0
+
+    def reduce(self):
+        """Reads back the sums on the host, with the invalid terms flags.
+
+        :raises ValueError: If a term was NaN or infinite, or the total loss
+                            negative, since the start.
+        """
+        names = [name for name, value in self._sums.items() if isinstance(value, torch.Tensor)]
+        invalid_names = []
+        if names:
+            device = self._sums[names[0]].device
+            values = torch.stack(
+                [self._sums[name].to(device) for name in names] +
+                [self._invalid[name].to(device, torch.float32) for name in names]
+            ).tolist()
+            self._reduced.update(zip(names, values[:len(names)]))
+            invalid_names = [
+                name for name, invalid in zip(names, values[len(names):]) if invalid
+            ]
+        self._reduced.update(
+            (name, value)
+            for name, value in self._sums.items()
+            if not isinstance(value, torch.Tensor)
+        )
+        self.nb_reduced_steps = self.nb_steps
+
+        if invalid_names:
+            raise ValueError(
+                "Losses {} were NaN, infinite, or negative within the first {} steps: {}".format(
+                    invalid_names, self.nb_steps, dict(self._reduced)
+                )
+            )
+        return dict(self._reduced)
+
+    def items(self):
+        """Sums as of the last reduction."""
+        return self._reduced.items()
+
+    def means(self):
+        """Means per step as of the last reduction."""
+        nb_steps = max(self.nb_reduced_steps, 1)
+        return {name: value / nb_steps for name, value in self._reduced.items()}
+
+
 def cord_metric(accuracy_matrix, only=None):
     accuracies = []
 
@@ -169,7 +458,7 @@ def new_accuracy(ypreds, ytrue, task_size):
 
 def accuracy(output, targets, topk=1):
     """Computes the precision@k for the specified values of k"""
-    output, targets = torch.tensor(output), torch.tensor(targets)
+    targets = torch.tensor(targets)
 
     batch_size = targets.shape[0]
     if batch_size == 0:
@@ -177,7 +466,13 @@ def accuracy(output, targets, topk=1):
     nb_classes = len(np.unique(targets))
     topk = min(topk, nb_classes)
 
-    _, pred = output.topk(topk, 1, True, True)
+    if isinstance(output, TopkPredictions):
+        assert topk <= output.indexes.shape[1], "Only the top-{} is kept.".format(
+            output.indexes.shape[1]
+        )
+        pred = torch.tensor(output.indexes[:, :topk])
+    else:
+        _, pred = torch.tensor(output).topk(topk, 1, True, True)
     pred = pred.t()
     correct = pred.eq(targets.view(1, -1).expand_as(pred))
 
@@ -48,6 +48,7 @@ class BasicNet(nn.Module):
         logger.info("Post processor is: {}".format(self.post_processor))
 
         self.convnet = factory.get_convnet(convnet_type, **convnet_kwargs)
+        self.channels_last = convnet_kwargs.get("channels_last", False)
 
         if "type" not in classifier_kwargs:
             raise ValueError("Specify a classifier!", classifier_kwargs)
@@ -117,7 +118,7 @@ class BasicNet(nn.Module):
         else:
             words = None
 
-        outputs = self.convnet(x)
+        outputs = self.convnet(self._to_memory_format(x))
         if words is not None:  # ugly to change
             outputs["word_embeddings"] = self.word_embeddings(words)
 
@@ -173,7 +174,7 @@ class BasicNet(nn.Module):
         self.classifier.add_custom_weights(weights, **kwargs)
 
     def extract(self, x):
-        outputs = self.convnet(x)
+        outputs = self.convnet(self._to_memory_format(x))
         if self.extract_no_act:
             return outputs["raw_features"]
         return outputs["features"]
@@ -181,7 +182,12 @@ class BasicNet(nn.Module):
     def predict_rotations(self, inputs):
         if self.rotations_predictor is None:
             raise ValueError("Enable the rotations predictor.")
-        return self.rotations_predictor(self.convnet(inputs)["features"])
+        return self.rotations_predictor(self.convnet(self._to_memory_format(inputs))["features"])
+
+    def _to_memory_format(self, x):
+        if getattr(self, "channels_last", False) and x.dim() == 4:
+            return x.contiguous(memory_format=torch.channels_last)
+        return x
 
     def freeze(self, trainable=False, model="all"):
         if model == "all":
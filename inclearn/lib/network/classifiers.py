@@ -1,13 +1,13 @@
 import copy
 import logging
 
-import numpy as np
 import torch
 from sklearn.cluster import KMeans
 from torch import nn
 from torch.nn import functional as F
 
 from inclearn.lib import distance as distance_lib
+from inclearn.lib import features as features_lib
 from inclearn.lib import utils
 
 from .postprocessors import FactorScalar, HeatedUpScalar
@@ -218,7 +218,9 @@ class CosineClassifier(nn.Module):
         super().__init__()
 
         self.n_classes = 0
+        # Each task's weights are a view of a single, growable, storage:
         self._weights = nn.ParameterList([])
+        self._weights_storage = None
         self.bias = None
         self.features_dim = features_dim
         self.proxy_per_class = proxy_per_class
@@ -298,45 +300,56 @@ class CosineClassifier(nn.Module):
         else:
             raise NotImplementedError("Unknown distance function {}.".format(self.distance))
 
+        similarities = self._merge_similarities(raw_similarities)
+
+        return {"logits": similarities, "raw_logits": raw_similarities}
+
+    def _merge_similarities(self, raw_similarities):
+        """Merges the proxies of each class, or biases the negative weights.
+
+        The merging is fused. The float & top-k biases are applied in place on
+        the negative weights' similarities, the min & max ones on a copy.
+        """
         if self.proxy_per_class > 1:
-            similarities = self._reduce_proxies(raw_similarities)
-        else:
-            similarities = raw_similarities
-
-            if self._negative_weights is not None and self.negative_weights_bias is not None and\
-               self.training is True:
-                qt = self._negative_weights.shape[0]
-                if isinstance(self.negative_weights_bias, float):
-                    similarities[..., -qt:] = torch.clamp(
-                        similarities[..., -qt:] - self.negative_weights_bias, min=0
-                    )
-                elif isinstance(
-                    self.negative_weights_bias, str
-                ) and self.negative_weights_bias == "min":
-                    min_simi = similarities[..., :-qt].min(dim=1, keepdim=True)[0]
-                    similarities = torch.min(
-                        similarities,
-                        torch.cat((similarities[..., :-qt], min_simi.repeat(1, qt)), dim=1)
-                    )
-                elif isinstance(
-                    self.negative_weights_bias, str
-                ) and self.negative_weights_bias == "max":
-                    max_simi = similarities[..., :-qt].max(dim=1, keepdim=True)[0] - 1e-6
-                    similarities = torch.min(
-                        similarities,
-                        torch.cat((similarities[..., :-qt], max_simi.repeat(1, qt)), dim=1)
-                    )
-                elif isinstance(self.negative_weights_bias,
-                                str) and self.negative_weights_bias.startswith("top_"):
-                    topk = int(self.negative_weights_bias.replace("top_", ""))
-                    botk = min(qt - topk, qt)
+            return self._reduce_proxies(raw_similarities)
+        elif self._negative_weights is None or self.negative_weights_bias is None or \
+             self.training is not True:
+            return raw_similarities
+
+        similarities = raw_similarities
+        qt = self._negative_weights.shape[0]
+        negative_similarities = similarities[..., -qt:]
+
+        if isinstance(self.negative_weights_bias, float):
+            negative_similarities.copy_(
+                torch.clamp(negative_similarities - self.negative_weights_bias, min=0)
+            )
+        elif isinstance(self.negative_weights_bias, str) and \
+             self.negative_weights_bias in ("min", "max"):
+            if self.negative_weights_bias == "min":
+                bound = similarities[..., :-qt].min(dim=1, keepdim=True)[0]
+            else:
+                bound = similarities[..., :-qt].max(dim=1, keepdim=True)[0] - 1e-6
+            # Like torch.min, but `where` only saves the mask for the backward. Out
+            # of place, the raw similarities are returned unbiased:
+            similarities = torch.cat(
+                (
+                    similarities[..., :-qt],
+                    torch.where(negative_similarities > bound, bound, negative_similarities)
+                ),
+                dim=1
+            )
+        elif isinstance(self.negative_weights_bias,
+                        str) and self.negative_weights_bias.startswith("top_"):
+            topk = int(self.negative_weights_bias.replace("top_", ""))
+            botk = min(qt - topk, qt)
 
-                    indexes = (-similarities[..., -qt:]).topk(botk, dim=1)[1]
-                    similarities[..., -qt:].scatter_(1, indexes, 0.)
-                else:
-                    raise NotImplementedError(f"Unknown {self.negative_weights_bias}.")
+            indexes = (-negative_similarities).topk(botk, dim=1)[1]
+            negative_similarities.scatter_(1, indexes, 0.)
+        else:
+            raise NotImplementedError(f"Unknown {self.negative_weights_bias}.")
 
-        return {"logits": similarities, "raw_logits": raw_similarities}
+        return similarities
 
     def _reduce_proxies(self, similarities):
         # shape (batch_size, n_classes * proxy_per_class)
@@ -345,16 +358,16 @@ class CosineClassifier(nn.Module):
         n_classes = int(n_classes)
         bs = similarities.shape[0]
 
+        simi_per_class = similarities.view(bs, n_classes, self.proxy_per_class)
         if self.merging == "mean":
-            return similarities.view(bs, n_classes, self.proxy_per_class).mean(-1)
+            return simi_per_class.mean(-1)
         elif self.merging == "softmax":
-            simi_per_class = similarities.view(bs, n_classes, self.proxy_per_class)
-            attentions = F.softmax(self.gamma * simi_per_class, dim=-1)  # shouldn't be -gamma?
-            return (simi_per_class * attentions).sum(-1)
+            # shouldn't be -gamma?
+            return _SoftmaxMerging.apply(simi_per_class, self.gamma)
         elif self.merging == "max":
-            return similarities.view(bs, n_classes, self.proxy_per_class).max(-1)[0]
+            return simi_per_class.max(-1)[0]
         elif self.merging == "min":
-            return similarities.view(bs, n_classes, self.proxy_per_class).min(-1)[0]
+            return simi_per_class.min(-1)[0]
         else:
             raise ValueError("Unknown merging for multiple centers: {}.".format(self.merging))
 
@@ -383,7 +396,7 @@ class CosineClassifier(nn.Module):
             else:
                 raise NotImplementedError(f"Unknown ponderation type {ponderate}.")
 
-        self._weights.append(nn.Parameter(weights))
+        self._append_weights(weights)
         self.to(self.device)
 
     def align_weights(self):
@@ -402,16 +415,19 @@ class CosineClassifier(nn.Module):
             old_norm = torch.mean(old_weights.norm(dim=1))
             new_norm = torch.mean(self.new_weights.norm(dim=1))
 
-            self._weights[-1] = nn.Parameter((old_norm / new_norm) * self._weights[-1])
+            self._weights[-1].mul_(old_norm / new_norm)
 
     def align_weights_i_to_j(self, indexes_i, indexes_j):
         with torch.no_grad():
-            base_weights = self.weights[indexes_i]
+            # `weights` used to be a concatenated copy, that the rescaling was
+            # written into: it must keep not modifying the parameters.
+            weights = self.weights.clone()
+            base_weights = weights[indexes_i]
 
             old_norm = torch.mean(base_weights.norm(dim=1))
-            new_norm = torch.mean(self.weights[indexes_j].norm(dim=1))
+            new_norm = torch.mean(weights[indexes_j].norm(dim=1))
 
-            self.weights[indexes_j] = nn.Parameter((old_norm / new_norm) * self.weights[indexes_j])
+            weights[indexes_j] = nn.Parameter((old_norm / new_norm) * weights[indexes_j])
 
     def align_inv_weights(self):
         """Align new weights based on old weights norm.
@@ -426,11 +442,16 @@ class CosineClassifier(nn.Module):
             old_norm = torch.mean(old_weights.norm(dim=1))
             new_norm = torch.mean(self.new_weights.norm(dim=1))
 
-            self._weights[-1] = nn.Parameter((new_norm / old_norm) * self._weights[-1])
+            self._weights[-1].mul_(new_norm / old_norm)
 
     @property
     def weights(self):
-        return torch.cat([clf for clf in self._weights])
+        # The graph is traced with the weights already packed, see `_apply`:
+        if not _is_compiling() and not self._is_packed():
+            self._pack_weights()
+
+        nb_weights = sum(len(w) for w in self._weights)
+        return _ContiguousWeights.apply(self._weights_storage[:nb_weights], *self._weights)
 
     @property
     def new_weights(self):
@@ -443,15 +464,90 @@ class CosineClassifier(nn.Module):
         return None
 
     def add_classes(self, n_classes):
-        new_weights = nn.Parameter(torch.zeros(self.proxy_per_class * n_classes, self.features_dim))
+        new_weights = torch.zeros(self.proxy_per_class * n_classes, self.features_dim)
         nn.init.kaiming_normal_(new_weights, nonlinearity="linear")
 
-        self._weights.append(new_weights)
+        self._append_weights(new_weights)
 
         self.to(self.device)
         self.n_classes += n_classes
         return self
 
+    def _append_weights(self, weights):
+        """Adds a task's weights as a parameter viewing the storage's next rows.
+
+        The storage doubles its capacity when full, thus the previous weights
+        are only copied when that happens, not at every forward.
+        """
+        if not self._is_packed():
+            self._pack_weights()
+
+        nb_weights = sum(len(w) for w in self._weights)
+        if self._weights_storage is None or nb_weights + len(weights) > len(
+            self._weights_storage
+        ):
+            capacity = 0 if self._weights_storage is None else 2 * len(self._weights_storage)
+            self._pack_weights(
+                max(capacity, nb_weights + len(weights)),
+                device=self.device if self.device is not None else weights.device
+            )
+
+        new_weights = self._weights_storage[nb_weights:nb_weights + len(weights)]
+        with torch.no_grad():
+            new_weights.copy_(weights)
+        self._weights.append(nn.Parameter(new_weights))
+
+    def _is_packed(self):
+        """Whether all weights are views of successive rows of the storage."""
+        storage = self._weights_storage
+        if storage is None:
+            return len(self._weights) == 0
+
+        offset = 0
+        for w in self._weights:
+            row_ptr = storage.data_ptr() + offset * storage.stride(0) * storage.element_size()
+            if w.device != storage.device or w.dtype != storage.dtype or \
+               w.shape[1:] != storage.shape[1:] or not w.is_contiguous() or \
+               offset + len(w) > len(storage) or w.data_ptr() != row_ptr:
+                return False
+            offset += len(w)
+        return True
+
+    def _pack_weights(self, capacity=0, device=None):
+        """Copies the weights in a new storage, the parameters viewing it.
+
+        The parameters are the same objects, as referenced by the optimizer.
+        """
+        nb_weights = sum(len(w) for w in self._weights)
+        if len(self._weights) > 0:
+            reference = self._weights[0]
+        elif self._weights_storage is not None:
+            reference = self._weights_storage
+        else:
+            reference = torch.empty(0, self.features_dim, device=device)
+
+        storage = reference.new_zeros((max(capacity, nb_weights), self.features_dim))
+        offset = 0
+        for w in self._weights:
+            storage[offset:offset + len(w)] = w.data
+            w.data = storage[offset:offset + len(w)]
+            offset += len(w)
+        self._weights_storage = storage
+
+    def _apply(self, *args, **kwargs):
+        # E.g. `.to()` to another device, replacing the parameters:
+        module = super()._apply(*args, **kwargs)
+        if not self._is_packed():
+            self._pack_weights(0 if self._weights_storage is None else len(self._weights_storage))
+        return module
+
+    def __setstate__(self, state):
+        # Deepcopy & unpickling don't preserve the views:
+        state.setdefault("_weights_storage", None)
+        super().__setstate__(state)
+        if not self._is_packed():
+            self._pack_weights(0 if self._weights_storage is None else len(self._weights_storage))
+
     def add_imprinted_classes(
         self, class_indexes, inc_dataset, network, multi_class_diff="normal", type=None
     ):
@@ -462,11 +558,12 @@ class CosineClassifier(nn.Module):
         avg_weights_norm = torch.mean(weights_norm, dim=0).cpu()
 
         new_weights = []
-        for class_index in class_indexes:
-            _, loader = inc_dataset.get_custom_loader([class_index])
-            features, _ = utils.extract_features(network, loader)
-
-            features_normalized = F.normalize(torch.from_numpy(features), p=2, dim=1)
+        for class_features in features_lib.iter_class_features(
+            network, inc_dataset, class_indexes, flip=False
+        ):
+            features_normalized = F.normalize(
+                torch.from_numpy(class_features.features), p=2, dim=1
+            )
             class_embeddings = torch.mean(features_normalized, dim=0)
             class_embeddings = F.normalize(class_embeddings, dim=0, p=2)
 
@@ -490,7 +587,7 @@ class CosineClassifier(nn.Module):
                     )
 
         new_weights = torch.stack(new_weights)
-        self._weights.append(nn.Parameter(new_weights))
+        self._append_weights(new_weights)
 
         self.to(self.device)
         self.n_classes += len(class_indexes)
@@ -544,29 +641,22 @@ class MCCosineClassifier(CosineClassifier):
         if self.training:
             return super().forward(F.dropout(x, p=self._dropout))
 
-        sampled_similarities = torch.zeros(x.shape[0], self.nb_samples,
-                                           self.n_classes).to(x.device).float()
-        for i in range(self.nb_samples):
-            similarities = super().forward(F.dropout(x, p=self._dropout))["logits"]
-            sampled_similarities[:, i] = similarities
+        # All samples at once, their dropout masks drawn in a single (S, B, D) tensor:
+        sampled_x = F.dropout(x.expand(self.nb_samples, *x.shape), p=self._dropout)
+        sampled_similarities = super().forward(sampled_x.reshape(-1, x.shape[-1]))["logits"]
+        sampled_similarities = sampled_similarities.view(self.nb_samples, x.shape[0], -1)
 
         return {
-            "logits": sampled_similarities.mean(dim=1),
-            "var_ratio": self.var_ratio(sampled_similarities)
+            "logits": sampled_similarities.mean(dim=0),
+            "var_ratio": self.var_ratio(sampled_similarities.transpose(0, 1))
         }
 
     def var_ratio(self, sampled_similarities):
-        predicted_class = sampled_similarities.max(dim=2)[1].cpu().numpy()
-
-        hist = np.array(
-            [
-                np.histogram(predicted_class[i, :], range=(0, 10))[0]
-                for i in range(predicted_class.shape[0])
-            ]
+        """Variation ratio of the samples of shape (B, S, C), on device."""
+        return utils.variation_ratio(
+            sampled_similarities.argmax(dim=2), sampled_similarities.shape[2]
         )
 
-        return 1. - hist.max(axis=1) / self.nb_samples
-
 
 class CosineM2KDClassifier(CosineClassifier):
 
@@ -633,6 +723,55 @@ class GradReverse(torch.autograd.Function):
         return grad_output.neg()
 
 
+class _ContiguousWeights(torch.autograd.Function):
+    """Gives the weights' storage, as if the weights were concatenated.
+
+    The weights are views of the storage, thus no copy is made, and their
+    gradients are views of the storage's gradient.
+    """
+
+    @staticmethod
+    def forward(ctx, storage, *weights):
+        ctx.sizes = [len(w) for w in weights]
+        return storage
+
+    @staticmethod
+    def backward(ctx, grad_storage):
+        return (None, *grad_storage.split(ctx.sizes))
+
+
+def _is_compiling():
+    """Whether `torch.compile` is tracing, `torch.compiler` being torch >= 2.3 only."""
+    compiler = getattr(torch, "compiler", None)
+    return compiler is not None and hasattr(compiler, "is_compiling") and \
+        compiler.is_compiling()
+
+
+class _SoftmaxMerging(torch.autograd.Function):
+    """Sum of the similarities weighted by their softmax, over the last dim.
+
+    The backward is fused as dy/dx_i = a_i (1 + gamma (x_i - y)), with the
+    softmax a, instead of the softmax, product & sum backwards.
+    """
+
+    @staticmethod
+    def forward(ctx, similarities, gamma):
+        attentions = F.softmax(gamma * similarities, dim=-1)
+        # Summed in the same order as the unfused merging, a batched matmul isn't:
+        merged = (attentions * similarities.to(attentions.dtype)).sum(-1)
+
+        ctx.gamma = gamma
+        ctx.save_for_backward(similarities, attentions, merged)
+        return merged
+
+    @staticmethod
+    def backward(ctx, grad_merged):
+        similarities, attentions, merged = ctx.saved_tensors
+
+        grad = (similarities - merged[..., None]).mul_(ctx.gamma).add_(1.)
+        return grad.mul_(attentions).mul_(grad_merged[..., None]), None
+
+
 class BinaryCosineClassifier(nn.Module):
 
     def __init__(self, features_dim):
@@ -0,0 +1,227 @@
+"""Teacher (old model) outputs used by the distillation losses.
+
+The old model is frozen during a task, thus its outputs only depend on the
+augmented input. With determinist augmentations (see
+`samplers.AugmentationSeedSampler`), a sample is identified by its index in
+the task dataset and its augmentation slot, and the old model only has to be
+run the first time a (index, slot) pair is seen.
+
+Else, the old model can be run alongside the new one, see `fused_forward`.
+"""
+import logging
+import os
+
+import numpy as np
+import torch
+
+from inclearn.lib.losses import distillation
+
+logger = logging.getLogger(__name__)
+
+
+class TeacherCache:
+    """Caches the raw features, logits, and pooled attention maps of a teacher.
+
+    Entries are stored as flat float32 rows: up to `max_size` MB in RAM, and
+    the remaining ones on disk if a `spill_path` is given, else they are
+    recomputed every time.
+
+    :param nb_augmentations: Number of augmentation slots per sample, must be
+                             the same as the dataset `nb_augmentation_slots`.
+                             It has no default, as it trades augmentation
+                             diversity for cache hits: the same crops & flips
+                             are replayed every `nb_augmentations` epochs, and
+                             the old model is run on the first
+                             `nb_augmentations` epochs only. Set it to the
+                             number of epochs to keep all augmentations.
+    :param max_size: Memory budget in MB.
+    :param spill_path: Directory where entries over the budget are written,
+                       deleted when the cache is reset.
+    """
+
+    def __init__(self, nb_augmentations, max_size=2048, spill_path=None):
+        self.max_size = int(max_size * 1024**2)
+        self.spill_path = spill_path
+        self.nb_slots = nb_augmentations
+
+        self._disk, self._disk_path = None, None
+        self.reset(0)
+
+    def reset(self, nb_samples):
+        """Empties the cache, for a new dataset or a new teacher.
+
+        :param nb_samples: Number of samples of the training dataset.
+        """
+        self._slots = np.full((nb_samples * self.nb_slots,), -1, dtype=np.int64)
+        self._nb_entries = 0
+        self._layout = None
+        self._ram = None
+
+        if self._disk is not None:
+            del self._disk
+            os.remove(self._disk_path)
+        self._disk, self._disk_path = None, None
+
+    def __call__(self, teacher, inputs, indexes, slots, collapse_channels=None):
+        """Returns the teacher outputs, from the cache when all entries are present.
+
+        :param teacher: The frozen teacher network.
+        :param inputs: The batch inputs, on the teacher device.
+        :param indexes: The samples indexes in the dataset.
+        :param slots: The augmentation slots of the samples.
+        :param collapse_channels: POD pooling of the attention maps, which
+                                  are not returned if None.
+        :return: A dict of "raw_features", "logits", and "attention", the list
+                 of pooled attention maps.
+        """
+        keys = np.asarray(indexes, dtype=np.int64) * self.nb_slots + np.asarray(slots)
+        entries = self._slots[keys]
+
+        if self._layout is not None and (entries >= 0).all():
+            return self._unflatten(self._read(entries).to(inputs.device, non_blocking=True))
+
+        outputs = teacher_forward(teacher, inputs, collapse_channels=collapse_channels)
+        if collapse_channels is None:
+            outputs["attention"] = []
+
+        if self._layout is None:
+            self._allocate(outputs)
+        missing = np.where(entries < 0)[0]
+        self._write(
+            keys[missing],
+            self._flatten(outputs)[torch.from_numpy(missing).to(inputs.device)].cpu()
+        )
+
+        return outputs
+
+    def _allocate(self, outputs):
+        tensors = [outputs["raw_features"], outputs["logits"], *outputs["attention"]]
+        self._layout = [tensor.shape[1] for tensor in tensors]
+        width = sum(self._layout)
+
+        nb_keys = len(self._slots)
+        self._ram_capacity = min(nb_keys, self.max_size // (4 * width))
+        self._ram = torch.empty((self._ram_capacity, width), dtype=torch.float32)
+
+        if self.spill_path and self._ram_capacity < nb_keys:
+            os.makedirs(self.spill_path, exist_ok=True)
+            self._disk_path = os.path.join(
+                self.spill_path, "teacher_cache_{}.bin".format(os.getpid())
+            )
+            logger.info(
+                "Spilling {} teacher entries in {}.".format(
+                    nb_keys - self._ram_capacity, self._disk_path
+                )
+            )
+            self._disk = np.memmap(
+                self._disk_path,
+                dtype=np.float32,
+                mode="w+",
+                shape=(nb_keys - self._ram_capacity, width)
+            )
+        self._capacity = self._ram_capacity + (len(self._disk) if self._disk is not None else 0)
+
+    def _write(self, keys, rows):
+        nb_written = min(len(keys), self._capacity - self._nb_entries)
+        if nb_written == 0:
+            return
+
+        entries = np.arange(self._nb_entries, self._nb_entries + nb_written)
+        self._slots[keys[:nb_written]] = entries
+        self._nb_entries += nb_written
+
+        rows, in_ram = rows[:nb_written], entries < self._ram_capacity
+        self._ram[torch.from_numpy(entries[in_ram])] = rows[torch.from_numpy(in_ram)]
+        if not in_ram.all():
+            self._disk[entries[~in_ram] - self._ram_capacity] = rows[torch.from_numpy(~in_ram)
+                                                                     ].numpy()
+
+    def _read(self, entries):
+        in_ram = entries < self._ram_capacity
+        if in_ram.all():
+            return self._ram[torch.from_numpy(entries)]
+
+        rows = torch.empty((len(entries), self._ram.shape[1]), dtype=torch.float32)
+        rows[torch.from_numpy(in_ram)] = self._ram[torch.from_numpy(entries[in_ram])]
+        rows[torch.from_numpy(~in_ram)] = torch.from_numpy(
+            self._disk[entries[~in_ram] - self._ram_capacity]
+        )
+        return rows
+
+    def _flatten(self, outputs):
+        return torch.cat(
+            [outputs["raw_features"], outputs["logits"], *outputs["attention"]], dim=1
+        ).float()
+
+    def _unflatten(self, rows):
+        raw_features, logits, *attention = torch.split(rows, self._layout, dim=1)
+        return {"raw_features": raw_features, "logits": logits, "attention": attention}
+
+
+def teacher_forward(teacher, inputs, collapse_channels=None):
+    """Runs the frozen teacher, pooling its attention maps as `losses.pod` does.
+
+    :param teacher: The frozen teacher network.
+    :param inputs: The batch inputs, on the teacher device.
+    :param collapse_channels: POD pooling of the attention maps, kept as is if None.
+    :return: The teacher outputs.
+    """
+    with torch.no_grad():
+        outputs = teacher(inputs)
+        if collapse_channels is not None:
+            outputs["attention"] = [
+                distillation.pod_pooling(att, collapse_channels) for att in outputs["attention"]
+            ]
+    return outputs
+
+
+def fused_forward(student, teacher, inputs, collapse_channels=None):
+    """Runs the student and the frozen teacher on the same batch.
+
+    On CUDA, the teacher runs on a side stream concurrently with the student,
+    and its attention maps are pooled as soon as they are computed, so that
+    the full maps are freed early. On CPU, both networks run one after the
+    other: their weights differ, thus they can't be merged in a single batch.
+
+    :param student: The trained network.
+    :param teacher: The frozen teacher network.
+    :param inputs: The batch inputs, already on the device.
+    :param collapse_channels: POD pooling of the teacher attention maps.
+    :return: The student and teacher outputs.
+    """
+    if not inputs.is_cuda:
+        teacher_outputs = teacher_forward(teacher, inputs, collapse_channels=collapse_channels)
+        return student(inputs), teacher_outputs
+
+    main_stream = torch.cuda.current_stream(inputs.device)
+    side_stream = _get_side_stream(inputs.device)
+
+    side_stream.wait_stream(main_stream)  # Inputs must be ready.
+    with torch.cuda.stream(side_stream):
+        teacher_outputs = teacher_forward(teacher, inputs, collapse_channels=collapse_channels)
+    inputs.record_stream(side_stream)
+
+    outputs = student(inputs)
+
+    main_stream.wait_stream(side_stream)
+    for tensor in _iter_tensors(teacher_outputs):
+        tensor.record_stream(main_stream)
+
+    return outputs, teacher_outputs
+
+
+_side_streams = {}
+
+
+def _get_side_stream(device):
+    if device not in _side_streams:
+        _side_streams[device] = torch.cuda.Stream(device)
+    return _side_streams[device]
+
+
+def _iter_tensors(outputs):
+    for value in outputs.values():
+        if isinstance(value, torch.Tensor):
+            yield value
+        elif isinstance(value, (list, tuple)):
+            yield from (v for v in value if isinstance(v, torch.Tensor))
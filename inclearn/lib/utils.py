@@ -11,6 +11,8 @@ from sklearn import manifold
 from sklearn.cluster import KMeans
 from sklearn.neighbors import KNeighborsClassifier
 
+from inclearn.lib import features as features_lib
+
 logger = logging.getLogger(__name__)
 
 
@@ -20,6 +22,19 @@ def to_onehot(targets, n_classes):
     return onehot
 
 
+def variation_ratio(predictions, nb_classes):
+    """Variation ratio, 1 - the frequency of the mode, of sampled predictions.
+
+    :param predictions: A tensor of predicted classes of shape (B, S).
+    :param nb_classes: The number of classes.
+    :return: A tensor of shape (B,), on the same device.
+    """
+    counts = torch.zeros(predictions.shape[0], nb_classes, device=predictions.device)
+    counts.scatter_add_(1, predictions, torch.ones_like(predictions, dtype=counts.dtype))
+
+    return 1. - counts.max(dim=1)[0] / predictions.shape[1]
+
+
 def check_loss(loss):
     return not bool(torch.isnan(loss).item()) and bool((loss >= 0.).item())
 
@@ -65,6 +80,38 @@ def extract_features(model, loader):
     return np.concatenate(features), np.concatenate(targets)
 
 
+def extract_features_with_flip(model, loader):
+    """Extracts features of images and of their horizontal flip.
+
+    Both views come from a loader in `test_flip` mode, thus each image is only
+    decoded once, and both views are fed to the model as a single batch.
+
+    :param model: The model, must have an `extract` method.
+    :param loader: A loader in `test_flip` mode.
+    :return: A tuple of (features, flipped features, targets).
+    """
+    targets, features, features_flipped = [], [], []
+
+    state = model.training
+    model.eval()
+
+    for input_dict in loader:
+        inputs, inputs_flipped = input_dict["inputs"], input_dict["inputs_flipped"]
+        _targets = input_dict["targets"].numpy()
+
+        with torch.no_grad():
+            _features = model.extract(torch.cat((inputs, inputs_flipped)).to(model.device))
+        _features = _features.detach().cpu().numpy()
+
+        features.append(_features[:len(inputs)])
+        features_flipped.append(_features[len(inputs):])
+        targets.append(_targets)
+
+    model.train(state)
+
+    return np.concatenate(features), np.concatenate(features_flipped), np.concatenate(targets)
+
+
 def compute_centroids(model, loader):
     features, targets = extract_features(model, loader)
 
@@ -134,9 +181,11 @@ def add_new_weights(network, weight_generation, current_nb_classes, task_size, i
         logger.info("Generating embedding weights")
 
         mean_embeddings = []
-        for class_index in range(current_nb_classes, current_nb_classes + task_size):
-            _, loader = inc_dataset.get_custom_loader([class_index])
-            features, _ = extract_features(network, loader)
+        for class_features in features_lib.iter_class_features(
+            network, inc_dataset, range(current_nb_classes, current_nb_classes + task_size),
+            flip=False
+        ):
+            features = class_features.features
             features = features / np.linalg.norm(features, axis=-1)[..., None]
 
             mean = np.mean(features, axis=0)
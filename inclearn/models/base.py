@@ -1,4 +1,5 @@
 import abc
+import inspect
 import logging
 import os
 
@@ -24,6 +25,11 @@ class IncrementalLearner(abc.ABC):
     def __init__(self, *args, **kwargs):
         self._network = None
 
+    @property
+    def _eval_task_accuracy(self):
+        """Whether `_eval_task` takes an `accuracy`, which it updates batch per batch."""
+        return "accuracy" in inspect.signature(self._eval_task).parameters
+
     def set_task_info(self, task_info):
         self._task = task_info["task"]
         self._total_n_classes = task_info["total_n_classes"]
@@ -52,10 +58,25 @@ class IncrementalLearner(abc.ABC):
         self.eval()
         self._after_task(inc_dataset)
 
-    def eval_task(self, data_loader):
+    def eval_task(self, data_loader, accuracy=None):
+        """Predicts the classes of a loader.
+
+        :param data_loader: The loader to evaluate.
+        :param accuracy: A `metrics.StreamingAccuracy` to count the predictions
+                         in, after each batch if the model supports it, else
+                         once all are made.
+        :return: The predictions & the true classes.
+        """
         LOGGER.info("eval task")
         self.eval()
-        return self._eval_task(data_loader)
+        if accuracy is None:
+            return self._eval_task(data_loader)
+        if self._eval_task_accuracy:
+            return self._eval_task(data_loader, accuracy=accuracy)
+
+        ypreds, ytrue = self._eval_task(data_loader)
+        accuracy.update(ypreds, ytrue)
+        return ypreds, ytrue
 
     def get_memory(self):
         return None
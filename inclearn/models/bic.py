@@ -128,7 +128,7 @@ class BiC(ICarl):
                 inputs, memory_flags, self._network, self._rotations_config
             )
             loss += rotations_loss
-            self._metrics["rot"] += rotations_loss.item()
+            self._log_metric("rot", rotations_loss)
 
         return loss
 
@@ -28,6 +28,7 @@ class End2End(IncrementalLearner):
         #self._lr_decay = args["lr_decay"]
 
         self._k = args["memory_size"]
+        self._grad_clip = args.get("grad_clip", 2.)
         self._n_classes = 0
 
         self._temperature = args["temperature"]
@@ -135,9 +136,6 @@ class End2End(IncrementalLearner):
     # -----------
 
     def _train(self, train_loader, val_loader, n_epochs, optimizer, scheduler):
-        for p in self._network.parameters():
-            p.register_hook(lambda grad: torch.clamp(grad, -2., 2.))
-
         self._callbacks = [
             #callbacks.GaussianNoiseAnnealing(self._network.parameters()),
             #callbacks.EarlyStopping(self._network, minimize_metric=False)
@@ -179,6 +177,7 @@ class End2End(IncrementalLearner):
                 loss = clf_loss + distil_loss
 
                 loss.backward(retain_graph=True)
+                torch.nn.utils.clip_grad_value_(self._network.parameters(), self._grad_clip)
 
                 #l2reg_grad = 0.
                 #for p in self._network.parameters():
@@ -68,7 +68,7 @@ class GDumb(ICarl):
         self._cutmix_alpha = args.get("cutmix_alpha", 1.0)
         self._cutmix_prob = args.get("cutmix_prob", 0.5)
 
-        self._grad_clip = args.get("grad_clip", 10.0)
+        self._set_training_options(args, grad_clip=10.0)
 
         self._examplars = {}
         self._means = None
@@ -92,10 +92,6 @@ class GDumb(ICarl):
         return self._memory_size // self._n_classes
 
     def _train_task(self, train_loader, val_loader):
-        for p in self._network.parameters():
-            if p.requires_grad:
-                p.register_hook(lambda grad: torch.clamp(grad, -self._grad_clip, self._grad_clip))
-
         if self._task > 0:
             train_loader = self.inc_dataset.get_custom_loader(
                 [], memory=self.get_memory(), mode="train"
@@ -189,12 +185,9 @@ class GDumb(ICarl):
         else:
             loss = F.cross_entropy(logits, targets)
 
-        self._metrics["cce"] += loss.item()
-
-        if not utils.check_loss(loss):
-            raise ValueError("A loss is NaN: {}".format(self._metrics))
+        self._log_metric("cce", loss)
 
-        self._metrics["loss"] += loss.item()
+        self._log_metric("loss", loss)
 
         return loss
 
@@ -1,17 +1,21 @@
 import collections
+import contextlib
 import copy
 import logging
 import os
 import pickle
+import time
 
 import numpy as np
 import torch
-from scipy.spatial.distance import cdist
 from torch import nn
 from torch.nn import functional as F
 from tqdm import tqdm
 
-from inclearn.lib import factory, herding, losses, network, schedulers, utils
+from inclearn.lib import features as features_lib
+from inclearn.lib import (
+    distributed, factory, herding, losses, metrics, network, schedulers, teacher, utils
+)
 from inclearn.lib.network import hook
 from inclearn.models.base import IncrementalLearner
 
@@ -31,6 +35,16 @@ class ICarl(IncrementalLearner):
     :param args: An argparse parsed arguments object.
     """
 
+    # Defaults for the models that don't call `ICarl.__init__`:
+    _teacher_cache = None
+    _fused_teacher = False
+    # POD pooling of the old model attention maps, when only used pooled:
+    _teacher_collapse_channels = None
+    # Whether the old model outputs are differentiable, e.g. for its gradcam:
+    _old_model_grad = False
+    # Features of the new classes, extracted once for the confusion & herding:
+    _feature_cache = None
+
     def __init__(self, args):
         super().__init__()
 
@@ -83,6 +97,9 @@ class ICarl(IncrementalLearner):
         self._data_memory, self._targets_memory = None, None
 
         self._old_model = None
+        self._teacher_cache = self._get_teacher_cache(args)
+        self._fused_teacher = args.get("fused_teacher", False)
+        self._set_training_options(args)
 
         self._clf_loss = F.binary_cross_entropy_with_logits
         self._distil_loss = F.binary_cross_entropy_with_logits
@@ -185,33 +202,108 @@ class ICarl(IncrementalLearner):
         logger.debug("nb {}.".format(len(train_loader.dataset)))
         self._training_step(train_loader, val_loader, 0, self._n_epochs)
 
+    def _set_training_options(self, args, grad_clip=None):
+        """Reads the options of `_training_step`, to be called by the models
+        which don't call `ICarl.__init__`.
+
+        :param args: An argparse parsed arguments object.
+        :param grad_clip: The model default gradients clipping value.
+        """
+        self._mixed_precision = args.get("mixed_precision", False)
+        if self._mixed_precision and not hasattr(torch, "autocast"):
+            raise ValueError("The mixed_precision option needs torch >= 1.10.")
+        self._grad_clip = args.get("grad_clip", grad_clip)
+        self._compile_config = args.get("compile", {})
+        self._metrics_reduce_every = args.get("metrics_reduce_every")
+
+        self._grad_scaler = None
+        self._last_refresh = 0.
+
+    @staticmethod
+    def _get_teacher_cache(args):
+        if not args.get("teacher_cache"):
+            return None
+
+        logger.info("Caching the old model outputs.")
+        return teacher.TeacherCache(**args["teacher_cache"])
+
+    def _old_model_outputs(self, inputs, outputs):
+        """Outputs of the old model, either computed alongside the new model's,
+        read from the teacher cache, or computed now.
+
+        Attention maps are pooled by `losses.pod_pooling` in the first two cases,
+        if `_teacher_collapse_channels` is set.
+        """
+        if "old_outputs" in outputs:
+            return outputs["old_outputs"]
+        if self._teacher_cache is None or "sample_keys" not in outputs:
+            with torch.set_grad_enabled(self._old_model_grad):
+                return self._old_model(inputs)
+
+        return self._teacher_cache(
+            self._old_model,
+            inputs,
+            *outputs["sample_keys"],
+            collapse_channels=self._teacher_collapse_channels
+        )
+
     def _training_step(
         self, train_loader, val_loader, initial_epoch, nb_epochs, record_bn=True, clipper=None
     ):
         best_epoch, best_acc = -1, -1.
         wait = 0
 
-        grad, act = None, None
-        if len(self._multiple_devices) > 1:
+        if self._teacher_cache is not None:
+            self._teacher_cache.reset(len(train_loader.dataset))
+        if not hasattr(self, "_epoch_metrics"):
+            self._epoch_metrics = collections.defaultdict(list)
+
+        # Loss scaling is only needed for float16, bfloat16 has float32's range:
+        self._grad_scaler = None
+        if self._autocast_dtype == torch.float16:
+            if hasattr(torch.amp, "GradScaler"):
+                self._grad_scaler = torch.amp.GradScaler(self._device.type)
+            else:  # Before torch 2.3, only on GPU.
+                self._grad_scaler = torch.cuda.amp.GradScaler()
+
+        grad, act, gradcam_handles = None, None, []
+        if distributed.is_enabled():
+            logger.info(
+                "Distributed training on {} processes.".format(distributed.get_world_size())
+            )
+            # A single replica per process, thus the network's own gradcam hooks are used.
+            training_network = nn.parallel.DistributedDataParallel(
+                self._network,
+                device_ids=[self._device] if self._device.type == "cuda" else None
+            )
+        elif len(self._multiple_devices) > 1:
             logger.info("Duplicating model on {} gpus.".format(len(self._multiple_devices)))
             training_network = nn.DataParallel(self._network, self._multiple_devices)
             if self._network.gradcam_hook:
                 grad, act, back_hook, for_hook = hook.get_gradcam_hook(training_network)
-                training_network.module.convnet.last_conv.register_backward_hook(back_hook)
-                training_network.module.convnet.last_conv.register_forward_hook(for_hook)
+                gradcam_handles = [
+                    training_network.module.convnet.last_conv.register_backward_hook(back_hook),
+                    training_network.module.convnet.last_conv.register_forward_hook(for_hook)
+                ]
         else:
             training_network = self._network
 
+        compiled_forward_loss = self._get_compiled_forward_loss()
+        batch_size = None
+
         for epoch in range(initial_epoch, nb_epochs):
-            self._metrics = collections.defaultdict(float)
+            self._metrics = metrics.RunningMetrics(reduce_every=self._metrics_reduce_every)
 
             self._epoch_percent = epoch / (nb_epochs - initial_epoch)
+            distributed.set_epoch(train_loader, epoch)
 
+            recording_bn = False
             if epoch == nb_epochs - 1 and record_bn and len(self._multiple_devices) == 1 and \
-               hasattr(training_network.convnet, "record_mode"):
+               hasattr(self._network.convnet, "record_mode"):
                 logger.info("Recording BN means & vars for MCBN...")
-                training_network.convnet.clear_records()
-                training_network.convnet.record_mode()
+                self._network.convnet.clear_records()
+                self._network.convnet.record_mode()
+                recording_bn = True
 
             prog_bar = tqdm(
                 train_loader,
@@ -222,27 +314,49 @@ class ICarl(IncrementalLearner):
             for i, input_dict in enumerate(prog_bar, start=1):
                 inputs, targets = input_dict["inputs"], input_dict["targets"]
                 memory_flags = input_dict["memory_flags"]
+                if "indexes" in input_dict:  # Determinist augmentations, see the teacher cache.
+                    sample_keys = (input_dict["indexes"].numpy(), input_dict["aug_slots"].numpy())
+                else:
+                    sample_keys = None
 
                 if grad is not None:
                     _clean_list(grad)
                     _clean_list(act)
 
-                self._optimizer.zero_grad()
-                loss = self._forward_loss(
-                    training_network,
-                    inputs,
-                    targets,
-                    memory_flags,
-                    gradcam_grad=grad,
-                    gradcam_act=act
-                )
-                loss.backward()
-                self._optimizer.step()
+                # MCBN records the BN statistics of each batch, in Python:
+                forward_loss = self._forward_loss_terms
+                if compiled_forward_loss is not None and not recording_bn:
+                    forward_loss = compiled_forward_loss
+                    batch_size = batch_size or len(inputs)
+                    inputs, targets, memory_flags, sample_keys = self._get_static_batch(
+                        batch_size, inputs, targets, memory_flags, sample_keys
+                    )
+
+                stepped = inputs is not None
+                if stepped:
+                    self._optimizer.zero_grad()
+                    loss = self._step_loss(
+                        forward_loss,
+                        training_network,
+                        inputs,
+                        targets,
+                        memory_flags,
+                        gradcam_grad=grad,
+                        gradcam_act=act,
+                        sample_keys=sample_keys
+                    )
+                    self._backward_step(loss)
 
-                if clipper:
-                    training_network.apply(clipper)
+                    if clipper:
+                        training_network.apply(clipper)
 
-                self._print_metrics(prog_bar, epoch, nb_epochs, i)
+                if (stepped and self._metrics.step()) or i == len(train_loader) or \
+                   self._is_refreshing(prog_bar):
+                    self._metrics.reduce()
+                    self._print_metrics(prog_bar, epoch, nb_epochs, max(self._metrics.nb_steps, 1))
+
+            for metric_name, metric_value in self._metrics.means().items():
+                self._epoch_metrics[metric_name].append(metric_value)
 
             if self._scheduler:
                 self._scheduler.step(epoch)
@@ -252,8 +366,9 @@ class ICarl(IncrementalLearner):
                 self._data_memory, self._targets_memory, self._herding_indexes, self._class_means = self.build_examplars(
                     self.inc_dataset, self._herding_indexes
                 )
-                ytrue, ypred = self._eval_task(val_loader)
-                acc = 100 * round((ypred == ytrue).sum() / len(ytrue), 3)
+                counts = metrics.StreamingAccuracy(self._n_classes)
+                self.eval_task(val_loader, accuracy=counts)
+                acc = 100 * counts.accuracy()
                 logger.info("Val accuracy: {}".format(acc))
                 self._network.train()
 
@@ -271,10 +386,151 @@ class ICarl(IncrementalLearner):
         if self._eval_every_x_epochs:
             logger.info("Best accuracy reached at epoch {} with {}%.".format(best_epoch, best_acc))
 
-        if len(self._multiple_devices) == 1 and hasattr(training_network.convnet, "record_mode"):
-            training_network.convnet.normal_mode()
+        if len(self._multiple_devices) == 1 and hasattr(self._network.convnet, "record_mode"):
+            self._network.convnet.normal_mode()
+        for handle in gradcam_handles:
+            handle.remove()
+        distributed.broadcast_buffers(self._network)
+
+    @property
+    def _autocast_dtype(self):
+        if not self._mixed_precision:
+            return None
+        if isinstance(self._mixed_precision, str):
+            return getattr(torch, self._mixed_precision)
+        return torch.float16 if self._device.type == "cuda" else torch.bfloat16
+
+    def _autocast(self):
+        """Context of the forward & losses, in mixed precision if enabled.
+
+        The `mixed_precision` option is either True, for float16 on GPU and
+        bfloat16 on CPU, or the name of the dtype to use.
+        """
+        if not self._mixed_precision:
+            return contextlib.nullcontext()
+        return torch.autocast(self._device.type, dtype=self._autocast_dtype)
+
+    def _step_loss(self, forward_loss, *args, **kwargs):
+        """Runs the forward & losses of a step, then adds its loss terms to
+        the running metrics.
+
+        During the forward, `self._metrics` is a plain dict only collecting
+        the terms of the step, see `_log_metric`. Compiled, the running
+        metrics are thus updated outside of the graph.
+
+        :param forward_loss: `_forward_loss_terms`, compiled or not.
+        :return: The loss.
+        """
+        running_metrics, self._metrics = self._metrics, {}
+        try:
+            with self._autocast():
+                loss, loss_terms = forward_loss(*args, **kwargs)
+        finally:
+            self._metrics = running_metrics
+
+        for name, value in loss_terms.items():
+            self._metrics[name] += value
+        return loss
+
+    def _forward_loss_terms(self, *args, **kwargs):
+        """`_forward_loss`, also returning the loss terms it logged.
+
+        :return: The loss, and a dict of its detached float32 terms.
+        """
+        loss = self._forward_loss(*args, **kwargs)
+        return loss, dict(self._metrics)
+
+    def _log_metric(self, name, value):
+        """Adds a loss term of the step to `self._metrics`.
+
+        The first value is stored as a float32 copy, and not added to 0.:
+        compiled, `0. + loss.detach()` is simplified to the loss itself, and
+        the graph then returns the loss without its autograd graph.
+        """
+        value = value.detach().to(torch.float32, copy=True)
+        if name in self._metrics:
+            value = self._metrics[name] + value
+        self._metrics[name] = value
+
+    def _backward_step(self, loss):
+        """Backward, gradients clipping & optimizer step, with loss scaling
+        under float16 mixed precision.
+
+        The loss terms are checked on device, and only read back when the
+        metrics are reduced.
+        """
+        if self._grad_scaler is None:
+            loss.backward()
+            self._clip_gradients()
+            self._optimizer.step()
+            return
+
+        self._grad_scaler.scale(loss).backward()
+        self._clip_gradients()
+        self._grad_scaler.step(self._optimizer)
+        self._grad_scaler.update()
+
+    def _clip_gradients(self):
+        """Clamps all gradients in [-grad_clip, grad_clip], after the backward.
+
+        `clip_grad_value_` clamps the gradients of all parameters in place,
+        replacing the per-parameter hooks. Under float16 mixed precision, the
+        gradients are unscaled first.
+        """
+        if self._grad_clip is None:
+            return
+
+        if self._grad_scaler is not None:
+            self._grad_scaler.unscale_(self._optimizer)
+        torch.nn.utils.clip_grad_value_(self._network.parameters(), self._grad_clip)
+
+    def _get_compiled_forward_loss(self):
+        """Compiles the forward & losses, if enabled by the `compile` option.
+
+        The option is a dict with the `torch.compile` "mode", e.g.
+        "reduce-overhead" for CUDA graphs, and "last_batch", either "drop" or
+        "pad", so that all batches have the same shape. Gradcam distillation
+        isn't compiled, as it runs backwards during the forward.
+        """
+        if not self._compile_config:
+            return None
+        if getattr(self._network, "gradcam_hook", False):
+            logger.warning("Gradcam distillation is not compiled.")
+            return None
+
+        # The classifier has grown since the previous task, thus so have the graphs:
+        torch.compiler.reset()
+        return torch.compile(
+            self._forward_loss_terms,
+            mode=self._compile_config.get("mode", "default"),
+            dynamic=False
+        )
+
+    def _get_static_batch(self, batch_size, inputs, targets, memory_flags, sample_keys):
+        """Gives a smaller batch, usually the last one, the shape of the others.
+
+        It is either dropped, with None inputs, or padded with its first
+        samples, whose teacher outputs are then not cached.
+        """
+        if len(inputs) == batch_size:
+            return inputs, targets, memory_flags, sample_keys
+        if self._compile_config.get("last_batch", "drop") == "drop":
+            return None, None, None, None
+
+        indexes = torch.arange(batch_size) % len(inputs)
+        return inputs[indexes], targets[indexes], memory_flags[indexes], None
+
+    def _is_refreshing(self, prog_bar):
+        """Whether the progress bar is due for a refresh, at most every `mininterval`.
+
+        The metrics are accumulated on device and only reduced at that time.
+        """
+        if prog_bar.disable:
+            return False
+        return time.time() - self._last_refresh >= prog_bar.mininterval
 
     def _print_metrics(self, prog_bar, epoch, nb_epochs, nb_batches):
+        self._last_refresh = time.time()
         pretty_metrics = ", ".join(
             "{}: {}".format(metric_name, round(metric_value / nb_batches, 3))
             for metric_name, metric_value in self._metrics.items()
@@ -294,22 +550,33 @@ class ICarl(IncrementalLearner):
         memory_flags,
         gradcam_grad=None,
         gradcam_act=None,
+        sample_keys=None,
         **kwargs
     ):
         inputs, targets = inputs.to(self._device), targets.to(self._device)
         onehot_targets = utils.to_onehot(targets, self._n_classes).to(self._device)
 
-        outputs = training_network(inputs)
+        if self._fused_teacher and self._old_model is not None and (
+            self._teacher_cache is None or sample_keys is None
+        ):
+            outputs, old_outputs = teacher.fused_forward(
+                training_network,
+                self._old_model,
+                inputs,
+                collapse_channels=self._teacher_collapse_channels
+            )
+            outputs["old_outputs"] = old_outputs
+        else:
+            outputs = training_network(inputs)
         if gradcam_act is not None:
             outputs["gradcam_gradients"] = gradcam_grad
             outputs["gradcam_activations"] = gradcam_act
+        if sample_keys is not None:
+            outputs["sample_keys"] = sample_keys
 
         loss = self._compute_loss(inputs, outputs, targets, onehot_targets, memory_flags)
 
-        if not utils.check_loss(loss):
-            raise ValueError("A loss is NaN: {}".format(self._metrics))
-
-        self._metrics["loss"] += loss.item()
+        self._log_metric("loss", loss)
 
         return loss
 
@@ -320,16 +587,24 @@ class ICarl(IncrementalLearner):
         self._data_memory, self._targets_memory, self._herding_indexes, self._class_means = self.build_examplars(
             inc_dataset, self._herding_indexes
         )
+        self._feature_cache = None
 
     def _after_task(self, inc_dataset):
         self._old_model = self._network.copy().freeze().to(self._device)
         self._network.on_task_end()
+        if self._teacher_cache is not None:
+            self._teacher_cache.reset(0)
         # self.plot_tsne()
 
     def _compute_confusion_matrix(self):
         use_validation = self._validation_percent > 0.
+        new_classes = list(range(self._n_classes - self._task_size, self._n_classes))
+        if not use_validation and self._nme_evaluation:
+            self._last_results = self._compute_cached_confusion(new_classes)
+            return
+
         _, loader = self.inc_dataset.get_custom_loader(
-            list(range(self._n_classes - self._task_size, self._n_classes)),
+            new_classes,
             memory=self.get_val_memory() if use_validation else self.get_memory(),
             mode="test",
             data_source="val" if use_validation else "train"
@@ -337,6 +612,32 @@ class ICarl(IncrementalLearner):
         ypreds, ytrue = self._eval_task(loader)
         self._last_results = (ypreds, ytrue)
 
+    def _compute_cached_confusion(self, new_classes):
+        """Predictions of the train samples of the new classes, from their
+        features then kept in `self._feature_cache` for `build_examplars`.
+
+        Only those samples are ranked by the confusion herding, the memory
+        isn't predicted.
+
+        :return: A tuple of `metrics.TopkPredictions` & targets.
+        """
+        new_features = features_lib.extract_class_features(
+            self._network, self.inc_dataset, new_classes
+        )
+        self._feature_cache = features_lib.FeatureCache("train")
+        self._feature_cache.put(
+            np.concatenate([self.inc_dataset.get_class_indexes(c) for c in new_classes]),
+            new_features.features, new_features.features_flipped
+        )
+
+        class_means = torch.as_tensor(self._class_means, dtype=torch.float64).to(self._device)
+        ypreds = self._nme_predictions(
+            torch.as_tensor(new_features.features).to(self._device),
+            torch.as_tensor(new_features.targets).to(self._device), class_means,
+            class_means.pow(2).sum(dim=1)
+        )
+        return ypreds, new_features.targets
+
     def plot_tsne(self):
         if self.folder_result:
             loader = self.inc_dataset.get_custom_loader([], memory=self.get_memory())[1]
@@ -345,8 +646,15 @@ class ICarl(IncrementalLearner):
                 os.path.join(self.folder_result, "tsne_{}".format(self._task)), embeddings, targets
             )
 
-    def _eval_task(self, data_loader):
-        ypreds, ytrue = self.compute_accuracy(self._network, data_loader, self._class_means)
+    @property
+    def _nme_evaluation(self):
+        """Whether `_eval_task` is the nearest-mean-of-examplars classification."""
+        return type(self)._eval_task is ICarl._eval_task
+
+    def _eval_task(self, data_loader, accuracy=None):
+        ypreds, ytrue = self.compute_accuracy(
+            self._network, data_loader, self._class_means, accuracy=accuracy
+        )
 
         return ypreds, ytrue
 
@@ -360,8 +668,7 @@ class ICarl(IncrementalLearner):
         if self._old_model is None:
             loss = F.binary_cross_entropy_with_logits(logits, onehot_targets)
         else:
-            with torch.no_grad():
-                old_targets = torch.sigmoid(self._old_model(inputs)["logits"])
+            old_targets = torch.sigmoid(self._old_model_outputs(inputs, outputs)["logits"])
 
             new_targets = onehot_targets.clone()
             new_targets[..., :-self._task_size] = old_targets
@@ -373,7 +680,7 @@ class ICarl(IncrementalLearner):
                 inputs, memory_flags, self._network, self._rotations_config
             )
             loss += rotations_loss
-            self._metrics["rot"] += rotations_loss.item()
+            self._log_metric("rot", rotations_loss)
 
         return loss
 
@@ -390,6 +697,32 @@ class ICarl(IncrementalLearner):
 
     def build_examplars(
         self, inc_dataset, herding_indexes, memory_per_class=None, data_source="train"
+    ):
+        if not distributed.is_enabled():
+            return self._select_examplars(
+                inc_dataset, herding_indexes, memory_per_class, data_source
+            )
+
+        # Only the main process extracts the features & selects the examplars:
+        if distributed.is_main_process():
+            data_memory, targets_memory, herding_indexes, class_means = self._select_examplars(
+                inc_dataset, herding_indexes, memory_per_class, data_source
+            )
+            distributed.broadcast_object((herding_indexes, class_means))
+            return data_memory, targets_memory, herding_indexes, class_means
+
+        herding_indexes, class_means = distributed.broadcast_object(None)
+        data_memory, targets_memory = [], []
+        for class_idx, selected_indexes in enumerate(herding_indexes):
+            inputs, targets = inc_dataset.get_class_data(class_idx, data_source=data_source)
+            data_memory.append(inputs[selected_indexes])
+            targets_memory.append(targets[selected_indexes])
+
+        return np.concatenate(data_memory), np.concatenate(targets_memory), herding_indexes, \
+            class_means
+
+    def _select_examplars(
+        self, inc_dataset, herding_indexes, memory_per_class=None, data_source="train"
     ):
         logger.info("Building & updating memory.")
         memory_per_class = memory_per_class or self._memory_per_class
@@ -398,21 +731,24 @@ class ICarl(IncrementalLearner):
         data_memory, targets_memory = [], []
         class_means = np.zeros((self._n_classes, self._network.features_dim))
 
-        for class_idx in range(self._n_classes):
-            # We extract the features, both normal and flipped:
-            inputs, loader = inc_dataset.get_custom_loader(
-                class_idx, mode="test", data_source=data_source
-            )
-            features, targets = utils.extract_features(self._network, loader)
-            features_flipped, _ = utils.extract_features(
-                self._network,
-                inc_dataset.get_custom_loader(class_idx, mode="flip", data_source=data_source)[1]
-            )
+        new_classes_features = []
+
+        # We extract the features, both normal and flipped, of all classes at once:
+        for class_features in features_lib.iter_class_features(
+            self._network,
+            inc_dataset,
+            list(range(self._n_classes)),
+            data_source=data_source,
+            cache=self._feature_cache
+        ):
+            class_idx, features = class_features.class_index, class_features.features
 
             if class_idx >= self._n_classes - self._task_size:
                 # New class, selecting the examplars:
                 if self._herding_selection["type"] == "icarl":
-                    selected_indexes = herding.icarl_selection(features, memory_per_class)
+                    # Herding of all new classes is done at once, after the loop:
+                    new_classes_features.append(class_features)
+                    continue
                 elif self._herding_selection["type"] == "closest":
                     selected_indexes = herding.closest_to_mean(features, memory_per_class)
                 elif self._herding_selection["type"] == "random":
@@ -431,10 +767,16 @@ class ICarl(IncrementalLearner):
                         minimize_confusion=self._herding_selection["minimize_confusion"]
                     )
                 elif self._herding_selection["type"] == "var_ratio":
+                    _, loader = inc_dataset.get_custom_loader(
+                        class_idx, mode="test", data_source=data_source
+                    )
                     selected_indexes = herding.var_ratio(
                         memory_per_class, self._network, loader, **self._herding_selection
                     )
                 elif self._herding_selection["type"] == "mcbn":
+                    _, loader = inc_dataset.get_custom_loader(
+                        class_idx, mode="test", data_source=data_source
+                    )
                     selected_indexes = herding.mcbn(
                         memory_per_class, self._network, loader, **self._herding_selection
                     )
@@ -445,29 +787,59 @@ class ICarl(IncrementalLearner):
 
                 herding_indexes.append(selected_indexes)
 
-            # Reducing examplars:
-            try:
-                selected_indexes = herding_indexes[class_idx][:memory_per_class]
-                herding_indexes[class_idx] = selected_indexes
-            except:
-                import pdb
-                pdb.set_trace()
-
-            # Re-computing the examplar mean (which may have changed due to the training):
-            examplar_mean = self.compute_examplar_mean(
-                features, features_flipped, selected_indexes, memory_per_class
+            self._add_class_to_memory(
+                class_features, herding_indexes, memory_per_class, data_memory, targets_memory,
+                class_means
             )
 
-            data_memory.append(inputs[selected_indexes])
-            targets_memory.append(targets[selected_indexes])
-
-            class_means[class_idx, :] = examplar_mean
+        if len(new_classes_features) > 0:
+            # New classes come last, thus their herding indexes are still appended in order:
+            herding_indexes.extend(
+                herding.icarl_selection_batched(
+                    [class_features.features for class_features in new_classes_features],
+                    memory_per_class,
+                    device=self._device if self._herding_selection.get("on_device") else None
+                )
+            )
+            for class_features in new_classes_features:
+                self._add_class_to_memory(
+                    class_features, herding_indexes, memory_per_class, data_memory,
+                    targets_memory, class_means
+                )
 
         data_memory = np.concatenate(data_memory)
         targets_memory = np.concatenate(targets_memory)
 
         return data_memory, targets_memory, herding_indexes, class_means
 
+    def _add_class_to_memory(
+        self, class_features, herding_indexes, memory_per_class, data_memory, targets_memory,
+        class_means
+    ):
+        class_idx = class_features.class_index
+        inputs, targets = class_features.data, class_features.targets
+        features, features_flipped = class_features.features, class_features.features_flipped
+
+        # Reducing examplars:
+        if class_idx >= len(herding_indexes):
+            raise IndexError(
+                "No herding indexes for class {}, only {} classes were selected.".format(
+                    class_idx, len(herding_indexes)
+                )
+            )
+        selected_indexes = herding_indexes[class_idx][:memory_per_class]
+        herding_indexes[class_idx] = selected_indexes
+
+        # Re-computing the examplar mean (which may have changed due to the training):
+        examplar_mean = self.compute_examplar_mean(
+            features, features_flipped, selected_indexes, memory_per_class
+        )
+
+        data_memory.append(inputs[selected_indexes])
+        targets_memory.append(targets[selected_indexes])
+
+        class_means[class_idx, :] = examplar_mean
+
     def get_memory(self):
         return self._data_memory, self._targets_memory
 
@@ -488,16 +860,56 @@ class ICarl(IncrementalLearner):
         return mean
 
     @staticmethod
-    def compute_accuracy(model, loader, class_means):
-        features, targets_ = utils.extract_features(model, loader)
+    def compute_accuracy(model, loader, class_means, accuracy=None):
+        """Nearest-mean-of-examplars classification, batch per batch on device.
+
+        The scores are the negative squared distances of the normalized
+        features to the class means, of which only the top-k are kept.
+
+        :param accuracy: A `metrics.StreamingAccuracy` updated after each batch.
+        :return: A tuple of `metrics.TopkPredictions` & targets.
+        """
+        # In float64 like scipy's cdist, the expanded distance cancels in float32:
+        class_means = torch.as_tensor(class_means, dtype=torch.float64).to(model.device)
+        class_sq_norms = class_means.pow(2).sum(dim=1)
+
+        predictions, targets = [], []
+
+        state = model.training
+        model.eval()
+        with torch.no_grad():
+            for input_dict in loader:
+                _targets = input_dict["targets"]
+
+                features = model.extract(input_dict["inputs"].to(model.device))
+                predictions.append(
+                    ICarl._nme_predictions(
+                        features, _targets.to(model.device), class_means, class_sq_norms
+                    )
+                )
+                targets.append(_targets.numpy())
+                if accuracy is not None:
+                    accuracy.update(predictions[-1], targets[-1])
+        model.train(state)
+
+        return metrics.TopkPredictions.concatenate(predictions), np.concatenate(targets)
+
+    @staticmethod
+    def _nme_predictions(features, targets, class_means, class_sq_norms):
+        """Nearest-mean-of-examplars predictions of unnormalized features.
 
-        features = (features.T / (np.linalg.norm(features.T, axis=0) + EPSILON)).T
+        :param class_means: The class means, in float64.
+        :param class_sq_norms: Their squared norms.
+        :return: A `metrics.TopkPredictions`.
+        """
+        features = features.double()
+        features = features / (features.norm(dim=1, keepdim=True) + EPSILON)
 
-        # Compute score for iCaRL
-        sqd = cdist(class_means, features, 'sqeuclidean')
-        score_icarl = (-sqd).T
+        # Compute score for iCaRL, -||f - m||^2 expanded to use a matmul:
+        scores = 2 * features @ class_means.T - class_sq_norms[None] \
+                 - features.pow(2).sum(dim=1, keepdim=True)
 
-        return score_icarl, targets_
+        return metrics.TopkPredictions.from_scores(scores, targets)
 
 
 def _clean_list(l):
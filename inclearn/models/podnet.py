@@ -6,7 +6,7 @@ import numpy as np
 import torch
 from torch.nn import functional as F
 
-from inclearn.lib import data, factory, losses, network, utils
+from inclearn.lib import data, distributed, factory, losses, metrics, network, utils
 from inclearn.lib.data import samplers
 from inclearn.models.icarl import ICarl
 
@@ -84,6 +84,15 @@ class PODNet(ICarl):
         self._means = None
 
         self._old_model = None
+        self._teacher_cache = self._get_teacher_cache(args)
+        if self._teacher_cache is not None and (
+            self._perceptual_features or self._perceptual_style or self._gradcam_distil
+        ):
+            raise ValueError("Teacher cache only supports the POD & classification losses.")
+        self._fused_teacher = args.get("fused_teacher", False)
+        if self._fused_teacher and self._gradcam_distil:
+            raise ValueError("Fused teacher forward doesn't support gradcam distillation.")
+        self._set_training_options(args, grad_clip=5.)
 
         self._finetuning_config = args.get("finetuning_config")
 
@@ -108,15 +117,21 @@ class PODNet(ICarl):
             return self._memory_size // self._total_n_classes
         return self._memory_size // self._n_classes
 
+    @property
+    def _teacher_collapse_channels(self):
+        if not self._pod_spatial_config or self._perceptual_features or self._perceptual_style:
+            return None
+        return self._pod_spatial_config.get("collapse_channels", "spatial")
+
+    @property
+    def _old_model_grad(self):
+        return bool(self._gradcam_distil)
+
     def _train_task(self, train_loader, val_loader):
         if self._meta_transfer:
             logger.info("Setting task meta-transfer")
             self.set_meta_transfer()
 
-        for p in self._network.parameters():
-            if p.requires_grad:
-                p.register_hook(lambda grad: torch.clamp(grad, -5., 5.))
-
         logger.debug("nb {}.".format(len(train_loader.dataset)))
 
         if self._meta_transfer.get("clip"):
@@ -212,9 +227,13 @@ class PODNet(ICarl):
         else:
             super()._after_task(inc_dataset)
 
-    def _eval_task(self, test_loader):
+    @property
+    def _nme_evaluation(self):
+        return self._evaluation_type in ("icarl", "nme")
+
+    def _eval_task(self, test_loader, accuracy=None):
         if self._evaluation_type in ("icarl", "nme"):
-            return super()._eval_task(test_loader)
+            return super()._eval_task(test_loader, accuracy=accuracy)
         elif self._evaluation_type in ("softmax", "cnn"):
             ypred = []
             ytrue = []
@@ -226,9 +245,15 @@ class PODNet(ICarl):
                 logits = self._network(inputs)["logits"].detach()
 
                 preds = F.softmax(logits, dim=-1)
-                ypred.append(preds.cpu().numpy())
+                ypred.append(
+                    metrics.TopkPredictions.from_scores(
+                        preds, input_dict["targets"].to(self._device)
+                    )
+                )
+                if accuracy is not None:
+                    accuracy.update(ypred[-1], ytrue[-1])
 
-            ypred = np.concatenate(ypred)
+            ypred = metrics.TopkPredictions.concatenate(ypred)
             ytrue = np.concatenate(ytrue)
 
             self._last_results = (ypred, ytrue)
@@ -305,10 +330,9 @@ class PODNet(ICarl):
             scaled_logits = logits * self._post_processing_type
 
         if self._old_model is not None:
-            with torch.no_grad():
-                old_outputs = self._old_model(inputs)
-                old_features = old_outputs["raw_features"]
-                old_atts = old_outputs["attention"]
+            old_outputs = self._old_model_outputs(inputs, outputs)
+            old_features = old_outputs["raw_features"]
+            old_atts = old_outputs["attention"]
 
         if self._nca_config:
             nca_config = copy.deepcopy(self._nca_config)
@@ -322,10 +346,10 @@ class PODNet(ICarl):
                 class_weights=self._class_weights,
                 **nca_config
             )
-            self._metrics["nca"] += loss.item()
+            self._log_metric("nca", loss)
         elif self._softmax_ce:
             loss = F.cross_entropy(scaled_logits, targets)
-            self._metrics["cce"] += loss.item()
+            self._log_metric("cce", loss)
 
         # --------------------
         # Distillation losses:
@@ -342,7 +366,7 @@ class PODNet(ICarl):
 
                 pod_flat_loss = factor * losses.embeddings_similarity(old_features, features)
                 loss += pod_flat_loss
-                self._metrics["flat"] += pod_flat_loss.item()
+                self._log_metric("flat", pod_flat_loss)
 
             if self._pod_spatial_config:
                 if self._pod_spatial_config.get("scheduled_factor", False):
@@ -360,21 +384,21 @@ class PODNet(ICarl):
                     **self._pod_spatial_config
                 )
                 loss += pod_spatial_loss
-                self._metrics["pod"] += pod_spatial_loss.item()
+                self._log_metric("pod", pod_spatial_loss)
 
             if self._perceptual_features:
                 percep_feat = losses.perceptual_features_reconstruction(
                     old_atts, atts, **self._perceptual_features
                 )
                 loss += percep_feat
-                self._metrics["p_feat"] += percep_feat.item()
+                self._log_metric("p_feat", percep_feat)
 
             if self._perceptual_style:
                 percep_style = losses.perceptual_style_reconstruction(
                     old_atts, atts, **self._perceptual_style
                 )
                 loss += percep_style
-                self._metrics["p_sty"] += percep_style.item()
+                self._log_metric("p_sty", percep_style)
 
             if self._gradcam_distil:
                 top_logits_indexes = logits[..., :-self._task_size].argmax(dim=1)
@@ -388,9 +412,22 @@ class PODNet(ICarl):
 
                 old_logits = old_outputs["logits"]
 
-                logits[
-                    ..., :-self._task_size].backward(gradient=onehot_top_logits, retain_graph=True)
-                old_logits.backward(gradient=onehot_top_logits)
+                if distributed.is_enabled():
+                    # A backward through the DDP network would all-reduce its gradients now,
+                    # thus only the gradients of the last conv are computed:
+                    outputs["gradcam_gradients"] = list(
+                        torch.autograd.grad(
+                            logits[..., :-self._task_size],
+                            outputs["gradcam_activations"][0],
+                            grad_outputs=onehot_top_logits,
+                            retain_graph=True
+                        )
+                    )
+                else:
+                    logits[..., :-self._task_size].backward(
+                        gradient=onehot_top_logits, retain_graph=True
+                    )
+                old_logits.backward(gradient=onehot_top_logits, retain_graph=True)
 
                 if len(outputs["gradcam_gradients"]) > 1:
                     gradcam_gradients = torch.cat(
@@ -423,7 +460,7 @@ class PODNet(ICarl):
                     import pdb
                     pdb.set_trace()
 
-                self._metrics["grad"] += attention_loss.item()
+                self._log_metric("grad", attention_loss)
                 loss += attention_loss
 
                 self._old_model.zero_grad()
@@ -6,7 +6,7 @@ import numpy as np
 import torch
 from torch.nn import functional as F
 
-from inclearn.lib import factory, losses, network, utils
+from inclearn.lib import factory, losses, metrics, network, utils
 from inclearn.models.icarl import ICarl
 
 logger = logging.getLogger(__name__)
@@ -43,6 +43,8 @@ class UCIR(ICarl):
         self._less_forget = args.get("less_forget")
         self._ranking_loss = args.get("ranking_loss")
 
+        self._set_training_options(args, grad_clip=5.)
+
         self._network = network.BasicNet(
             args["convnet"],
             convnet_kwargs=args.get("convnet_config", {}),
@@ -94,9 +96,13 @@ class UCIR(ICarl):
 
         super()._after_task(inc_dataset)
 
-    def _eval_task(self, data_loader):
+    @property
+    def _nme_evaluation(self):
+        return self._eval_type == "nme"
+
+    def _eval_task(self, data_loader, accuracy=None):
         if self._eval_type == "nme":
-            return super()._eval_task(data_loader)
+            return super()._eval_task(data_loader, accuracy=accuracy)
         elif self._eval_type == "cnn":
             ypred = []
             ytrue = []
@@ -108,9 +114,15 @@ class UCIR(ICarl):
                 logits = self._network(inputs)["logits"].detach()
 
                 preds = F.softmax(logits, dim=-1)
-                ypred.append(preds.cpu().numpy())
+                ypred.append(
+                    metrics.TopkPredictions.from_scores(
+                        preds, input_dict["targets"].to(self._device)
+                    )
+                )
+                if accuracy is not None:
+                    accuracy.update(ypred[-1], ytrue[-1])
 
-            ypred = np.concatenate(ypred)
+            ypred = metrics.TopkPredictions.concatenate(ypred)
             ytrue = np.concatenate(ytrue)
 
             self._last_results = (ypred, ytrue)
@@ -145,10 +157,6 @@ class UCIR(ICarl):
             logger.info("Setting task meta-transfer")
             self.set_meta_transfer()
 
-        for p in self._network.parameters():
-            if p.requires_grad:
-                p.register_hook(lambda grad: torch.clamp(grad, -5., 5.))
-
         self._training_step(train_loader, val_loader, 0, self._n_epochs)
 
         if self._finetuning_config and self._task != 0:
@@ -197,7 +205,7 @@ class UCIR(ICarl):
 
         # Classification loss is cosine + learned factor + softmax:
         loss = F.cross_entropy(self._network.post_process(logits), targets)
-        self._metrics["clf"] += loss.item()
+        self._log_metric("clf", loss)
 
         if self._old_model is not None:
             with torch.no_grad():
@@ -214,7 +222,7 @@ class UCIR(ICarl):
                     old_features, features
                 )
                 loss += lessforget_loss
-                self._metrics["lf"] += lessforget_loss.item()
+                self._log_metric("lf", lessforget_loss)
             elif self._use_mimic_score:
                 old_class_logits = logits[..., :self._n_classes - self._task_size]
                 old_class_old_logits = old_logits[..., :self._n_classes - self._task_size]
@@ -222,7 +230,7 @@ class UCIR(ICarl):
                 mimic_loss = F.mse_loss(old_class_logits, old_class_old_logits)
                 mimic_loss *= (self._n_classes - self._task_size)
                 loss += mimic_loss
-                self._metrics["mimic"] += mimic_loss.item()
+                self._log_metric("mimic", mimic_loss)
 
             if self._ranking_loss:
                 ranking_loss = self._ranking_loss["factor"] * losses.ucir_ranking(
@@ -234,6 +242,6 @@ class UCIR(ICarl):
                     margin=self._ranking_loss["margin"]
                 )
                 loss += ranking_loss
-                self._metrics["rank"] += ranking_loss.item()
+                self._log_metric("rank", ranking_loss)
 
         return loss
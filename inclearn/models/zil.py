@@ -1436,14 +1436,17 @@ class ZIL(ICarl):
         else:
             classes = []
 
-        _, loader = self.inc_dataset.get_custom_loader(classes, memory=self.get_memory())
-        real_features = utils.extract_features(self._network, loader)[0]
         if flip:
             _, loader = self.inc_dataset.get_custom_loader(
-                classes, memory=self.get_memory(), mode="flip"
+                classes, memory=self.get_memory(), mode="test_flip"
+            )
+            real_features, real_features_flipped, _ = utils.extract_features_with_flip(
+                self._network, loader
             )
-            real_features_flipped = utils.extract_features(self._network, loader)[0]
             real_features = np.concatenate((real_features, real_features_flipped))
+        else:
+            _, loader = self.inc_dataset.get_custom_loader(classes, memory=self.get_memory())
+            real_features = utils.extract_features(self._network, loader)[0]
 
         real_features = torch.tensor(real_features).float().to(self._device)
         real_targets = torch.zeros(len(real_features)).long().to(self._device)
@@ -1527,14 +1530,17 @@ class ZIL(ICarl):
         else:
             classes = []
 
-        _, loader = self.inc_dataset.get_custom_loader(classes, memory=self.get_memory())
-        real_features = utils.extract_features(self._network, loader)[0]
         if flip:
             _, loader = self.inc_dataset.get_custom_loader(
-                classes, memory=self.get_memory(), mode="flip"
+                classes, memory=self.get_memory(), mode="test_flip"
+            )
+            real_features, real_features_flipped, _ = utils.extract_features_with_flip(
+                self._network, loader
             )
-            real_features_flipped = utils.extract_features(self._network, loader)[0]
             real_features = np.concatenate((real_features, real_features_flipped))
+        else:
+            _, loader = self.inc_dataset.get_custom_loader(classes, memory=self.get_memory())
+            real_features = utils.extract_features(self._network, loader)[0]
         real_targets = np.zeros(len(real_features))
 
         ghost_features = ghost_features.cpu().numpy()
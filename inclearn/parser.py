@@ -49,6 +49,8 @@ def get_parser():
     parser.add_argument("-sampler", "--sampler",
                         help="Elements sampler.")
     parser.add_argument("--data-path", default="/data/douillard/", type=str)
+    parser.add_argument("--image-store-path", default=None, type=str,
+                        help="Memory-map in-RAM datasets (e.g. CIFAR) in this directory.")
 
     # Training related:
     parser.add_argument("-lr", "--lr", default=2., type=float,
@@ -82,7 +84,7 @@ def get_parser():
                         help="Save the network, either the `last` one or"
                              " each `task`'s ones.")
     parser.add_argument("--dump-predictions", default=False, action="store_true",
-                        help="Dump the predictions and their ground-truth on disk.")
+                        help="Dump the top-5 predictions and their ground-truth on disk.")
     parser.add_argument("-log", "--logging", choices=["critical", "warning", "info", "debug"],
                         default="info", help="Logging level")
     parser.add_argument("-resume", "--resume", default=None,
@@ -14,12 +14,21 @@ import torch
 import yaml
 from inclearn.lib import factory
 from inclearn.lib import logger as logger_lib
-from inclearn.lib import metrics, results_utils, utils
+from inclearn.lib import distributed, metrics, results_utils, utils
 
 logger = logging.getLogger(__name__)
 
 
 def train(args):
+    distributed.init_process_group(
+        args["device"],
+        backend=args.get("distributed_backend"),
+        timeout=args.get("distributed_timeout")
+    )
+    if not distributed.is_main_process():
+        # The other processes only report warnings:
+        args["logging"] = "warning"
+        args["no_progressbar"] = True
     logger_lib.set_logging_level(args["logging"])
 
     autolabel = _set_up_options(args)
@@ -125,12 +134,13 @@ def _train(args, start_date, class_order, run_id):
         # 4. Eval Task
         # ------------
         logger.info("Eval on {}->{}.".format(0, task_info["max_class"]))
-        ypreds, ytrue = model.eval_task(test_loader)
-        metric_logger.log_task(
-            ypreds, ytrue, task_size=task_info["increment"], zeroshot=args.get("all_test_classes")
+        accuracy = metrics.StreamingAccuracy(metric_logger.nb_classes)
+        ypreds, ytrue = model.eval_task(test_loader, accuracy=accuracy)
+        metric_logger.log_accuracy(
+            accuracy, task_size=task_info["increment"], zeroshot=args.get("all_test_classes")
         )
 
-        if args["dump_predictions"] and args["label"]:
+        if args["dump_predictions"] and args["label"] and distributed.is_main_process():
             os.makedirs(
                 os.path.join(results_folder, "predictions_{}".format(run_id)), exist_ok=True
             )
@@ -140,7 +150,7 @@ def _train(args, start_date, class_order, run_id):
                     str(task_id).rjust(len(str(30)), "0") + ".pkl"
                 ), "wb+"
             ) as f:
-                pickle.dump((ypreds, ytrue), f)
+                pickle.dump(_compact_predictions(ypreds, ytrue), f)
 
         if args["label"]:
             logger.info(args["label"])
@@ -188,7 +198,7 @@ def _train(args, start_date, class_order, run_id):
     logger.info(
         "Average Incremental Accuracy: {}.".format(results["results"][-1]["incremental_accuracy"])
     )
-    if args["label"] is not None:
+    if args["label"] is not None and distributed.is_main_process():
         results_utils.save_results(
             results, args["label"], args["model"], start_date, run_id, args["seed"]
         )
@@ -232,7 +242,7 @@ def _after_task(config, model, inc_dataset, run_id, task_id, results_folder):
 
     model.after_task(inc_dataset)
 
-    if config["label"] and (
+    if config["label"] and distributed.is_main_process() and (
         config["save_model"] == "task" or
         (config["save_model"] == "last" and task_id == inc_dataset.n_tasks - 1) or
         (config["save_model"] == "first" and task_id == 0)
@@ -327,3 +337,15 @@ def _aggregate_results(list_results):
     if len(list_results) > 1:
         res = res + " +/- " + str(round(statistics.stdev(list_results) * 100, 2))
     return res
+
+
+def _compact_predictions(ypreds, ytrue):
+    """Keeps the top-k predictions to dump, instead of all the scores."""
+    if not isinstance(ypreds, metrics.TopkPredictions):
+        ypreds = metrics.TopkPredictions.from_scores(
+            torch.as_tensor(ypreds), torch.as_tensor(ytrue)
+        )
+
+    predictions = ypreds.as_dict()
+    predictions["targets"] = ytrue
+    return predictions
@@ -0,0 +1,45 @@
+import torch
+import torch.nn.functional as F
+
+from inclearn.lib.data import batch_transforms
+
+
+def test_random_crop():
+    x = torch.rand(8, 3, 32, 32)
+
+    torch.manual_seed(1)
+    crops = batch_transforms.RandomCrop(32, padding=4)(x)
+
+    torch.manual_seed(1)
+    top, left = torch.randint(0, 9, (8,)), torch.randint(0, 9, (8,))
+    padded = F.pad(x, (4, 4, 4, 4))
+
+    for i in range(8):
+        assert torch.equal(crops[i], padded[i, :, top[i]:top[i] + 32, left[i]:left[i] + 32])
+
+
+def test_random_horizontal_flip():
+    x = torch.rand(16, 3, 8, 8)
+    flipped = batch_transforms.RandomHorizontalFlip()(x)
+
+    for i in range(16):
+        assert torch.equal(flipped[i], x[i]) or torch.equal(flipped[i], x[i].flip(-1))
+
+
+def test_determinist():
+    transform = batch_transforms.Compose(
+        [
+            batch_transforms.RandomCrop(32, padding=4),
+            batch_transforms.RandomHorizontalFlip(),
+            batch_transforms.ColorJitter(brightness=63 / 255),
+            batch_transforms.Normalize((0.5, 0.5, 0.5), (0.25, 0.25, 0.25))
+        ]
+    )
+    x = torch.rand(8, 3, 32, 32)
+
+    torch.manual_seed(1)
+    a = transform(x)
+    torch.manual_seed(1)
+    b = transform(x)
+
+    assert torch.equal(a, b)
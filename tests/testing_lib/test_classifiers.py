@@ -0,0 +1,162 @@
+import copy
+
+import numpy as np
+import pytest
+import torch
+from torch.nn import functional as F
+
+from inclearn.lib import utils
+from inclearn.lib.network import classifiers
+
+
+def test_cosine_classifier_weights_storage():
+    torch.manual_seed(1)
+    classifier = classifiers.CosineClassifier(
+        16, torch.device("cpu"), proxy_per_class=2, distance="neg_stable_cosine_distance"
+    )
+    classifier.add_classes(5)
+    first_weights = classifier.new_weights
+    optimizer = torch.optim.SGD(classifier.parameters(), lr=0.1)
+
+    for n_classes in (3, 10, 1):
+        classifier.add_classes(n_classes)
+        classifier.add_custom_weights(torch.randn(2, 16))
+
+    assert classifier._weights[0] is first_weights
+    assert len(classifier._weights_storage) >= len(classifier.weights) == 2 * 19 + 2 * 3
+    assert classifier._is_packed()
+    assert torch.equal(classifier.weights, torch.cat(list(classifier._weights)))
+
+    classifier(torch.randn(4, 16))["logits"].sum().backward()
+    for weights in classifier._weights:
+        assert weights.grad.shape == weights.shape
+
+    # The optimizer updates the parameters, i.e. the storage:
+    before = first_weights.detach().clone()
+    optimizer.step()
+    assert not torch.equal(first_weights, before)
+    assert torch.equal(classifier.weights[:10], first_weights)
+
+    copied = copy.deepcopy(classifier)
+    assert copied._is_packed()
+    assert torch.equal(copied.weights, classifier.weights)
+
+
+def _reference_merge_similarities(self, raw_similarities):
+    if self.proxy_per_class > 1:
+        simi_per_class = raw_similarities.view(len(raw_similarities), -1, self.proxy_per_class)
+        if self.merging == "mean":
+            return simi_per_class.mean(-1)
+        elif self.merging == "softmax":
+            attentions = F.softmax(self.gamma * simi_per_class, dim=-1)
+            return (simi_per_class * attentions).sum(-1)
+        elif self.merging == "max":
+            return simi_per_class.max(-1)[0]
+        return simi_per_class.min(-1)[0]
+
+    similarities = raw_similarities
+    qt = self._negative_weights.shape[0]
+    if isinstance(self.negative_weights_bias, float):
+        similarities[..., -qt:] = torch.clamp(
+            similarities[..., -qt:] - self.negative_weights_bias, min=0
+        )
+    elif self.negative_weights_bias in ("min", "max"):
+        if self.negative_weights_bias == "min":
+            bound = similarities[..., :-qt].min(dim=1, keepdim=True)[0]
+        else:
+            bound = similarities[..., :-qt].max(dim=1, keepdim=True)[0] - 1e-6
+        similarities = torch.min(
+            similarities, torch.cat((similarities[..., :-qt], bound.repeat(1, qt)), dim=1)
+        )
+    else:
+        topk = int(self.negative_weights_bias.replace("top_", ""))
+        indexes = (-similarities[..., -qt:]).topk(min(qt - topk, qt), dim=1)[1]
+        similarities[..., -qt:].scatter_(1, indexes, 0.)
+    return similarities
+
+
+@pytest.mark.parametrize(
+    "proxy_per_class,merging,negative_weights_bias", [
+        (10, "softmax", None),
+        (10, "mean", None),
+        (10, "max", None),
+        (10, "min", None),
+        (1, "softmax", 0.5),
+        (1, "softmax", "min"),
+        (1, "softmax", "max"),
+        (1, "softmax", "top_2"),
+    ]
+)
+def test_cosine_classifier_merging(proxy_per_class, merging, negative_weights_bias, monkeypatch):
+    torch.manual_seed(2)
+    classifier = classifiers.CosineClassifier(
+        32,
+        torch.device("cpu"),
+        proxy_per_class=proxy_per_class,
+        distance="stable_cosine_distance",
+        merging=merging,
+        gamma=2.,
+        negative_weights_bias=negative_weights_bias,
+        train_negative_weights=True
+    )
+    classifier.add_classes(20)
+    if negative_weights_bias is not None:
+        classifier.set_negative_weights(torch.randn(5, 32))
+    features = torch.randn(8, 32, requires_grad=True)
+
+    def forward():
+        outputs = classifier(features)
+        logits = outputs["logits"]
+        grads = torch.autograd.grad(logits.pow(2).sum(), [features, *classifier.parameters()])
+        return (logits, outputs["raw_logits"].detach(), *grads)
+
+    outputs = forward()
+    monkeypatch.setattr(
+        classifiers.CosineClassifier, "_merge_similarities", _reference_merge_similarities
+    )
+    reference_outputs = forward()
+
+    for output, reference_output in zip(outputs, reference_outputs):
+        assert torch.allclose(output, reference_output, atol=1e-5)
+
+
+def test_mc_cosine_classifier():
+    torch.manual_seed(3)
+    classifier = classifiers.MCCosineClassifier(
+        32, torch.device("cpu"), proxy_per_class=2, dropout=0.5, nb_samples=7
+    )
+    classifier.add_classes(30)
+    classifier.eval()
+    features = torch.randn(8, 32)
+
+    outputs = classifier(features)
+    assert outputs["logits"].shape == (8, 30)
+    assert outputs["var_ratio"].shape == (8,)
+
+    classifier._dropout = 0.
+    outputs = classifier(features)
+    logits = classifiers.CosineClassifier.forward(classifier, features)["logits"]
+    assert torch.allclose(outputs["logits"], logits, atol=1e-6)
+    assert (outputs["var_ratio"] == 0.).all()
+
+
+def test_variation_ratio():
+    rng = np.random.RandomState(4)
+    predictions = rng.randint(0, 30, size=(50, 9))
+
+    var_ratios = utils.variation_ratio(torch.tensor(predictions), 30)
+
+    modes = np.array([np.bincount(row, minlength=30).max() for row in predictions])
+    np.testing.assert_allclose(var_ratios.numpy(), 1. - modes / 9, rtol=1e-6)
+
+
+def test_cosine_classifier_align_weights_i_to_j():
+    torch.manual_seed(5)
+    classifier = classifiers.CosineClassifier(16, torch.device("cpu"))
+    classifier.add_classes(4)
+    classifier.add_classes(4)
+    weights = classifier.weights.detach().clone()
+
+    classifier.align_weights_i_to_j(list(range(4)), list(range(4, 8)))
+
+    assert torch.equal(classifier.weights, weights)
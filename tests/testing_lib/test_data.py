@@ -1,6 +1,32 @@
+import types
+
+import numpy as np
 import pytest
+import torch
+from PIL import Image
+from torch import nn
+
+from inclearn.lib import data, utils
+from inclearn.lib.data import incdataset
+
 
-from inclearn.lib import data
+def _get_inc_dataset(
+    monkeypatch, targets, batch_size=4, class_order=None, dataset_name="random"
+):
+    """An incremental dataset of random 4x4 images, whose class i is the i-th."""
+    rnd_state = np.random.RandomState(0)
+    targets = np.asarray(targets)
+    images = rnd_state.randint(0, 256, (len(targets), 4, 4, 3), dtype=np.uint8)
+
+    class _Dataset(data.DataHandler):
+
+        def base_dataset(self, data_path, train=True, download=False):
+            return types.SimpleNamespace(data=images, targets=targets, class_order=class_order)
+
+    monkeypatch.setattr(incdataset, "_get_dataset", lambda dataset_name: _Dataset)
+    return data.IncrementalDataset(
+        dataset_name, shuffle=False, workers=0, batch_size=batch_size, increment=2
+    )
 
 
 @pytest.mark.parametrize("dataset_name,increment,n_tasks", [
@@ -31,3 +57,139 @@ def test_incremental_class(dataset_name, increment, n_tasks):
             assert all(0 <= t.item() < max_c for t in targets)
 
         current_class += increment
+
+
+def test_shards_keep_samples_order(tmp_path):
+    rnd_state = np.random.RandomState(0)
+    targets = [2, 0, 1, 0, 2, 1, 1]
+    paths, images = [], []
+    for i in range(len(targets)):
+        images.append(rnd_state.randint(0, 256, (4, 4 + i, 3), dtype=np.uint8))
+        paths.append(str(tmp_path / "{}.png".format(i)))
+        Image.fromarray(images[-1]).save(paths[-1])
+
+    # Already of the shards size, thus not resized:
+    data.build_shards(paths, targets, str(tmp_path / "shards"), "train", size=4)
+    store = data.ShardStore(str(tmp_path / "shards"), splits=("train",))
+
+    # Same order as the unsharded samples, e.g. for the validation split:
+    assert store.split_targets("train").tolist() == targets
+    for index, image in zip(store.split_indexes("train"), images):
+        assert (store[index] == image).all()
+
+
+def test_test_flip_loader(monkeypatch):
+    inc_dataset = _get_inc_dataset(monkeypatch, np.arange(11) % 4, batch_size=3)
+    network = _Network()
+
+    _, loader = inc_dataset.get_custom_loader([0, 1, 2, 3], mode="test_flip")
+    features, features_flipped, targets = utils.extract_features_with_flip(network, loader)
+
+    # Same as a pass in "test" mode, then another in "flip" mode:
+    _, loader = inc_dataset.get_custom_loader([0, 1, 2, 3], mode="test")
+    reference, reference_targets = utils.extract_features(network, loader)
+    _, loader = inc_dataset.get_custom_loader([0, 1, 2, 3], mode="flip")
+    reference_flipped, _ = utils.extract_features(network, loader)
+
+    assert (targets == reference_targets).all()
+    np.testing.assert_allclose(features, reference)
+    np.testing.assert_allclose(features_flipped, reference_flipped)
+    assert not np.allclose(features, features_flipped)
+
+
+@pytest.mark.parametrize("low_range,high_range", [
+    (0, 1), (3, 4), (5, 6), (0, 6), (2, 5), (4, 3), (-1, 2), (4, 10), (7, 9)
+])
+def test_select_indexes(monkeypatch, low_range, high_range):
+    # Class 3 has no samples:
+    targets = np.random.RandomState(1).choice([0, 1, 2, 4, 5], size=50)
+    inc_dataset = _get_inc_dataset(monkeypatch, targets, class_order=[0, 1, 2, 3, 4, 5])
+
+    for data_source in ("train", "test"):
+        x, y = inc_dataset._get_split(data_source)
+
+        # Same as the previous scan of the whole split:
+        reference = np.where(np.logical_and(y >= low_range, y < high_range))[0]
+        idxes = inc_dataset._select_indexes(data_source, low_range, high_range)
+        assert idxes.tolist() == reference.tolist()
+
+        selected_x, selected_y = inc_dataset._select(data_source, low_range, high_range)
+        assert (selected_x == x[reference]).all() and (selected_y == y[reference]).all()
+
+
+def test_build_class_index():
+    y = np.array([2, 0, 2, 4, 0, 2])
+    sorted_indexes, offsets = data.IncrementalDataset._build_class_index(y, 5)
+
+    assert offsets.tolist() == [0, 2, 2, 5, 5, 6]
+    for class_index in range(5):
+        class_indexes = sorted_indexes[offsets[class_index]:offsets[class_index + 1]]
+        assert class_indexes.tolist() == np.where(y == class_index)[0].tolist()
+
+
+def test_map_new_class_index():
+    # The first occurrence of a class in the order is its new index:
+    order = [3, 1, 3, 0]
+    new_y = data.IncrementalDataset._map_new_class_index([0, 1, 3, 3, 0], order)
+    assert new_y.tolist() == [3, 1, 0, 0, 3]
+
+    assert len(data.IncrementalDataset._map_new_class_index([], order)) == 0
+    with pytest.raises(ValueError):
+        data.IncrementalDataset._map_new_class_index([0, 2, 1], order)
+    with pytest.raises(ValueError):
+        data.IncrementalDataset._map_new_class_index([5], order)
+
+
+def test_map_new_class_index_concatenated_datasets(monkeypatch):
+    # Classes 2, 0 & 1 become 0, 1 & 2, then 3, 4 & 5 in the second dataset:
+    targets = [0, 0, 1, 2, 2, 2]
+    inc_dataset = _get_inc_dataset(
+        monkeypatch, targets, class_order=[2, 0, 1], dataset_name="random-random"
+    )
+
+    assert inc_dataset.increments == [3, 3]
+    for y in (inc_dataset.targets_train, inc_dataset.targets_test):
+        assert np.bincount(y).tolist() == [3, 2, 1, 3, 2, 1]
+
+
+def test_image_store(tmp_path):
+    rnd_state = np.random.RandomState(2)
+    train = rnd_state.randint(0, 256, (10, 4, 4, 3), dtype=np.uint8)
+    test = rnd_state.randint(0, 256, (3, 4, 4, 3), dtype=np.uint8)
+
+    store = data.ImageStore(str(tmp_path))
+    train_indexes, test_indexes = store.add("random_train", train), store.add("random_test", test)
+    assert len(store) == 13 and test_indexes.tolist() == [10, 11, 12]
+    assert all((store[i] == image).all() for i, image in zip(train_indexes, train))
+
+    # Reopened, the files are reused as long as the metadata match:
+    path = tmp_path / "random_train.npy"
+    mtime = path.stat().st_mtime_ns
+    store = data.ImageStore(str(tmp_path))
+    store.add("random_train", train)
+    assert path.stat().st_mtime_ns == mtime
+    assert all((store[i] == image).all() for i, image in zip(train_indexes, train))
+
+    # Same shape but other images, thus rebuilt:
+    other_train = 255 - train
+    store = data.ImageStore(str(tmp_path))
+    store.add("random_train", other_train)
+    assert all((store[i] == image).all() for i, image in zip(train_indexes, other_train))
+
+    # A truncated file is rebuilt too:
+    with open(str(path), "r+b") as f:
+        f.truncate(path.stat().st_size - 1)
+    store = data.ImageStore(str(tmp_path))
+    store.add("random_train", other_train)
+    assert all((store[i] == image).all() for i, image in zip(train_indexes, other_train))
+
+
+class _Network(nn.Module):
+    """Features are the first column of the images, which flipping changes."""
+
+    def __init__(self):
+        super().__init__()
+        self.device = torch.device("cpu")
+
+    def extract(self, x):
+        return x[..., 0].flatten(1)
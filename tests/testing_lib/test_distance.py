@@ -0,0 +1,85 @@
+import pytest
+import torch
+from torch.nn import functional as F
+
+from inclearn.lib import distance
+from inclearn.lib.network import classifiers
+
+
+def _reference_stable_cosine_distance(a, b, squared=True):
+    mat = torch.cat([a, b])
+
+    pairwise_distances_squared = torch.add(
+        mat.pow(2).sum(dim=1, keepdim=True).expand(mat.size(0), -1),
+        torch.t(mat).pow(2).sum(dim=0, keepdim=True).expand(mat.size(0), -1)
+    ) - 2 * (torch.mm(mat, torch.t(mat)))
+
+    pairwise_distances_squared = torch.clamp(pairwise_distances_squared, min=0.0)
+    error_mask = torch.le(pairwise_distances_squared, 0.0)
+
+    if squared:
+        pairwise_distances = pairwise_distances_squared
+    else:
+        pairwise_distances = torch.sqrt(pairwise_distances_squared + error_mask.float() * 1e-16)
+
+    pairwise_distances = torch.mul(pairwise_distances, (error_mask == False).float())
+
+    mask_offdiagonals = 1 - torch.eye(*pairwise_distances.size(), device=pairwise_distances.device)
+    pairwise_distances = torch.mul(pairwise_distances, mask_offdiagonals)
+
+    return pairwise_distances[:a.shape[0], a.shape[0]:]
+
+
+@pytest.mark.parametrize("squared", [True, False])
+def test_stable_cosine_distance(squared):
+    torch.manual_seed(1)
+    a = (3 * F.normalize(torch.randn(32, 64), dim=-1)).requires_grad_()
+    b = 3 * F.normalize(torch.randn(100, 64), dim=-1)
+    b[:4] = a[:4].detach()  # Zero distances.
+    b.requires_grad_()
+    grad_output = torch.randn(32, 100)
+
+    distances = distance.stable_cosine_distance(a, b, squared=squared)
+    grads = torch.autograd.grad(distances, (a, b), grad_output)
+
+    reference_distances = _reference_stable_cosine_distance(a, b, squared=squared)
+    reference_grads = torch.autograd.grad(reference_distances, (a, b), grad_output)
+
+    assert distances.shape == (32, 100)
+    assert torch.allclose(distances, reference_distances, atol=1e-5)
+    for grad, reference_grad in zip(grads, reference_grads):
+        assert torch.allclose(grad, reference_grad, atol=1e-4)
+
+
+def test_stable_cosine_distance_gradcheck():
+    torch.manual_seed(2)
+    a = torch.randn(5, 8, dtype=torch.float64, requires_grad=True)
+    b = torch.randn(7, 8, dtype=torch.float64, requires_grad=True)
+
+    for squared in (True, False):
+        assert torch.autograd.gradcheck(
+            lambda a, b: distance.stable_cosine_distance(a, b, squared), (a, b)
+        )
+
+
+@pytest.mark.parametrize(
+    "distance_type", [
+        "stable_cosine_distance", "neg_stable_cosine_distance", "prelu_stable_cosine_distance",
+        "prelu_neg_stable_cosine_distance"
+    ]
+)
+def test_cosine_classifier_distances(distance_type, monkeypatch):
+    torch.manual_seed(3)
+    classifier = classifiers.CosineClassifier(
+        64, torch.device("cpu"), proxy_per_class=10, distance=distance_type, scaling=3.
+    )
+    classifier.add_classes(20)
+    features = torch.randn(16, 64)
+
+    logits = classifier(features)["logits"]
+    monkeypatch.setattr(
+        classifiers.distance_lib, "stable_cosine_distance", _reference_stable_cosine_distance
+    )
+    reference_logits = classifier(features)["logits"]
+
+    assert torch.allclose(logits, reference_logits, atol=1e-5)
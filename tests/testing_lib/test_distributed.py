@@ -0,0 +1,174 @@
+import os
+import socket
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.utils.data import DataLoader, DistributedSampler
+
+from inclearn import models
+from inclearn.lib import distributed
+from inclearn.lib.data import samplers
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _worker(rank, world_size, port, results):
+    os.environ.update(
+        {
+            "RANK": str(rank),
+            "LOCAL_RANK": str(rank),
+            "WORLD_SIZE": str(world_size),
+            "MASTER_ADDR": "127.0.0.1",
+            "MASTER_PORT": str(port)
+        }
+    )
+    distributed.init_process_group([-1])
+
+    herding_indexes = [np.arange(rank, rank + 3)] if rank == 0 else None
+    herding_indexes = distributed.broadcast_object(herding_indexes)
+
+    dataset = torch.arange(10)
+    loader = DataLoader(dataset, sampler=DistributedSampler(dataset), batch_size=4)
+    distributed.set_epoch(loader, 1)
+    indexes = torch.cat(list(loader)).tolist()
+
+    results[rank] = (herding_indexes[0].tolist(), indexes)
+    dist.destroy_process_group()
+
+
+def test_distributed_gloo():
+    world_size = 2
+    results = mp.Manager().dict()
+    mp.spawn(_worker, args=(world_size, _free_port(), results), nprocs=world_size)
+
+    assert results[0][0] == results[1][0] == [0, 1, 2]
+    # Shards are disjoint & cover the whole dataset:
+    assert sorted(results[0][1] + results[1][1]) == list(range(10))
+
+
+def test_augmentation_seed_sampler_shards():
+    y = np.zeros(11, dtype=np.int64)
+    shards = []
+    for rank in range(2):
+        np.random.seed(rank)  # Processes' global RNGs may differ.
+        sampler = samplers.AugmentationSeedSampler(
+            y, None, batch_size=4, nb_slots=2, rank=rank, world_size=2, seed=3
+        )
+        shards.append([index for batch in sampler for index, _, _ in batch])
+
+    assert len(shards[0]) == len(shards[1]) == 6
+    assert sorted(set(shards[0] + shards[1])) == list(range(11))
+
+
+class _Batches(torch.utils.data.Dataset):
+
+    def __init__(self, nb_samples, nb_classes, nb_old_classes):
+        generator = torch.Generator().manual_seed(0)
+        self.inputs = torch.randn(nb_samples, 3, 32, 32, generator=generator)
+        self.targets = torch.arange(nb_samples) % nb_classes
+        self.memory_flags = (self.targets < nb_old_classes).float()
+
+    def __len__(self):
+        return len(self.inputs)
+
+    def __getitem__(self, index):
+        return {
+            "inputs": self.inputs[index],
+            "targets": self.targets[index],
+            "memory_flags": self.memory_flags[index]
+        }
+
+
+def _training_worker(rank, world_size, port, results):
+    os.environ.update(
+        {
+            "RANK": str(rank),
+            "LOCAL_RANK": str(rank),
+            "WORLD_SIZE": str(world_size),
+            "MASTER_ADDR": "127.0.0.1",
+            "MASTER_PORT": str(port)
+        }
+    )
+    distributed.init_process_group([-1])
+    torch.manual_seed(0)  # Same initial weights in all processes.
+
+    model = models.PODNet(
+        {
+            "device": [torch.device("cpu")],
+            "convnet": "rebuffi",
+            "batch_size": 8,
+            "optimizer": "sgd",
+            "lr": 0.1,
+            "weight_decay": 0.0005,
+            "epochs": 1,
+            "scheduling": "cosine",
+            "lr_decay": 0.1,
+            "memory_size": 20,
+            "no_progressbar": True,
+            "classifier_config": {
+                "type": "cosine",
+                "proxy_per_class": 2,
+                "distance": "neg_stable_cosine_distance"
+            },
+            "postprocessor_config": {
+                "type": "learned_scaling",
+                "initial_value": 1.0
+            },
+            "pod_flat": {
+                "scheduled_factor": 1.0
+            },
+            "pod_spatial": {
+                "scheduled_factor": 3.0,
+                "collapse_channels": "spatial"
+            },
+            "nca": {
+                "margin": 0.6,
+                "scale": 1.,
+                "exclude_pos_denominator": True
+            },
+            "groupwise_factors": {
+                "old_weights": 0.
+            },
+            "weight_generation": {
+                "type": "basic"
+            }
+        }
+    )
+
+    model.inc_dataset = None  # Only used by the imprinted weights.
+
+    for task in range(2):  # Without, then with the old model.
+        dataset = _Batches(32, 2 * (task + 1), 2 * task)
+        loader = DataLoader(dataset, sampler=DistributedSampler(dataset), batch_size=8)
+        model.set_task_info(
+            {
+                "task": task,
+                "total_n_classes": 4,
+                "increment": 2,
+                "n_train_data": len(dataset),
+                "n_test_data": 0,
+                "max_task": 2
+            }
+        )
+        model._before_task(loader, None)
+        model._training_step(loader, None, 0, 1)
+        model._after_task(None)
+
+    results[rank] = [p.detach().clone() for p in model._network.parameters()]
+    dist.destroy_process_group()
+
+
+def test_distributed_training_step_gloo():
+    world_size = 2
+    results = mp.Manager().dict()
+    mp.spawn(_training_worker, args=(world_size, _free_port(), results), nprocs=world_size)
+
+    # The gradients were all-reduced, thus the replicas stayed identical:
+    for p0, p1 in zip(results[0], results[1]):
+        torch.testing.assert_close(p0, p1)
@@ -0,0 +1,183 @@
+import types
+
+import numpy as np
+import pytest
+import torch
+from torch import nn
+
+from inclearn import models
+from inclearn.lib import data, features, utils
+from inclearn.lib.data import incdataset
+
+
+def _get_inc_dataset(monkeypatch, targets, increment=2, batch_size=4, class_order=None):
+    """An incremental dataset of random 4x4 images, whose class i is the i-th."""
+    rnd_state = np.random.RandomState(0)
+    targets = np.asarray(targets)
+    images = rnd_state.randint(0, 256, (len(targets), 4, 4, 3), dtype=np.uint8)
+
+    class _Dataset(data.DataHandler):
+
+        def base_dataset(self, data_path, train=True, download=False):
+            return types.SimpleNamespace(data=images, targets=targets, class_order=class_order)
+
+    monkeypatch.setattr(incdataset, "_get_dataset", lambda dataset_name: _Dataset)
+    return data.IncrementalDataset(
+        "random", shuffle=False, workers=0, batch_size=batch_size, increment=increment
+    )
+
+
+class _Network(nn.Module):
+    """Features are the first column of the images, which flipping changes."""
+
+    def __init__(self):
+        super().__init__()
+        self.device = torch.device("cpu")
+        self.nb_extracted = 0
+
+    def extract(self, x):
+        self.nb_extracted += len(x)
+        return x[..., 0].flatten(1)
+
+
+def test_class_offsets():
+    targets = np.array([3, 3, 0, 2, 2, 2])
+
+    assert features.class_offsets(targets, [3, 1, 0, 2]).tolist() == [0, 2, 2, 3, 6]
+    assert features.class_offsets(np.zeros((0,)), [1, 0]).tolist() == [0, 0, 0]
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, 64])
+def test_iter_class_features(monkeypatch, batch_size):
+    # Class 2 has no samples, and most classes are split across batches:
+    targets = [0, 1, 3, 3, 4, 1, 0, 4, 4, 3, 1, 0, 3]
+    inc_dataset = _get_inc_dataset(
+        monkeypatch, targets, batch_size=batch_size, class_order=[0, 1, 2, 3, 4]
+    )
+    network = _Network()
+    class_indexes = [3, 0, 2, 4, 1]
+
+    class_features = list(features.iter_class_features(network, inc_dataset, class_indexes))
+    assert [f.class_index for f in class_features] == class_indexes
+
+    for f in class_features:
+        assert (f.targets == f.class_index).all()
+        if f.class_index == 2:
+            assert len(f.data) == len(f.features) == len(f.features_flipped) == 0
+            continue
+
+        # Same as the previous extraction, with a loader per class & view:
+        _, loader = inc_dataset.get_custom_loader([f.class_index], mode="test")
+        reference, reference_targets = utils.extract_features(network, loader)
+        _, loader = inc_dataset.get_custom_loader([f.class_index], mode="flip")
+        reference_flipped, _ = utils.extract_features(network, loader)
+
+        assert (f.targets == reference_targets).all()
+        assert (f.data == inc_dataset.get_class_data(f.class_index)[0]).all()
+        np.testing.assert_allclose(f.features, reference)
+        np.testing.assert_allclose(f.features_flipped, reference_flipped)
+
+
+def test_grouped_features(monkeypatch):
+    targets = [0, 1, 3, 3, 4, 1, 0, 4, 4, 3, 1, 0, 3]
+    inc_dataset = _get_inc_dataset(monkeypatch, targets, batch_size=3, class_order=[0, 1, 2, 3, 4])
+    network = _Network()
+
+    grouped = features.extract_class_features(network, inc_dataset, [4, 2, 0], flip=False)
+    assert len(grouped) == 3
+    assert 2 in grouped and 1 not in grouped
+    assert grouped.features_flipped is None
+    assert grouped.offsets.tolist() == [0, 3, 3, 6]
+    assert [f.class_index for f in grouped] == [4, 2, 0]
+
+    assert len(grouped[2].features) == 0
+    for class_index in (4, 0):
+        iterated = next(
+            f for f in features.iter_class_features(
+                network, inc_dataset, [class_index], flip=False
+            )
+        )
+        assert (grouped[class_index].targets == class_index).all()
+        assert grouped[class_index].features_flipped is None
+        np.testing.assert_allclose(grouped[class_index].features, iterated.features)
+
+
+def test_feature_cache():
+    cache = features.FeatureCache()
+    assert cache.get([0]) is None
+
+    cache.put([4, 1], np.array([[4.], [1.]]), np.array([[-4.], [-1.]]))
+    cache.put([2, 4], np.array([[2.], [5.]]), np.array([[-2.], [-5.]]))
+    assert len(cache) == 3
+
+    cached_features, cached_flipped = cache.get([4, 2, 1])
+    assert cached_features[:, 0].tolist() == [5., 2., 1.]
+    assert cached_flipped[:, 0].tolist() == [-5., -2., -1.]
+    assert cache.get([1, 3]) is None
+
+    # Without flipped features, only the features are found:
+    cache.put([3], np.array([[3.]]))
+    assert cache.get([1]) is None
+    assert cache.get([1, 3], flip=False)[0][:, 0].tolist() == [1., 3.]
+
+
+def test_cached_classes_are_not_extracted(monkeypatch):
+    inc_dataset = _get_inc_dataset(monkeypatch, [0, 1, 2, 3, 3, 2, 1, 0, 2, 3, 3])
+    network = _Network()
+
+    reference = features.extract_class_features(network, inc_dataset, [0, 1, 2, 3])
+    assert network.nb_extracted == 2 * 11
+
+    new_classes = features.extract_class_features(network, inc_dataset, [2, 3])
+    cache = features.FeatureCache()
+    cache.put(
+        np.concatenate([inc_dataset.get_class_indexes(c) for c in (2, 3)]), new_classes.features,
+        new_classes.features_flipped
+    )
+
+    network.nb_extracted = 0
+    cached = features.extract_class_features(network, inc_dataset, [0, 1, 2, 3], cache=cache)
+    assert network.nb_extracted == 2 * 4  # Only the samples of classes 0 & 1.
+
+    assert (cached.targets == reference.targets).all()
+    assert (cached.data == reference.data).all()
+    np.testing.assert_allclose(cached.features, reference.features)
+    np.testing.assert_allclose(cached.features_flipped, reference.features_flipped)
+
+
+def test_cached_confusion(monkeypatch):
+    inc_dataset = _get_inc_dataset(monkeypatch, np.arange(40) % 4)
+    model = models.ICarl(
+        {
+            "device": [torch.device("cpu")],
+            "convnet": "rebuffi",
+            "optimizer": "sgd",
+            "lr": 0.1,
+            "weight_decay": 0.0005,
+            "epochs": 1,
+            "scheduling": [1],
+            "lr_decay": 0.1,
+            "memory_size": 20,
+            "fixed_memory": False,
+            "validation": 0.,
+            "herding_selection": {
+                "type": "confusion",
+                "minimize_confusion": True
+            }
+        }
+    )
+    model.inc_dataset = inc_dataset
+    model._n_classes = 4
+    model._task_size = 2
+    model._class_means = np.random.RandomState(1).randn(2, model._network.features_dim)
+
+    ypreds, ytrue = model._compute_cached_confusion([2, 3])
+
+    # Same predictions as the evaluation of the new classes:
+    _, loader = inc_dataset.get_custom_loader([2, 3], mode="test")
+    eval_ypreds, eval_ytrue = model._eval_task(loader)
+    assert (ytrue == eval_ytrue).all()
+    assert (ypreds.target_ranks == eval_ypreds.target_ranks).all()
+
+    cached_features, _ = model._feature_cache.get(inc_dataset.get_class_indexes(3))
+    assert len(cached_features) == 10
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+import torch
+from torch import nn
+
+from inclearn.convnet import my_resnet_mcbn
+from inclearn.lib import herding
+
+
+@pytest.mark.parametrize("nb_classes,nb_examplars,device", [
+    (1, 20, None),
+    (10, 20, None),
+    (10, 500, None),
+    (10, 20, torch.device("cpu")),
+])
+def test_icarl_selection_batched(nb_classes, nb_examplars, device):
+    rnd_state = np.random.RandomState(1)
+    features = [
+        np.abs(rnd_state.randn(rnd_state.randint(5, 300), 64)).astype(np.float32)
+        for _ in range(nb_classes)
+    ]
+
+    batched_indexes = herding.icarl_selection_batched(features, nb_examplars, device=device)
+
+    assert len(batched_indexes) == nb_classes
+    for class_features, indexes in zip(features, batched_indexes):
+        assert (indexes == herding.icarl_selection(class_features, nb_examplars)).all()
+
+
+def test_mcbn_sampling():
+    torch.manual_seed(2)
+    bn = my_resnet_mcbn.MCBatchNorm2d(8)
+    nn.init.normal_(bn.bn.weight)
+    nn.init.normal_(bn.bn.bias)
+    bn.record_mode()
+    for _ in range(5):
+        bn(3 * torch.randn(16, 8, 4, 4) + 1)
+
+    bn.sampling_mode(nb_samples=3)
+    x = torch.randn(3 * 6, 8, 4, 4)
+    torch.manual_seed(3)
+    normed_x = bn(x)
+
+    torch.manual_seed(3)
+    indexes = torch.randint(5, (3,))
+    chunks = zip(x.view(3, 6, 8, 4, 4), normed_x.view(3, 6, 8, 4, 4), indexes)
+    for chunk, normed_chunk, i in chunks:
+        mean = bn.recorded_means[i][None, :, None, None]
+        var = bn.recorded_vars[i][None, :, None, None]
+        reference = (chunk - mean) / torch.sqrt(var + bn.eps)
+        reference = reference * bn.bn.weight[None, :, None, None] + bn.bn.bias[None, :, None, None]
+        assert torch.allclose(normed_chunk, reference, atol=1e-5)
+
+
+def test_mcbn():
+    torch.manual_seed(4)
+    network = _MCBNNetwork()
+    network.eval()
+    network.convnet.record_mode()
+    for _ in range(4):
+        network(torch.randn(16, 3, 8, 8))
+
+    loader = [{"inputs": torch.randn(10, 3, 8, 8)}, {"inputs": torch.randn(7, 3, 8, 8)}]
+    indexes = herding.mcbn(5, network, loader, nb_samples=10, nb_samples_per_forward=4)
+
+    assert len(set(indexes.tolist())) == len(indexes) == 5
+    assert 0 <= indexes.min() and indexes.max() < 17
+    assert network.convnet.bn_1._mode == "normal"
+
+
+class _MCBNNetwork(nn.Module):
+
+    def __init__(self):
+        super().__init__()
+        self.convnet = my_resnet_mcbn.resnet_rebuffi(n=1, nf=4, zero_residual=False)
+        self.classifier = nn.Linear(self.convnet.out_dim, 20)
+        self.device = torch.device("cpu")
+
+    def forward(self, x):
+        return {"logits": self.classifier(self.convnet(x)["features"])}
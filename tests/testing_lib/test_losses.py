@@ -0,0 +1,46 @@
+import pytest
+import torch
+from torch.nn import functional as F
+
+from inclearn.lib import losses
+
+
+def _reference_pod(list_attentions_a, list_attentions_b, collapse_channels="spatial"):
+    loss = 0.
+    for a, b in zip(list_attentions_a, list_attentions_b):
+        a, b = torch.pow(a, 2), torch.pow(b, 2)
+
+        if collapse_channels == "width":
+            a, b = a.sum(dim=2).view(a.shape[0], -1), b.sum(dim=2).view(b.shape[0], -1)
+        elif collapse_channels == "height":
+            a, b = a.sum(dim=3).view(a.shape[0], -1), b.sum(dim=3).view(b.shape[0], -1)
+        else:
+            a = torch.cat(
+                [a.sum(dim=3).view(a.shape[0], -1), a.sum(dim=2).view(a.shape[0], -1)], -1
+            )
+            b = torch.cat(
+                [b.sum(dim=3).view(b.shape[0], -1), b.sum(dim=2).view(b.shape[0], -1)], -1
+            )
+
+        a, b = F.normalize(a, dim=1, p=2), F.normalize(b, dim=1, p=2)
+        loss += torch.mean(torch.frobenius_norm(a - b, dim=-1))
+
+    return loss / len(list_attentions_a)
+
+
+@pytest.mark.parametrize("collapse_channels", ["spatial", "width", "height"])
+def test_pod(collapse_channels):
+    torch.manual_seed(1)
+    shapes = [(8, 16, 32, 32), (8, 32, 16, 16), (8, 64, 8, 8)]
+    old_atts = [torch.rand(shape) for shape in shapes]
+    new_atts = [torch.rand(shape, requires_grad=True) for shape in shapes]
+
+    loss = losses.pod(old_atts, new_atts, collapse_channels=collapse_channels)
+    grads = torch.autograd.grad(loss, new_atts)
+
+    reference_loss = _reference_pod(old_atts, new_atts, collapse_channels=collapse_channels)
+    reference_grads = torch.autograd.grad(reference_loss, new_atts)
+
+    assert abs(loss.item() - reference_loss.item()) < 1e-6
+    for grad, reference_grad in zip(grads, reference_grads):
+        assert (grad - reference_grad).abs().max() < 1e-6
@@ -0,0 +1,150 @@
+import collections
+
+import numpy as np
+import pytest
+import torch
+
+from inclearn import models
+from inclearn.lib import metrics
+from inclearn.models import ull, zil
+
+
+@pytest.mark.parametrize("reduce_every", [None, 1, 3])
+def test_running_metrics(reduce_every):
+    running = metrics.RunningMetrics(reduce_every)
+    legacy = collections.defaultdict(float)
+
+    nb_reductions = 0
+    for step in range(10):
+        loss = torch.tensor(float(step), requires_grad=True) * 2
+        running["loss"] += loss.detach()
+        legacy["loss"] += loss.item()
+        if step % 2 == 0:
+            running["rot"] += (loss / 2).detach()
+            legacy["rot"] += (loss / 2).item()
+        running["float"] += 1.
+        legacy["float"] += 1.
+
+        if running.step():
+            nb_reductions += 1
+            running.reduce()
+
+    assert nb_reductions == (10 // reduce_every if reduce_every else 0)
+
+    running.reduce()
+    assert dict(running.items()) == pytest.approx(dict(legacy))
+    assert running.means()["loss"] == pytest.approx(legacy["loss"] / 10)
+    assert not running["loss"].requires_grad
+
+
+def test_running_metrics_bfloat16():
+    running = metrics.RunningMetrics()
+    for _ in range(1000):
+        running["loss"] += torch.tensor(1.001, dtype=torch.bfloat16)
+
+    assert running["loss"].dtype == torch.float32
+    assert running.reduce()["loss"] == pytest.approx(1000., rel=1e-2)
+
+
+@pytest.mark.parametrize("invalid_term", [float("nan"), float("inf")])
+def test_running_metrics_check(invalid_term):
+    running = metrics.RunningMetrics()
+    running["loss"] += torch.tensor(10.)
+    running["pod"] += torch.tensor(1.)
+    running.step()
+
+    # Only the total loss must be positive:
+    running["loss"] += torch.tensor(1.)
+    running["pod"] += torch.tensor(-0.5)
+    running.step()
+    running.reduce()
+
+    # Found at the next reduction, even once the sum is finite again:
+    running["loss"] += torch.tensor(1.)
+    running["pod"] += torch.tensor(invalid_term)
+    running.step()
+    running["pod"] = torch.tensor(0.)
+    with pytest.raises(ValueError, match=r"\['pod'\]"):
+        running.reduce()
+
+    # The sum stays positive, only the term is invalid:
+    running = metrics.RunningMetrics()
+    running["loss"] += torch.tensor(1.)
+    running.step()
+    running["loss"] += torch.tensor(-0.5)
+    running.step()
+    with pytest.raises(ValueError, match=r"\['loss'\]"):
+        running.reduce()
+
+
+def test_topk_predictions():
+    rng = np.random.RandomState(0)
+    scores = rng.randn(200, 20)
+    ytrue = rng.randint(0, 20, size=200)
+
+    predictions = metrics.TopkPredictions.concatenate(
+        [
+            metrics.TopkPredictions.from_scores(
+                torch.tensor(scores[i:i + 64]), torch.tensor(ytrue[i:i + 64])
+            ) for i in range(0, 200, 64)
+        ]
+    )
+
+    assert predictions.shape == scores.shape
+    for topk in (1, 5):
+        assert metrics.accuracy(predictions, ytrue, topk) == metrics.accuracy(scores, ytrue, topk)
+    assert metrics.accuracy_per_task(predictions, ytrue, task_size=1) == \
+        metrics.accuracy_per_task(scores, ytrue, task_size=1)
+    assert metrics.old_accuracy(predictions, ytrue, 10) == metrics.old_accuracy(scores, ytrue, 10)
+
+    ranks = (-scores).argsort(axis=1).argsort(axis=1)[np.arange(200), ytrue]
+    np.testing.assert_array_equal(predictions.target_ranks, ranks)
+
+    # Unseen classes, in zeroshot evaluation, are ranked last:
+    unseen = metrics.TopkPredictions.from_scores(
+        torch.tensor(scores[:4]), torch.tensor([0, 20, 1, 25])
+    )
+    assert unseen.target_ranks[[1, 3]].tolist() == [20, 20]
+
+
+@pytest.mark.parametrize("batch_size", [None, 32])
+def test_streaming_accuracy(batch_size):
+    rng = np.random.RandomState(1)
+    scores = rng.randn(300, 30)
+    ytrue = rng.randint(0, 30, size=300)
+    scores[np.arange(0, 300, 3), ytrue[::3]] += 2.  # Better than random.
+
+    counts = metrics.StreamingAccuracy(30)
+    for i in range(0, 300, batch_size or 300):
+        counts.update(scores[i:i + (batch_size or 300)], ytrue[i:i + (batch_size or 300)])
+
+    for task_size, topk in ((10, 1), (None, 5), (1, 1)):
+        assert counts.accuracy_per_task(task_size, topk) == \
+            metrics.accuracy_per_task(scores, ytrue, task_size, topk)
+    assert counts.old_accuracy(10) == metrics.old_accuracy(scores, ytrue, 10)
+    assert counts.new_accuracy(10) == metrics.new_accuracy(scores, ytrue, 10)
+
+    logger = metrics.MetricLogger(3, 30, [10, 10, 10])
+    logger.log_task(scores, ytrue, task_size=10)
+    logger.log_task(
+        metrics.TopkPredictions.from_scores(torch.tensor(scores), torch.tensor(ytrue)),
+        ytrue,
+        task_size=10
+    )
+    logger.log_accuracy(counts, task_size=10)
+    for i in (1, 2):
+        assert logger.metrics["accuracy"][0] == logger.metrics["accuracy"][i]
+        assert logger.metrics["accuracy_top5"][0] == logger.metrics["accuracy_top5"][i]
+
+
+@pytest.mark.parametrize("model_class,eval_task_accuracy", [
+    (models.ICarl, True),
+    (models.PODNet, True),
+    (models.UCIR, True),
+    (models.BiC, False),
+    (ull.ULL, False),
+    (zil.ZIL, False),
+])
+def test_eval_task_accuracy(model_class, eval_task_accuracy):
+    # Read from the `_eval_task` signature:
+    assert object.__new__(model_class)._eval_task_accuracy == eval_task_accuracy
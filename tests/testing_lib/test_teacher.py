@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+import torch
+
+from inclearn.convnet import my_resnet
+from inclearn.lib import factory, losses, teacher
+
+
+class FakeTeacher:
+
+    def __init__(self):
+        self.nb_calls = 0
+
+    def __call__(self, inputs):
+        self.nb_calls += 1
+        return {
+            "raw_features": inputs.mean(dim=(2, 3)),
+            "logits": inputs.sum(dim=(1, 2, 3))[:, None].repeat(1, 5),
+            "attention": [inputs, inputs[..., ::2, ::2]]
+        }
+
+
+@pytest.mark.parametrize("max_size,spill", [(10, False), (0.001, True), (0.001, False)])
+def test_teacher_cache(max_size, spill, tmpdir):
+    cache = teacher.TeacherCache(
+        2, max_size=max_size, spill_path=str(tmpdir) if spill else None
+    )
+    cache.reset(16)
+
+    fake_teacher = FakeTeacher()
+    inputs = torch.rand(16, 3, 8, 8)
+    indexes, slots = np.arange(16), np.ones(16, dtype=np.int64)
+
+    for _ in range(2):
+        outputs = cache(fake_teacher, inputs, indexes, slots, collapse_channels="spatial")
+
+        expected = fake_teacher(inputs)
+        fake_teacher.nb_calls -= 1
+        assert torch.allclose(outputs["raw_features"], expected["raw_features"])
+        assert torch.allclose(outputs["logits"], expected["logits"])
+        for pooled, att in zip(outputs["attention"], expected["attention"]):
+            assert torch.allclose(pooled, losses.pod_pooling(att, "spatial"))
+
+    assert fake_teacher.nb_calls == (1 if max_size > 1 or spill else 2)
+    assert len(tmpdir.listdir()) == (1 if spill else 0)
+
+    cache.reset(0)
+    assert len(tmpdir.listdir()) == 0
+
+
+def test_pod_pooled_teacher():
+    old_atts = [torch.rand(4, 3, 8, 8), torch.rand(4, 6, 4, 4)]
+    new_atts = [torch.rand(4, 3, 8, 8), torch.rand(4, 6, 4, 4)]
+    pooled_atts = [losses.pod_pooling(att, "spatial") for att in old_atts]
+
+    assert torch.allclose(losses.pod(old_atts, new_atts), losses.pod(pooled_atts, new_atts))
+
+
+def test_teacher_cache_batch_augmentations():
+    args = {
+        "teacher_cache": {
+            "nb_augmentations": 2
+        },
+        "dataset_transforms": {
+            "batch_augmentations": True
+        }
+    }
+    with pytest.raises(ValueError):
+        factory.get_data(args)
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="Needs CUDA for the side stream.")
+def test_fused_forward():
+    torch.manual_seed(6)
+    device = torch.device("cuda")
+    student = my_resnet.resnet_rebuffi(n=1, nf=4).to(device)
+    old_teacher = my_resnet.resnet_rebuffi(n=1, nf=4).to(device).eval()
+    inputs = torch.rand(8, 3, 32, 32, device=device)
+
+    outputs, teacher_outputs = teacher.fused_forward(
+        student, old_teacher, inputs, collapse_channels="spatial"
+    )
+    torch.cuda.synchronize(device)
+
+    # Same as both forwards one after the other, on the main stream:
+    expected_outputs = student(inputs)
+    expected_teacher_outputs = teacher.teacher_forward(
+        old_teacher, inputs, collapse_channels="spatial"
+    )
+    for name in ("raw_features", "features"):
+        assert torch.allclose(outputs[name], expected_outputs[name])
+        assert torch.allclose(teacher_outputs[name], expected_teacher_outputs[name])
+    for att, expected_att in zip(outputs["attention"], expected_outputs["attention"]):
+        assert torch.allclose(att, expected_att)
+    for att, expected_att in zip(
+        teacher_outputs["attention"], expected_teacher_outputs["attention"]
+    ):
+        assert torch.allclose(att, expected_att)
@@ -0,0 +1,138 @@
+import pytest
+import torch
+
+from benchmarks import training
+from inclearn import models
+from inclearn.lib import metrics
+
+
+def _get_model(**options):
+    args = {
+        "device": [torch.device("cpu")],
+        "convnet": "rebuffi",
+        "optimizer": "sgd",
+        "lr": 0.1,
+        "weight_decay": 0.0005,
+        "epochs": 1,
+        "scheduling": [1],
+        "lr_decay": 0.1,
+        "memory_size": 20,
+        "fixed_memory": False,
+        "validation": 0.,
+        "no_progressbar": True
+    }
+    args.update(options)
+
+    torch.manual_seed(0)  # Same initial weights for all models.
+    model = models.ICarl(args)
+    model.set_task_info(
+        {
+            "task": 0,
+            "total_n_classes": 10,
+            "increment": 10,
+            "n_train_data": 0,
+            "n_test_data": 0,
+            "max_task": 1
+        }
+    )
+    model._before_task(None, None)
+    model._metrics = metrics.RunningMetrics()
+    model._network.train()
+    return model
+
+
+def _gradients(model, inputs, targets, grad_scaler=None):
+    """Gradients of a training step, as `ICarl._training_step` computes them."""
+    model._grad_scaler = grad_scaler
+    model._optimizer.zero_grad()
+    loss = model._step_loss(
+        model._forward_loss_terms, model._network, inputs, targets, torch.zeros(len(targets))
+    )
+    model._backward_step(loss)
+
+    return loss.item(), torch.cat([p.grad.flatten() for p in model._network.parameters()])
+
+
+def _inputs():
+    generator = torch.Generator().manual_seed(1)
+    return torch.rand(8, 3, 32, 32, generator=generator), torch.arange(8) % 10
+
+
+def test_channels_last():
+    inputs, targets = _inputs()
+    loss, grads = _gradients(_get_model(), inputs, targets)
+
+    model = _get_model(convnet_config={"channels_last": True})
+    conv_weight = next(p for p in model._network.convnet.parameters() if p.dim() == 4)
+    assert conv_weight.is_contiguous(memory_format=torch.channels_last)
+    assert model._network._to_memory_format(inputs).is_contiguous(
+        memory_format=torch.channels_last
+    )
+
+    channels_last_loss, channels_last_grads = _gradients(model, inputs, targets)
+    assert channels_last_loss == pytest.approx(loss, rel=1e-5)
+    torch.testing.assert_close(channels_last_grads, grads, rtol=1e-3, atol=1e-5)
+
+
+@pytest.mark.skipif(not hasattr(torch, "autocast"), reason="Needs torch >= 1.10.")
+def test_mixed_precision_bfloat16():
+    inputs, targets = _inputs()
+    loss, grads = _gradients(_get_model(), inputs, targets)
+
+    model = _get_model(mixed_precision="bfloat16", convnet_config={"channels_last": True})
+    assert model._autocast_dtype == torch.bfloat16
+    bf16_loss, bf16_grads = _gradients(model, inputs, targets)
+
+    # bfloat16 keeps about 3 significant digits:
+    assert bf16_loss == pytest.approx(loss, rel=2e-2)
+    assert bf16_grads.dtype == torch.float32
+    assert torch.cosine_similarity(bf16_grads, grads, dim=0) > 0.99
+
+
+@pytest.mark.skipif(not hasattr(torch.amp, "GradScaler"), reason="Needs torch >= 2.3.")
+def test_mixed_precision_float16_grad_scaler():
+    inputs, targets = _inputs()
+    loss, grads = _gradients(_get_model(grad_clip=1e9), inputs, targets)
+
+    model = _get_model(mixed_precision="float16", grad_clip=1e9)
+    grad_scaler = torch.amp.GradScaler("cpu", init_scale=2.**10)
+    fp16_loss, fp16_grads = _gradients(model, inputs, targets, grad_scaler=grad_scaler)
+
+    # The gradients are unscaled before being clipped:
+    assert fp16_loss == pytest.approx(loss, rel=1e-2)
+    assert torch.cosine_similarity(fp16_grads, grads, dim=0) > 0.99
+    assert fp16_grads.norm() == pytest.approx(grads.norm().item(), rel=5e-2)
+
+
+def test_grad_clip():
+    inputs, targets = _inputs()
+    _, grads = _gradients(_get_model(), inputs, targets)
+
+    grad_clip = grads.abs().max().item() / 10
+    _, clipped_grads = _gradients(_get_model(grad_clip=grad_clip), inputs, targets)
+
+    torch.testing.assert_close(clipped_grads, grads.clamp(-grad_clip, grad_clip))
+
+
+@pytest.mark.skipif(not hasattr(torch, "compile"), reason="Needs torch >= 2.0.")
+def test_compiled_forward_loss_without_graph_breaks():
+    model = training.get_model(torch.device("cpu"), compile={"mode": "default"})
+    dataset = training.RandomDataset(8, 100, 50)
+    inputs, targets, memory_flags = dataset.inputs, dataset.targets, dataset.memory_flags
+
+    torch._dynamo.reset()
+    model._metrics = {}
+    explanation = torch._dynamo.explain(model._forward_loss_terms)(
+        model._network, inputs, targets, memory_flags
+    )
+    assert explanation.graph_break_count == 0
+    assert explanation.graph_count == 1
+
+    # The running metrics are updated outside of the graph:
+    model._metrics = metrics.RunningMetrics()
+    loss = model._step_loss(
+        model._get_compiled_forward_loss(), model._network, inputs, targets, memory_flags
+    )
+    assert loss.requires_grad
+    assert set(model._metrics._sums) == {"nca", "flat", "pod", "loss"}
+    assert model._metrics["loss"].item() == pytest.approx(loss.item())